@@ -1,124 +1,518 @@
-from flask import Flask, render_template, request, jsonify, send_file, session, redirect, url_for
+from flask import Blueprint, Flask, current_app, render_template, request, jsonify, send_file, session, redirect, url_for, g, Response, make_response, stream_with_context
 import sqlite3
 import datetime
 import os
-from fpdf import FPDF
+import json
+import base64
+import re
+import queue
+import threading
+import io
+import csv
+import zipfile
 from pathlib import Path
 from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
+from db import ConnectionPool, RowFactory, json_select, json_rows, json_row, clear_json_select_cache
+from migrations import CHANGE_LOG_TABLES, ROLLUPS, migrate, rebuild_rollups
+from cache import ReadCache
+from events import ChangeFeed, EventBroker
+from stock import StockConflict, adjust_stock, apply_entries, begin_write, read_stock
+from numbering import next_document_number
+from invoices import InvoiceRenderer, MergedPdf, RendererBusy, document_hash, render_pages
+from documents import DocumentStore
+from auth import HasherBusy, LoginThrottle, PasswordHasher, UserCache
 
-app = Flask(__name__)
-app.config['DATABASE'] = 'inventory.db'
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+bp = Blueprint('inventory', __name__, cli_group=None)
+
+def create_app(config=None):
+    """Build an app; ``config`` overrides the environment-driven settings below.
+
+    Nothing here touches the database. The schema is migrated and the default
+    admin created when the app first needs a connection, or by init_db(app).
+    """
+    app = Flask(__name__)
+    app.config['DATABASE'] = os.environ.get('DATABASE', 'inventory.db')
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+    app.config['DATABASE_POOL_SIZE'] = int(os.environ.get('DATABASE_POOL_SIZE', 8))
+    app.config['DATABASE_BUSY_TIMEOUT'] = float(os.environ.get('DATABASE_BUSY_TIMEOUT', 5.0))
+    app.config['DATABASE_CACHE_SIZE'] = int(os.environ.get('DATABASE_CACHE_SIZE', -16000))  # negative = KiB
+    app.config['DATABASE_MMAP_SIZE'] = int(os.environ.get('DATABASE_MMAP_SIZE', 128 * 1024 * 1024))
+    app.config['READ_CACHE_SIZE'] = int(os.environ.get('READ_CACHE_SIZE', 256))  # entries; 0 disables
+    app.config['READ_CACHE_MAX_BYTES'] = int(os.environ.get('READ_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+    app.config['READ_CACHE_TTL'] = float(os.environ.get('READ_CACHE_TTL', 30.0))
+    app.config['EVENTS_HEARTBEAT'] = float(os.environ.get('EVENTS_HEARTBEAT', 15.0))  # seconds between keep-alives
+    app.config['EVENTS_POLL_INTERVAL'] = float(os.environ.get('EVENTS_POLL_INTERVAL', 1.0))  # seconds between change_log reads
+    app.config['IMPORT_CHUNK_SIZE'] = int(os.environ.get('IMPORT_CHUNK_SIZE', 500))  # entries per transaction
+    app.config['IMPORT_MAX_ERRORS'] = int(os.environ.get('IMPORT_MAX_ERRORS', 100))  # row errors listed in a response
+    app.config['SYNC_CHUNK_SIZE'] = int(os.environ.get('SYNC_CHUNK_SIZE', 100))  # operations per transaction
+    app.config['SYNC_MAX_OPERATIONS'] = int(os.environ.get('SYNC_MAX_OPERATIONS', 1000))  # per request
+    app.config['SYNC_KEY_RETENTION_DAYS'] = int(os.environ.get('SYNC_KEY_RETENTION_DAYS', 30))
+    app.config['PDF_WORKERS'] = int(os.environ.get('PDF_WORKERS', 2))  # render processes; 0 renders inline
+    app.config['PDF_MAX_PENDING'] = int(os.environ.get('PDF_MAX_PENDING', 8))  # renders queued or running
+    app.config['PDF_WAIT'] = float(os.environ.get('PDF_WAIT', 10.0))  # seconds to wait for a render slot
+    app.config['EXPORT_MAX_DAYS'] = int(os.environ.get('EXPORT_MAX_DAYS', 366))  # longest range one export may cover
+    app.config['DOCUMENT_STORE_DIR'] = os.environ.get('DOCUMENT_STORE_DIR', 'documents')
+    app.config['DOCUMENT_STORE_MAX_BYTES'] = int(os.environ.get('DOCUMENT_STORE_MAX_BYTES', 512 * 1024 * 1024))
+    app.config['DOCUMENT_STORE_MAX_AGE_DAYS'] = float(os.environ.get('DOCUMENT_STORE_MAX_AGE_DAYS', 90))
+    app.config['AUTH_CACHE_TTL'] = float(os.environ.get('AUTH_CACHE_TTL', 5.0))  # seconds a user's role and active flag are trusted
+    app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')  # werkzeug method string
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))  # hashing threads; 0 hashes inline
+    app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 32))  # hashes queued or running
+    app.config['PASSWORD_HASH_WAIT'] = float(os.environ.get('PASSWORD_HASH_WAIT', 10.0))  # seconds to wait for a slot
+    app.config['LOGIN_MAX_FAILURES'] = int(os.environ.get('LOGIN_MAX_FAILURES', 5))  # per username per window; 0 disables
+    app.config['LOGIN_MAX_FAILURES_PER_IP'] = int(os.environ.get('LOGIN_MAX_FAILURES_PER_IP', 20))  # per address per window
+    app.config['LOGIN_THROTTLE_WINDOW'] = float(os.environ.get('LOGIN_THROTTLE_WINDOW', 300.0))  # seconds
+    app.config.update(config or {})
+    app.extensions['db_init_lock'] = threading.Lock()
+    app.teardown_appcontext(release_db_connection)
+    app.register_blueprint(bp)
+    return app
 
 # --- DATABASE SETUP ---
-def dict_factory(cursor, row):
-    d = {}
-    for idx, col in enumerate(cursor.description):
-        d[col[0]] = row[idx]
-    return d
+def get_db_pool():
+    """The app's connection pool, setting up the database on first use."""
+    app = current_app
+    pool = app.extensions.get('db_pool')
+    if pool is None or pool.database != app.config['DATABASE']:
+        with app.extensions['db_init_lock']:
+            pool = app.extensions.get('db_pool')
+            if pool is None or pool.database != app.config['DATABASE']:
+                pool = ConnectionPool(app.config['DATABASE'],
+                                      max_size=app.config['DATABASE_POOL_SIZE'],
+                                      busy_timeout=app.config['DATABASE_BUSY_TIMEOUT'],
+                                      cache_size=app.config['DATABASE_CACHE_SIZE'],
+                                      mmap_size=app.config['DATABASE_MMAP_SIZE'],
+                                      row_factory=RowFactory)
+                prepare_database(pool)
+                app.extensions['db_pool'] = pool
+    return pool
 
 def get_db_connection():
-    conn = sqlite3.connect(app.config['DATABASE'])
-    conn.row_factory = dict_factory
+    """Check out a pooled connection; close() hands it back to the pool.
+
+    Within an app context the same connection is reused until it is closed,
+    and anything still checked out is released when the context tears down.
+    Once closed, the connection may already belong to another thread, so it
+    is only reused while this checkout is still the current one.
+    """
+    conn = g.get('db_conn')
+    if conn is None or conn._owner != threading.get_ident() or conn._lease != g.db_lease:
+        conn = get_db_pool().acquire()
+        g.db_conn, g.db_lease = conn, conn._lease
     return conn
 
-def init_db():
-    conn = get_db_connection()
+def release_db_connection(exc):
+    conn = g.pop('db_conn', None)
+    g.pop('db_lease', None)
+    if conn is not None:
+        conn.close()
+
+def raw_cursor(conn):
+    """Cursor yielding plain tuples, for the json_select() text rows."""
     cursor = conn.cursor()
-    
-    cursor.execute('''CREATE TABLE IF NOT EXISTS products 
-                      (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                       name TEXT UNIQUE, 
-                       quantity INTEGER, 
-                       reorder_level INTEGER, 
-                       price REAL DEFAULT 0, 
-                       brand TEXT)''')
-    
-    cursor.execute('''CREATE TABLE IF NOT EXISTS transactions 
-                      (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                       item_name TEXT, 
-                       quantity INTEGER, 
-                       type TEXT, 
-                       date TEXT, 
-                       time TEXT)''')
-    
-    cursor.execute('''CREATE TABLE IF NOT EXISTS sales 
-                      (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                       sale_num TEXT UNIQUE, 
-                       customer TEXT, 
-                       date TEXT, 
-                       time TEXT, 
-                       total_amount REAL, 
-                       payment_status TEXT)''')
-    
-    cursor.execute('''CREATE TABLE IF NOT EXISTS sale_items 
-                      (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                       sale_num TEXT, 
-                       item_name TEXT, 
-                       quantity INTEGER, 
-                       price REAL, 
-                       total REAL)''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS expenses 
-                      (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                       description TEXT, 
-                       category TEXT, 
-                       amount REAL, 
-                       date TEXT, 
-                       time TEXT, 
-                       notes TEXT)''')
-    
-    # Users Table
-    cursor.execute('''CREATE TABLE IF NOT EXISTS users 
-                      (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                       username TEXT UNIQUE NOT NULL,
-                       password_hash TEXT NOT NULL,
-                       full_name TEXT,
-                       email TEXT,
-                       role TEXT NOT NULL DEFAULT 'staff',
-                       created_at TEXT,
-                       is_active BOOLEAN DEFAULT 1)''')
-
-    # Create default admin if not exists
-    cursor.execute("SELECT * FROM users WHERE username=?", ('admin',))
-    if not cursor.fetchone():
-        admin_hash = generate_password_hash('admin123')
-        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute("""INSERT INTO users (username, password_hash, full_name, email, role, created_at, is_active)
-                         VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                      ('admin', admin_hash, 'Administrator', 'admin@inventory.local', 'admin', created_at, 1))
-        print("Default admin account created.")
-    
-    conn.commit()
+    cursor.row_factory = None
+    return cursor
+
+def json_response(body, status=200):
+    return Response(body, status=status, mimetype='application/json')
+
+# --- CONDITIONAL GET ---
+def data_version(conn, tables):
+    """Strong ETag value for the current contents of ``tables``."""
+    cursor = raw_cursor(conn)
+    placeholders = ','.join('?' * len(tables))
+    cursor.execute(f"SELECT name, version FROM data_versions WHERE name IN ({placeholders})", tables)
+    versions = dict(cursor.fetchall())
+    return '-'.join(f"{versions.get(table, 0)}" for table in tables)
+
+def get_read_cache():
+    cache = current_app.extensions.get('read_cache')
+    if cache is None:
+        cache = ReadCache(max_entries=current_app.config['READ_CACHE_SIZE'],
+                          max_bytes=current_app.config['READ_CACHE_MAX_BYTES'],
+                          ttl=current_app.config['READ_CACHE_TTL'])
+        current_app.extensions['read_cache'] = cache
+    return cache
+
+def invalidate(*tables):
+    """Drop cached responses built from any of ``tables``; call after commit."""
+    get_read_cache().invalidate(*tables)
+
+def conditional(*tables, cache=False):
+    """Answer If-None-Match with 304 while ``tables`` are unchanged.
+
+    The ETag is read before the view runs, so it is never newer than the
+    body it is attached to; a write in between only costs one extra refetch.
+    With ``cache=True`` the rendered body is also kept in the read cache,
+    keyed by path and query parameters and valid only for the same ETag.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            conn = get_db_connection()
+            try:
+                etag = data_version(conn, tables)
+            finally:
+                conn.close()
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                key = (request.path, tuple(sorted(request.args.items(multi=True))))
+                hit = get_read_cache().get(key, etag) if cache else None
+                if hit is not None:
+                    response = Response(hit[0], mimetype=hit[1])
+                else:
+                    response = make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    if cache:
+                        get_read_cache().set(key, etag, response.get_data(), response.mimetype, tables)
+            response.set_etag(etag)
+            # Let browsers and the service worker keep the body, but revalidate every time
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return decorated_function
+    return decorator
+
+# --- CHANGE EVENTS ---
+def get_event_broker():
+    broker = current_app.extensions.get('event_broker')
+    if broker is None:
+        broker = current_app.extensions['event_broker'] = EventBroker()
+    return broker
+
+CHANGE_EVENTS = {'products': 'product', 'transactions': 'transaction', 'sales': 'sale', 'expenses': 'expense'}
+EVENTS_BATCH = 500  # change_log entries read per poll; a longer backlog is sent as a resync
+
+def latest_change():
+    conn = get_db_connection()
+    seq = raw_cursor(conn).execute("SELECT ifnull(max(seq), 0) FROM change_log").fetchone()[0]
     conn.close()
+    return seq
+
+def read_changes(since):
+    """Events for the rows change_log says changed after ``since``, in order.
+
+    Upserts carry the row's current state, deletes ``{"id": ...}``. A
+    backlog of more than EVENTS_BATCH entries becomes a single resync.
+    """
+    conn = get_db_connection()
+    cursor = raw_cursor(conn)
+    conn.execute("BEGIN")
+    try:
+        cursor.execute("SELECT seq, tbl, row_id, deleted FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?",
+                       (since, EVENTS_BATCH + 1))
+        entries = cursor.fetchall()
+        if len(entries) > EVENTS_BATCH:
+            cursor.execute("SELECT max(seq) FROM change_log")
+            return cursor.fetchone()[0], [('resync', '{}')]
+        upserts = {}
+        for seq, table, row_id, deleted in entries:
+            if not deleted:
+                upserts.setdefault(table, []).append(row_id)
+        rows = {}
+        for table, ids in upserts.items():
+            cursor.execute(f"SELECT id, {json_select(conn, table)} FROM {table} WHERE id IN ({','.join('?' * len(ids))})",
+                           ids)
+            rows.update(((table, row_id), row) for row_id, row in cursor)
+        events = []
+        for seq, table, row_id, deleted in entries:
+            if deleted:
+                events.append((f'{CHANGE_EVENTS[table]}_deleted', json.dumps({'id': row_id})))
+            elif (table, row_id) in rows:
+                events.append((CHANGE_EVENTS[table], rows[table, row_id]))
+        return (entries[-1][0] if entries else since), events
+    finally:
+        conn.rollback()
+        conn.close()
+
+def get_change_feed():
+    feed = current_app.extensions.get('change_feed')
+    if feed is None:
+        app = current_app._get_current_object()
+
+        def in_app(func):
+            def call(*args):
+                with app.app_context():
+                    return func(*args)
+            return call
+
+        feed = ChangeFeed(get_event_broker(), in_app(latest_change), in_app(read_changes),
+                          interval=app.config['EVENTS_POLL_INTERVAL'])
+        current_app.extensions['change_feed'] = feed
+    return feed
+
+def notify_changes():
+    """Have this process's change feed pick up a write that just committed."""
+    feed = current_app.extensions.get('change_feed')
+    if feed is not None:
+        feed.wake()
+
+# --- PAGINATION ---
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def encode_cursor(date_val, time_val, row_id):
+    raw = json.dumps([date_val, time_val, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        date_val, time_val, row_id = json.loads(raw)
+        return str(date_val), str(time_val), int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+def list_page(conn, table, conditions, params, date=None):
+    """Newest-first keyset page over (date, time, id), as a JSON response.
+
+    Common query args: ``from``/``to`` (inclusive dates), ``cursor`` (the
+    previous page's X-Next-Cursor header) and ``limit``. Each page seeks
+    straight to the cursor through the (date, time) indexes, so deep pages
+    cost the same as the first one. A single ``date`` is returned whole
+    unless a limit is asked for, as before.
+    """
+    conditions = list(conditions)
+    params = list(params)
+
+    date_from = date or request.args.get('from', '').strip()
+    date_to = date or request.args.get('to', '').strip()
+    token = request.args.get('cursor', '').strip()
+    limit = request.args.get('limit', '').strip()
+
+    if date_from:
+        conditions.append('date >= ?')
+        params.append(date_from)
+    if token:
+        # The cursor is the upper bound from here on; keeping "date <= to"
+        # as well would let SQLite seek on that instead of the cursor.
+        conditions.append('(date, time, id) < (?, ?, ?)')
+        params.extend(decode_cursor(token))
+    elif date_to:
+        conditions.append('date <= ?')
+        params.append(date_to)
+
+    if limit:
+        if not limit.isdigit() or int(limit) <= 0:
+            raise ValueError('Invalid limit')
+        limit = min(int(limit), MAX_PAGE_SIZE)
+    elif not date or token:
+        limit = DEFAULT_PAGE_SIZE
+    else:
+        limit = None
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    query = f"SELECT {json_select(conn, table)}, date, time, id FROM {table} {where} ORDER BY date DESC, time DESC, id DESC"
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit + 1)
+
+    cursor = raw_cursor(conn)
+    rows = cursor.execute(query, params).fetchall()
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last[1], last[2], last[3])
+
+    response = json_response(json_rows(rows))
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+# --- CUSTOMER SEARCH ---
+def fts_prefix_query(text):
+    """FTS5 query matching rows where every word of ``text`` starts a word."""
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{word}"*' for word in words)
+
+def customer_condition(conn, text, mode='prefix'):
+    """WHERE condition (and params) limiting sales to customers matching ``text``.
+
+    ``prefix`` matches the start of each word through sales_customer_fts;
+    ``contains`` matches any substring through the trigram index when it is
+    available and the text is long enough for a trigram.
+    """
+    if mode == 'contains':
+        has_trigram = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name='sales_customer_trigram'").fetchone()
+        if has_trigram and len(text) >= 3:
+            phrase = '"' + text.replace('"', '""') + '"'
+            return ('id IN (SELECT rowid FROM sales_customer_trigram WHERE sales_customer_trigram MATCH ?)',
+                    [phrase])
+        return 'customer LIKE ?', [f'%{text}%']
 
-# Run init_db once
-init_db()
+    query = fts_prefix_query(text)
+    if not query:
+        return 'customer LIKE ?', [f'%{text}%']
+    return 'id IN (SELECT rowid FROM sales_customer_fts WHERE sales_customer_fts MATCH ?)', [query]
+
+# --- WRITE OPERATIONS ---
+# The writes the offline queue can replay are plain functions of (conn, data)
+# that run inside the caller's write transaction and return
+# (payload, tables): the JSON response and the tables to announce as changed
+# once the transaction has committed.
+# They raise ValueError (or StockConflict) to refuse, and never commit.
+
+def announce(tables):
+    invalidate(*tables)
+    notify_changes()
+
+def run_write(operation, data):
+    """Run one write operation in its own transaction and respond with its payload."""
+    conn = get_db_connection()
+    try:
+        begin_write(conn)
+        payload, tables = operation(conn, data)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    announce(tables)
+    conn.close()
+    return jsonify(payload)
+
+def get_password_hasher():
+    hasher = current_app.extensions.get('password_hasher')
+    if hasher is None:
+        hasher = PasswordHasher(method=current_app.config['PASSWORD_HASH_METHOD'],
+                                workers=current_app.config['PASSWORD_HASH_WORKERS'],
+                                max_pending=current_app.config['PASSWORD_HASH_MAX_PENDING'],
+                                wait=current_app.config['PASSWORD_HASH_WAIT'])
+        current_app.extensions['password_hasher'] = hasher
+    return hasher
+
+def get_login_throttle(scope):
+    """Failed sign-in counter per ``'username'`` or per ``'address'``."""
+    key = f'login_throttle_{scope}'
+    throttle = current_app.extensions.get(key)
+    if throttle is None:
+        limit = current_app.config['LOGIN_MAX_FAILURES'] if scope == 'username' else current_app.config['LOGIN_MAX_FAILURES_PER_IP']
+        throttle = LoginThrottle(get_db_connection, scope, max_failures=limit,
+                                 window=current_app.config['LOGIN_THROTTLE_WINDOW'])
+        current_app.extensions[key] = throttle
+    return throttle
+
+def prepare_database(pool):
+    """Apply pending migrations and create the default admin if missing."""
+    conn = pool.acquire()
+    try:
+        migrate(conn)
+        clear_json_select_cache()
+        cursor = conn.cursor()
+
+        # Create default admin if not exists
+        cursor.execute("SELECT * FROM users WHERE username=?", ('admin',))
+        if not cursor.fetchone():
+            admin_hash = get_password_hasher().hash('admin123')
+            created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            # Another worker may be setting up the same database right now
+            cursor.execute("""INSERT OR IGNORE INTO users (username, password_hash, full_name, email, role, created_at, is_active)
+                             VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                          ('admin', admin_hash, 'Administrator', 'admin@inventory.local', 'admin', created_at, 1))
+            if cursor.rowcount:
+                print("Default admin account created.")
+        conn.commit()
+    finally:
+        conn.close()
+
+def init_db(app):
+    """Set up ``app``'s database now instead of on its first request."""
+    with app.app_context():
+        get_db_pool()
+
+def shutdown_app(app):
+    """Let ``app``'s process stop: end its open /api/events streams."""
+    feed = app.extensions.get('change_feed')
+    if feed is not None:
+        feed.close()
+
+@bp.cli.command('init-db')
+def init_db_command():
+    """Apply pending migrations and create the default admin."""
+    init_db(current_app)
+    print("Database ready.")
+
+@bp.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the daily sales and expense rollups from the base tables."""
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        rebuild_rollups(conn)
+        # The summaries are cached and ETagged by their source tables' versions
+        sources = sorted({source for source, _, _ in ROLLUPS.values()})
+        conn.execute(f"UPDATE data_versions SET version = version + 1 WHERE name IN ({','.join('?' * len(sources))})",
+                     sources)
+        conn.commit()
+    finally:
+        conn.close()
+    print("Daily rollups rebuilt.")
+
+@bp.cli.command('prune-documents')
+def prune_documents_command():
+    """Apply the document store's size and age budget now."""
+    store = get_document_store()
+    store.prune()
+    stats = store.stats()
+    print(f"Document store: {stats['bytes']} bytes kept, {stats['evictions']} evicted, {stats['expired']} expired.")
 
 # --- AUTHENTICATION HELPERS ---
+def load_user(user_id):
+    conn = get_db_connection()
+    user = conn.execute('SELECT id, username, full_name, role, is_active FROM users WHERE id = ?',
+                        (user_id,)).fetchone()
+    conn.close()
+    return user
+
+def users_version():
+    conn = get_db_connection()
+    row = raw_cursor(conn).execute("SELECT version FROM data_versions WHERE name = 'users'").fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+def get_user_cache():
+    cache = current_app.extensions.get('user_cache')
+    if cache is None:
+        cache = UserCache(load_user, ttl=current_app.config['AUTH_CACHE_TTL'], version=users_version)
+        current_app.extensions['user_cache'] = cache
+    return cache
+
+def session_user():
+    """The signed-in user's cached record, or None once it is deleted or disabled.
+
+    A session for an account that is gone or deactivated is cleared, so the
+    change takes effect on that user's very next request.
+    """
+    if 'user_id' not in session:
+        return None
+    user = get_user_cache().get(session['user_id'])
+    if not user or not user['is_active']:
+        session.clear()
+        return None
+    return user
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        if session_user() is None:
             if request.path.startswith('/api/'):
                 return jsonify({'success': False, 'error': 'Authentication required'}), 401
-            return redirect(url_for('login'))
+            return redirect(url_for('.login_page'))
         return f(*args, **kwargs)
     return decorated_function
 
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        user = session_user()
+        if user is None:
             return jsonify({'success': False, 'error': 'Authentication required'}), 401
-        
-        conn = get_db_connection()
-        user = conn.execute('SELECT role FROM users WHERE id = ?', (session['user_id'],)).fetchone()
-        conn.close()
-        
-        if not user or user['role'] != 'admin':
+        if user['role'] != 'admin':
             return jsonify({'success': False, 'error': 'Admin access required'}), 403
         return f(*args, **kwargs)
     return decorated_function
@@ -126,109 +520,284 @@ def admin_required(f):
 
 
 # --- ROUTES ---
-@app.route('/')
+@bp.route('/')
 def index():
     return render_template('dashboard.html')
 
-@app.route('/api/inventory')
+@bp.route('/api/inventory')
+@conditional('products', cache=True)
 def get_inventory():
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM products")
-    products = cursor.fetchall()
+    cursor = raw_cursor(conn)
+    cursor.execute(f"SELECT {json_select(conn, 'products')} FROM products")
+    body = json_rows(cursor)
     conn.close()
-    return jsonify(products)
+    return json_response(body)
 
-@app.route('/api/add-entry', methods=['POST'])
-def add_entry():
-    data = request.json
+SEARCH_DEFAULT_LIMIT = 10
+SEARCH_MAX_LIMIT = 50
+
+PRODUCT_SEARCH_JSON = ("json_object('id', p.id, 'name', p.name, 'brand', p.brand, 'quantity', p.quantity, "
+                       "'reorder_level', p.reorder_level, 'price', p.price)")
+
+def fts_trigram_query(text):
+    """FTS5 query matching any trigram of ``text``; bm25 ranks rows sharing the most first."""
+    text = text.lower()
+    grams = {text[i:i + 3] for i in range(len(text) - 2)}
+    return ' OR '.join('"' + gram.replace('"', '""') + '"' for gram in sorted(grams) if gram.strip())
+
+@bp.route('/api/products/search')
+@conditional('products')
+def search_products():
+    """Ranked product autocomplete on name and brand.
+
+    Exact name first, then word-prefix matches (name-prefix before
+    brand-only hits); only when neither finds anything, typo-tolerant
+    trigram matches.
+    """
+    q = request.args.get('q', '').strip()
+    limit = request.args.get('limit', '').strip()
+    if limit and (not limit.isdigit() or int(limit) <= 0):
+        return jsonify({'success': False, 'error': 'Invalid limit'}), 400
+    limit = min(int(limit), SEARCH_MAX_LIMIT) if limit else SEARCH_DEFAULT_LIMIT
+    
+    if not q:
+        return json_response('[]')
+    
+    conn = get_db_connection()
+    cursor = raw_cursor(conn)
+    results = []
+    seen = set()
+    
+    def collect(sql, params):
+        for row_id, row in cursor.execute(sql, params).fetchall():
+            if row_id not in seen and len(results) < limit:
+                seen.add(row_id)
+                results.append((row,))
+    
+    collect(f"SELECT p.id, {PRODUCT_SEARCH_JSON} FROM products p WHERE p.name = ?", (q,))
+    
+    prefix_query = fts_prefix_query(q)
+    if prefix_query and len(results) < limit:
+        escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        collect(f"""SELECT p.id, {PRODUCT_SEARCH_JSON}
+                    FROM products_fts JOIN products p ON p.id = products_fts.rowid
+                    WHERE products_fts MATCH ?
+                    ORDER BY p.name LIKE ? ESCAPE '\\' DESC, bm25(products_fts, 10.0, 1.0)
+                    LIMIT ?""", (prefix_query, escaped + '%', limit + 1))
+    
+    if not results and len(q) >= 3:
+        has_trigram = conn.execute("SELECT 1 FROM sqlite_master WHERE name='products_trigram'").fetchone()
+        trigram_query = fts_trigram_query(q)
+        if has_trigram and trigram_query:
+            collect(f"""SELECT p.id, {PRODUCT_SEARCH_JSON}
+                        FROM products_trigram JOIN products p ON p.id = products_trigram.rowid
+                        WHERE products_trigram MATCH ?
+                        ORDER BY bm25(products_trigram, 10.0, 1.0)
+                        LIMIT ?""", (trigram_query, limit))
+    
+    conn.close()
+    return json_response(json_rows(results))
+
+@bp.route('/api/products/exists')
+@conditional('products')
+def products_exist():
+    """Which of the ``name`` args are products, matched exactly as create-sale matches them."""
+    names = list(dict.fromkeys(name.strip() for name in request.args.getlist('name') if name.strip()))
+    conn = get_db_connection()
+    stock = read_stock(raw_cursor(conn), names)
+    conn.close()
+    return jsonify({'success': True, 'found': [name for name in names if name in stock],
+                    'missing': [name for name in names if name not in stock]})
+
+def record_entry(conn, data):
     name = data.get('name', '').strip()
     qty = data.get('quantity')
     brand = data.get('brand', '').strip()
     entry_type = data.get('type', 'Intake')
     
     if not name or not isinstance(qty, int) or qty <= 0:
-        return jsonify({'success': False, 'error': 'Invalid name or quantity'}), 400
+        raise ValueError('Invalid name or quantity')
     
     now = datetime.datetime.now()
     date_str = now.strftime("%Y-%m-%d")
     time_str = now.strftime("%H:%M:%S")
     
-    conn = get_db_connection()
     cursor = conn.cursor()
+    try:
+        missing = adjust_stock(conn, {name: qty if entry_type == "Intake" else -qty})
+    except StockConflict:
+        raise ValueError('Insufficient stock')
+    
+    if missing:
+        if entry_type == "Supply":
+            raise ValueError('Item does not exist in stock')
+        try:
+            cursor.execute("INSERT INTO products (name, quantity, reorder_level, brand) VALUES (?, ?, ?, ?)", (name, qty, 5, brand))
+        except sqlite3.IntegrityError:
+            raise ValueError('Item name already exists')
+    
+    cursor.execute("INSERT INTO transactions (item_name, quantity, type, date, time) VALUES (?,?,?,?,?)",
+                  (name, qty, entry_type, date_str, time_str))
+    return ({'success': True, 'message': f'{entry_type} recorded successfully!'},
+            ('products', 'transactions'))
+
+@bp.route('/api/add-entry', methods=['POST'])
+def add_entry():
+    return run_write(record_entry, request.json)
+
+# --- BULK ENTRIES ---
+def parse_entry(record):
+    """Validate one bulk entry (JSON object or CSV row) into (name, quantity, type, brand)."""
+    if not isinstance(record, dict):
+        raise ValueError('Entry must be an object')
+    name = str(record.get('name') or '').strip()
+    qty = record.get('quantity')
+    if isinstance(qty, str) and qty.strip().isdigit():
+        qty = int(qty)
+    entry_type = str(record.get('type') or 'Intake').strip().capitalize()
+    brand = str(record.get('brand') or '').strip()
+    if not name or not isinstance(qty, int) or isinstance(qty, bool) or qty <= 0:
+        raise ValueError('Invalid name or quantity')
+    if entry_type not in ('Intake', 'Supply'):
+        raise ValueError('Type must be Intake or Supply')
+    return name, qty, entry_type, brand
+
+def import_entries(records):
+    """Apply ``(row, record)`` pairs in chunked transactions and summarise the outcome.
+
+    Records are consumed lazily and at most one chunk is held at a time, so
+    memory does not grow with the size of the input. Rows that fail
+    validation or would take stock below zero are reported and skipped.
+    """
+    chunk_size = max(1, current_app.config['IMPORT_CHUNK_SIZE'])
+    max_errors = current_app.config['IMPORT_MAX_ERRORS']
+    summary = {'success': True, 'rows': 0, 'applied': 0, 'failed': 0, 'errors': []}
+    
+    def fail(row, message):
+        summary['failed'] += 1
+        if len(summary['errors']) < max_errors:
+            summary['errors'].append({'row': row, 'error': message})
+    
+    def flush(chunk):
+        now = datetime.datetime.now()
+        conn = get_db_connection()
+        try:
+            begin_write(conn)
+            transaction_ids, _, errors = apply_entries(conn, [entry for row, entry in chunk],
+                                                           now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S"))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            conn.close()
+            for row, entry in chunk:
+                fail(row, str(e))
+            return
+        announce(('products', 'transactions'))
+        conn.close()
+        summary['applied'] += len(transaction_ids)
+        for index, message in errors:
+            fail(chunk[index][0], message)
     
+    chunk = []
     try:
-        cursor.execute("SELECT quantity FROM products WHERE name=?", (name,))
-        row = cursor.fetchone()
-        
-        if row:
-            new_qty = row['quantity'] + qty if entry_type == "Intake" else row['quantity'] - qty
-            if new_qty < 0:
-                return jsonify({'success': False, 'error': 'Insufficient stock'}), 400
-            cursor.execute("UPDATE products SET quantity=? WHERE name=?", (new_qty, name))
-        else:
-            if entry_type == "Supply":
-                return jsonify({'success': False, 'error': 'Item does not exist in stock'}), 400
-            # Try to insert with brand, fallback without if column doesn't exist
+        for row, record in records:
+            summary['rows'] += 1
             try:
-                cursor.execute("INSERT INTO products (name, quantity, reorder_level, brand) VALUES (?, ?, ?, ?)", (name, qty, 5, brand))
-            except sqlite3.OperationalError:
-                # If brand column doesn't exist, insert without it
-                cursor.execute("INSERT INTO products (name, quantity, reorder_level) VALUES (?, ?, ?)", (name, qty, 5))
-        
-        cursor.execute("INSERT INTO transactions (item_name, quantity, type, date, time) VALUES (?,?,?,?,?)",
-                      (name, qty, entry_type, date_str, time_str))
-        conn.commit()
-        return jsonify({'success': True, 'message': f'{entry_type} recorded successfully!'})
-    except sqlite3.IntegrityError:
-        conn.rollback()
-        return jsonify({'success': False, 'error': 'Item name already exists'}), 400
-    except Exception as e:
-        conn.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 400
+                chunk.append((row, parse_entry(record)))
+            except ValueError as e:
+                fail(row, str(e))
+                continue
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+    except (UnicodeDecodeError, csv.Error) as e:
+        # Rows read so far are still applied; the rest of the input is not
+        summary['success'] = False
+        summary['error'] = f"Could not read input after row {summary['rows']}: {e}"
+    if chunk:
+        flush(chunk)
+    summary['errors'].sort(key=lambda error: error['row'])
+    return summary
+
+def read_csv_records(text):
+    for row, record in enumerate(csv.DictReader(text), start=1):
+        yield row, {key.strip().lower(): value for key, value in record.items() if key}
+
+def read_jsonl_records(text):
+    for row, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield row, json.loads(line)
+        except ValueError:
+            yield row, None
+
+@bp.route('/api/add-entries', methods=['POST'])
+def add_entries():
+    data = request.get_json(silent=True)
+    entries = data.get('entries') if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        return jsonify({'success': False, 'error': 'Expected a list of entries'}), 400
+    return jsonify(import_entries(enumerate(entries, start=1)))
+
+@bp.route('/api/import-entries', methods=['POST'])
+def import_entries_upload():
+    """Stream a CSV (name,quantity,type,brand header) or JSON-lines upload into the ledger.
+
+    The body may be the raw file or a multipart form with a ``file`` field;
+    ``?format=csv|jsonl`` overrides detection from the file name or type.
+    """
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    filename = (upload.filename or '') if upload else ''
+    mimetype = upload.mimetype if upload else request.mimetype
+    fmt = request.args.get('format') or ('jsonl' if filename.endswith(('.jsonl', '.ndjson')) or 'json' in mimetype
+                                         else 'csv')
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({'success': False, 'error': 'Format must be csv or jsonl'}), 400
+    
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='' if fmt == 'csv' else None)
+    try:
+        records = read_csv_records(text) if fmt == 'csv' else read_jsonl_records(text)
+        return jsonify(import_entries(records))
     finally:
-        conn.close()
+        text.detach()
 
-@app.route('/api/update-reorder', methods=['POST'])
-def update_reorder():
-    data = request.json
+def set_reorder_level(conn, data):
     name = data.get('name', '').strip()
     level = data.get('level')
     
     if not name or not isinstance(level, int) or level < 0:
-        return jsonify({'success': False, 'error': 'Invalid input'}), 400
+        raise ValueError('Invalid input')
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE products SET reorder_level=? WHERE name=?", (level, name))
-    conn.commit()
-    conn.close()
-    return jsonify({'success': True})
+    conn.execute("UPDATE products SET reorder_level=? WHERE name=?", (level, name))
+    return {'success': True}, ('products',)
 
-@app.route('/api/transactions')
+@bp.route('/api/update-reorder', methods=['POST'])
+def update_reorder():
+    return run_write(set_reorder_level, request.json)
+
+@bp.route('/api/transactions')
+@conditional('transactions')
 def get_transactions():
     date_filter = request.args.get('date')
     type_filter = request.args.get('type', 'All')
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    conditions, params = [], []
+    if type_filter != 'All':
+        conditions.append('type=?')
+        params.append(type_filter)
     
-    if date_filter:
-        if type_filter == 'All':
-            cursor.execute("SELECT * FROM transactions WHERE date=? ORDER BY time DESC", (date_filter,))
-        else:
-            cursor.execute("SELECT * FROM transactions WHERE date=? AND type=? ORDER BY time DESC", (date_filter, type_filter))
-    else:
-        if type_filter == 'All':
-            cursor.execute("SELECT * FROM transactions ORDER BY date DESC, time DESC LIMIT 100")
-        else:
-            cursor.execute("SELECT * FROM transactions WHERE type=? ORDER BY date DESC, time DESC LIMIT 100", (type_filter,))
-    
-    transactions = cursor.fetchall()
-    conn.close()
-    return jsonify(transactions)
+    conn = get_db_connection()
+    try:
+        return list_page(conn, 'transactions', conditions, params, date=date_filter)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    finally:
+        conn.close()
 
-@app.route('/api/generate-invoice', methods=['POST'])
+@bp.route('/api/generate-invoice', methods=['POST'])
 def generate_invoice():
     data = request.json
     customer = data.get('customer', '').strip()
@@ -241,50 +810,31 @@ def generate_invoice():
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute("SELECT quantity FROM products WHERE name=?", (item,))
-    product = cursor.fetchone()
+    today = datetime.date.today().strftime("%Y-%m-%d")
     
-    if not product or product['quantity'] < qty:
+    begin_write(conn)
+    try:
+        missing = adjust_stock(conn, {item: -qty})
+    except StockConflict:
+        missing = [item]
+    if missing:
+        conn.rollback()
+        conn.close()
         return jsonify({'success': False, 'error': 'Insufficient stock'}), 400
     
-    inv_num = f"INV-{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
-    today = datetime.date.today().strftime("%Y-%m-%d")
-    
-    cursor.execute("UPDATE products SET quantity = quantity - ? WHERE name = ?", (qty, item))
-    cursor.execute("INSERT INTO transactions (item_name, quantity, type, date, time) VALUES (?,?,'Supply',?,?)",
-                  (item, qty, today, datetime.datetime.now().strftime("%H:%M:%S")))
+    inv_num = next_document_number(conn, 'INV')
+    cursor.execute("INSERT INTO transactions (item_name, quantity, type, date, time, ref) VALUES (?,?,'Supply',?,?,?)",
+                  (item, qty, today, datetime.datetime.now().strftime("%H:%M:%S"), inv_num))
+    transaction_id = cursor.lastrowid
     cursor.execute("INSERT INTO invoices VALUES (?,?,?,?)", (inv_num, today, customer, qty))
     conn.commit()
+    announce(('products', 'transactions'))
     conn.close()
     
-    # Generate PDF
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", 'B', 20)
-    pdf.cell(190, 10, "INVOICE", ln=True, align='C')
-    pdf.set_font("Arial", size=12)
-    pdf.cell(100, 10, f"Invoice No: {inv_num}", ln=True)
-    pdf.cell(100, 10, f"Customer: {customer}", ln=True)
-    pdf.cell(100, 10, f"Date: {today}", ln=True)
-    pdf.ln(10)
-    pdf.cell(100, 10, "Item Name", border=1)
-    pdf.cell(40, 10, "Quantity", border=1)
-    pdf.ln()
-    pdf.cell(100, 10, item, border=1)
-    pdf.cell(40, 10, str(qty), border=1)
-    
-    file_name = f"{inv_num}.pdf"
-    pdf.output(file_name)
-    
-    return jsonify({'success': True, 'message': f'Invoice {file_name} generated', 'file': file_name})
-
-@app.route('/download/<filename>')
-def download_file(filename):
-    if os.path.exists(filename):
-        return send_file(filename, as_attachment=True)
-    return jsonify({'error': 'File not found'}), 404
-
-@app.route('/api/delete-product/<int:product_id>', methods=['DELETE'])
+    return jsonify({'success': True, 'message': f'Invoice {inv_num} generated', 'invoice_num': inv_num,
+                    'url': url_for('.get_invoice_pdf', doc_num=inv_num)})
+
+@bp.route('/api/delete-product/<int:product_id>', methods=['DELETE'])
 def delete_product(product_id):
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -301,220 +851,170 @@ def delete_product(product_id):
     # Delete the product
     cursor.execute("DELETE FROM products WHERE id=?", (product_id,))
     conn.commit()
+    announce(('products',))
     conn.close()
     
     return jsonify({'success': True, 'message': f'Product "{product_name}" deleted successfully'})
 
-@app.route('/api/delete-transaction/<int:transaction_id>', methods=['DELETE'])
+@bp.route('/api/delete-transaction/<int:transaction_id>', methods=['DELETE'])
 def delete_transaction(transaction_id):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    # Get transaction details before deleting
+    # Read the row under the write lock so two deletes cannot both reverse it
+    begin_write(conn)
     cursor.execute("SELECT * FROM transactions WHERE id=?", (transaction_id,))
     transaction = cursor.fetchone()
     
     if not transaction:
+        conn.rollback()
+        conn.close()
         return jsonify({'success': False, 'error': 'Transaction not found'}), 404
     
     item_name = transaction['item_name']
     quantity = transaction['quantity']
     tx_type = transaction['type']
     
-    # Reverse the transaction effect on inventory
-    cursor.execute("SELECT quantity FROM products WHERE name=?", (item_name,))
-    product = cursor.fetchone()
-    
-    if product:
-        current_qty = product['quantity']
-        
-        # Reverse the effect based on transaction type
-        if tx_type == "Intake":
-            # If it was an intake, subtract the quantity
-            new_qty = current_qty - quantity
-        else:  # Supply
-            # If it was a supply outgoing, add the quantity back
-            new_qty = current_qty + quantity
-        
-        # Prevent negative stock
-        if new_qty < 0:
-            return jsonify({'success': False, 'error': 'Cannot delete transaction - would result in negative inventory'}), 400
-        
-        cursor.execute("UPDATE products SET quantity=? WHERE name=?", (new_qty, item_name))
+    # Reverse the effect based on transaction type: an intake is taken back
+    # out, a supply is put back; items no longer in the catalogue are skipped
+    try:
+        adjust_stock(conn, {item_name: -quantity if tx_type == "Intake" else quantity})
+    except StockConflict:
+        conn.rollback()
+        conn.close()
+        return jsonify({'success': False, 'error': 'Cannot delete transaction - would result in negative inventory'}), 400
     
     # Delete the transaction
     cursor.execute("DELETE FROM transactions WHERE id=?", (transaction_id,))
     conn.commit()
+    announce(('products', 'transactions'))
     conn.close()
     
     return jsonify({'success': True, 'message': f'Transaction deleted successfully. Inventory adjusted for "{item_name}"'})
 
 # --- SALES & CREDIT ROUTES ---
-@app.route('/api/create-sale', methods=['POST'])
-def create_sale():
-    data = request.json
+def record_sale(conn, data):
     customer = data.get('customer', '').strip()
     items = data.get('items', [])
     payment_status = data.get('payment_status', 'Pending')
     
     if not customer or not items:
-        return jsonify({'success': False, 'error': 'Customer and items required'}), 400
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
+        raise ValueError('Customer and items required')
     
-    try:
-        # Generate sale number
-        sale_num = f"SALE-{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
-        today = datetime.date.today().strftime("%Y-%m-%d")
-        current_time = datetime.datetime.now().strftime("%H:%M:%S")
-        total_amount = 0
-        
-        # Process each item
-        for item in items:
-            item_name = item.get('name', '').strip()
-            quantity = item.get('quantity')
-            price = item.get('price')
-            
-            if not item_name or not isinstance(quantity, int) or quantity <= 0 or not isinstance(price, (int, float)) or price < 0:
-                return jsonify({'success': False, 'error': 'Invalid item data'}), 400
-            
-            item_total = quantity * price
-            total_amount += item_total
-            
-            # Check if product exists and has enough stock
-            cursor.execute("SELECT quantity FROM products WHERE name=?", (item_name,))
-            product = cursor.fetchone()
-            
-            if product:
-                if product['quantity'] < quantity:
-                    return jsonify({'success': False, 'error': f'Insufficient stock for {item_name}'}), 400
-                
-                # Deduct from inventory
-                cursor.execute("UPDATE products SET quantity = quantity - ? WHERE name = ?", (quantity, item_name))
-                
-                # Log transaction
-                cursor.execute("INSERT INTO transactions (item_name, quantity, type, date, time) VALUES (?,?,'Supply',?,?)",
-                              (item_name, quantity, today, current_time))
-            
-            # Add sale item
-            cursor.execute("INSERT INTO sale_items (sale_num, item_name, quantity, price, total) VALUES (?,?,?,?,?)",
-                          (sale_num, item_name, quantity, price, item_total))
-        
-        # Create sale record
-        cursor.execute("INSERT INTO sales (sale_num, customer, date, time, total_amount, payment_status) VALUES (?,?,?,?,?,?)",
-                      (sale_num, customer, today, current_time, total_amount, payment_status))
+    # Validate every line before touching the database
+    lines = []
+    for item in items:
+        item_name = item.get('name', '').strip()
+        quantity = item.get('quantity')
+        price = item.get('price')
         
-        conn.commit()
-        conn.close()
+        if not item_name or not isinstance(quantity, int) or quantity <= 0 or not isinstance(price, (int, float)) or price < 0:
+            raise ValueError('Invalid item data')
         
-        return jsonify({'success': True, 'message': 'Sale created successfully', 'sale_num': sale_num, 'total': total_amount})
-    except Exception as e:
-        conn.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 400
-    finally:
-        conn.close()
+        lines.append((item_name, quantity, price, quantity * price))
+    
+    total_amount = sum(line[3] for line in lines)
+    
+    # A name may appear on several lines; stock is checked against the sum
+    wanted = {}
+    for item_name, quantity, price, item_total in lines:
+        wanted[item_name] = wanted.get(item_name, 0) + quantity
+    
+    cursor = conn.cursor()
+    
+    # Allocated under the write lock, so concurrent sales never share one
+    now = datetime.datetime.now()
+    sale_num = next_document_number(conn, 'SALE', now)
+    today = now.strftime("%Y-%m-%d")
+    current_time = now.strftime("%H:%M:%S")
+    
+    # Items not in the catalogue are still sold, but move no stock
+    missing = set(adjust_stock(conn, {item_name: -quantity for item_name, quantity in wanted.items()}))
+    
+    ledger = [(item_name, quantity, today, current_time, sale_num)
+              for item_name, quantity, price, item_total in lines if item_name not in missing]
+    cursor.executemany("INSERT INTO transactions (item_name, quantity, type, date, time, ref) VALUES (?,?,'Supply',?,?,?)",
+                       ledger)
+    
+    cursor.executemany("INSERT INTO sale_items (sale_num, item_name, quantity, price, total) VALUES (?,?,?,?,?)",
+                       [(sale_num,) + line for line in lines])
+    
+    # Create sale record
+    cursor.execute("INSERT INTO sales (sale_num, customer, date, time, total_amount, payment_status) VALUES (?,?,?,?,?,?)",
+                  (sale_num, customer, today, current_time, total_amount, payment_status))
+    
+    return ({'success': True, 'message': 'Sale created successfully', 'sale_num': sale_num, 'total': total_amount},
+            ('products', 'transactions', 'sales', 'sale_items'))
 
-@app.route('/api/sales')
+@bp.route('/api/create-sale', methods=['POST'])
+def create_sale():
+    return run_write(record_sale, request.json)
+
+@bp.route('/api/sales')
+@conditional('sales')
 def get_sales():
     customer_filter = request.args.get('customer', '').strip()
     date_filter = request.args.get('date', '').strip()
+    match_mode = request.args.get('match', 'prefix')
     
     conn = get_db_connection()
-    cursor = conn.cursor()
+    conditions, params = [], []
+    if customer_filter:
+        condition, condition_params = customer_condition(conn, customer_filter, match_mode)
+        conditions.append(condition)
+        params.extend(condition_params)
     
-    if customer_filter and date_filter:
-        cursor.execute("SELECT * FROM sales WHERE customer LIKE ? AND date=? ORDER BY date DESC, time DESC", (f'%{customer_filter}%', date_filter))
-    elif date_filter:
-        cursor.execute("SELECT * FROM sales WHERE date=? ORDER BY date DESC, time DESC", (date_filter,))
-    elif customer_filter:
-        cursor.execute("SELECT * FROM sales WHERE customer LIKE ? ORDER BY date DESC, time DESC", (f'%{customer_filter}%',))
-    else:
-        cursor.execute("SELECT * FROM sales ORDER BY date DESC, time DESC LIMIT 100")
-    
-    sales = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return jsonify(sales)
+    try:
+        return list_page(conn, 'sales', conditions, params, date=date_filter)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    finally:
+        conn.close()
+
+def date_clause(date_filter):
+    return ("WHERE date=?", (date_filter,)) if date_filter else ("", ())
+
+def sales_summary(cursor, date_filter=''):
+    """Sale count and revenue by payment status, read from the per-day rollup."""
+    where, params = date_clause(date_filter)
+    cursor.execute(f"""
+        SELECT 
+            SUM(count) as total_sales,
+            SUM(total) as total_revenue,
+            SUM(CASE WHEN payment_status='Paid' THEN total ELSE 0 END) as paid_amount,
+            SUM(CASE WHEN payment_status='Credit' THEN total ELSE 0 END) as credit_amount,
+            SUM(CASE WHEN payment_status='Pending' THEN total ELSE 0 END) as pending_amount
+        FROM sales_daily {where}
+    """, params)
+    result = cursor.fetchone()
+    return {key: value or 0 for key, value in result.items()}
+
+def expenses_total(cursor, date_filter=''):
+    where, params = date_clause(date_filter)
+    cursor.execute(f"SELECT SUM(total) as total_expenses FROM expenses_daily {where}", params)
+    return cursor.fetchone()['total_expenses'] or 0
 
-@app.route('/api/sales-summary')
+@bp.route('/api/sales-summary')
+@conditional('sales', cache=True)
 def get_sales_summary():
     date_filter = request.args.get('date', '').strip()
     
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    if date_filter:
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total_sales,
-                SUM(total_amount) as total_revenue,
-                SUM(CASE WHEN payment_status='Paid' THEN total_amount ELSE 0 END) as paid_amount,
-                SUM(CASE WHEN payment_status='Credit' THEN total_amount ELSE 0 END) as credit_amount,
-                SUM(CASE WHEN payment_status='Pending' THEN total_amount ELSE 0 END) as pending_amount
-            FROM sales WHERE date=?
-        """, (date_filter,))
-    else:
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total_sales,
-                SUM(total_amount) as total_revenue,
-                SUM(CASE WHEN payment_status='Paid' THEN total_amount ELSE 0 END) as paid_amount,
-                SUM(CASE WHEN payment_status='Credit' THEN total_amount ELSE 0 END) as credit_amount,
-                SUM(CASE WHEN payment_status='Pending' THEN total_amount ELSE 0 END) as pending_amount
-            FROM sales
-        """)
-    
-    result = cursor.fetchone()
+    summary = sales_summary(conn.cursor(), date_filter)
     conn.close()
     
-    return jsonify({
-        'total_sales': result['total_sales'] or 0,
-        'total_revenue': result['total_revenue'] or 0,
-        'paid_amount': result['paid_amount'] or 0,
-        'credit_amount': result['credit_amount'] or 0,
-        'pending_amount': result['pending_amount'] or 0
-    })
+    return jsonify(summary)
 
-@app.route('/api/dashboard-metrics')
+@bp.route('/api/dashboard-metrics')
+@conditional('sales', 'expenses', cache=True)
 def get_dashboard_metrics():
     date_filter = request.args.get('date', '').strip()
     
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    # Get sales data
-    if date_filter:
-        cursor.execute("""
-            SELECT 
-                SUM(total_amount) as total_revenue
-            FROM sales WHERE date=?
-        """, (date_filter,))
-    else:
-        cursor.execute("""
-            SELECT 
-                SUM(total_amount) as total_revenue
-            FROM sales
-        """)
-    
-    sales_result = cursor.fetchone()
-    total_revenue = sales_result['total_revenue'] or 0
-    
-    # Get expenses data
-    if date_filter:
-        cursor.execute("""
-            SELECT 
-                SUM(amount) as total_expenses
-            FROM expenses WHERE date=?
-        """, (date_filter,))
-    else:
-        cursor.execute("""
-            SELECT 
-                SUM(amount) as total_expenses
-            FROM expenses
-        """)
-    
-    expenses_result = cursor.fetchone()
-    total_expenses = expenses_result['total_expenses'] or 0
+    total_revenue = sales_summary(cursor, date_filter)['total_revenue']
+    total_expenses = expenses_total(cursor, date_filter)
     
     # Calculate net profit
     net_profit = total_revenue - total_expenses
@@ -527,90 +1027,292 @@ def get_dashboard_metrics():
         'net_profit': net_profit
     })
 
-@app.route('/api/sale/<sale_num>')
-def get_sale_details(sale_num):
+# --- DASHBOARD ---
+DASHBOARD_RECENT = 5
+
+@bp.route('/api/dashboard')
+@conditional('products', 'transactions', 'sales', 'expenses', cache=True)
+def get_dashboard():
+    """Every dashboard panel from one consistent snapshot.
+
+    All reads share one connection and one read transaction, so the stock
+    counts, totals and recent rows always agree with each other.
+    """
+    date_filter = request.args.get('date', '').strip()
+    
     conn = get_db_connection()
     cursor = conn.cursor()
+    rows = raw_cursor(conn)
     
-    cursor.execute("SELECT * FROM sales WHERE sale_num=?", (sale_num,))
-    sale = cursor.fetchone()
-    
-    if not sale:
-        return jsonify({'success': False, 'error': 'Sale not found'}), 404
-    
-    cursor.execute("SELECT * FROM sale_items WHERE sale_num=?", (sale_num,))
-    items = [dict(row) for row in cursor.fetchall()]
-    
-    conn.close()
+    try:
+        conn.execute("BEGIN")
+        
+        cursor.execute("""
+            SELECT 
+                COUNT(*) as total_items,
+                SUM(quantity <= reorder_level) as low_stock,
+                SUM(quantity) as total_units
+            FROM products
+        """)
+        stock = {key: value or 0 for key, value in cursor.fetchone().items()}
+        stock['healthy_stock'] = stock['total_items'] - stock['low_stock']
+        
+        sales = sales_summary(cursor, date_filter)
+        total_expenses = expenses_total(cursor, date_filter)
+        metrics = {
+            'total_revenue': sales['total_revenue'],
+            'total_expenses': total_expenses,
+            'net_profit': sales['total_revenue'] - total_expenses
+        }
+        
+        rows.execute(f"SELECT {json_select(conn, 'products')} FROM products WHERE quantity <= reorder_level")
+        low_stock_items = json_rows(rows)
+        
+        rows.execute(f"""SELECT {json_select(conn, 'transactions')} FROM transactions
+                         ORDER BY date DESC, time DESC, id DESC LIMIT ?""", (DASHBOARD_RECENT,))
+        recent_transactions = json_rows(rows)
+        
+        where, params = date_clause(date_filter)
+        rows.execute(f"""SELECT {json_select(conn, 'sales')} FROM sales {where}
+                         ORDER BY date DESC, time DESC, id DESC LIMIT ?""", params + (DASHBOARD_RECENT,))
+        recent_sales = json_rows(rows)
+        
+        conn.commit()
+    finally:
+        conn.close()
     
-    return jsonify({
-        'sale': dict(sale),
-        'items': items
-    })
+    # The row lists are already JSON text from SQLite; splice them in as-is
+    head = json.dumps({'stock': stock, 'sales': sales, 'metrics': metrics})
+    return json_response(head[:-1] + f',"low_stock_items":{low_stock_items}'
+                         f',"recent_transactions":{recent_transactions}'
+                         f',"recent_sales":{recent_sales}}}')
 
-@app.route('/api/generate-sale-invoice/<sale_num>', methods=['GET'])
-def generate_sale_invoice(sale_num):
+@bp.route('/api/sale/<sale_num>')
+@conditional('sales', 'sale_items')
+def get_sale_details(sale_num):
     conn = get_db_connection()
-    cursor = conn.cursor()
+    cursor = raw_cursor(conn)
     
-    cursor.execute("SELECT * FROM sales WHERE sale_num=?", (sale_num,))
-    sale = cursor.fetchone()
+    cursor.execute(f"SELECT {json_select(conn, 'sales')} FROM sales WHERE sale_num=?", (sale_num,))
+    sale = json_row(cursor)
     
     if not sale:
         return jsonify({'success': False, 'error': 'Sale not found'}), 404
     
-    cursor.execute("SELECT * FROM sale_items WHERE sale_num=?", (sale_num,))
-    items = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    
-    # Generate PDF
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", 'B', 20)
-    pdf.cell(190, 10, "KEL-B PHONE ACCESSORIES", ln=True, align='C')
-    pdf.set_font("Arial", size=16)
-    pdf.cell(190, 10, "SHOP 16 GOLDEN POINT PLAZA", ln=True, align='C')
-    pdf.cell(190, 10, "TEL: 08034746191, 09033762556", ln=True, align='C')
-    pdf.set_font("Arial", size=12)
-    pdf.cell(190, 10, "SALES INVOICE", ln=True, align='C')
-    pdf.set_font("Arial", size=11)
-    pdf.ln(5)
-    pdf.cell(95, 8, f"Sale No: {sale['sale_num']}", border=0)
-    pdf.cell(95, 8, f"Date: {sale['date']}", border=0, ln=True)
-    pdf.cell(95, 8, f"Customer: {sale['customer']}", border=0)
-    pdf.cell(95, 8, f"Time: {sale['time']}", border=0, ln=True)
-    pdf.ln(5)
-    
-    # Table header
-    pdf.set_font("Arial", 'B', 10)
-    pdf.cell(80, 8, "Item", border=1)
-    pdf.cell(30, 8, "Qty", border=1)
-    pdf.cell(30, 8, "Price", border=1)
-    pdf.cell(40, 8, "Total", border=1, ln=True)
-    
-    # Table rows
-    pdf.set_font("Arial", size=10)
-    for item in items:
-        pdf.cell(80, 8, item['item_name'][:25], border=1)
-        pdf.cell(30, 8, str(item['quantity']), border=1)
-        pdf.cell(30, 8, f"{item['price']:.2f}", border=1)
-        pdf.cell(40, 8, f"{item['total']:.2f}", border=1, ln=True)
-    
-    # Total
-    pdf.set_font("Arial", 'B', 11)
-    pdf.cell(140, 10, "Total Amount:", border=0, align='R')
-    pdf.cell(40, 10, f"{sale['total_amount']:.2f}", border=1, ln=True)
+    cursor.execute(f"SELECT {json_select(conn, 'sale_items')} FROM sale_items WHERE sale_num=?", (sale_num,))
+    items = json_rows(cursor)
     
-    pdf.set_font("Arial", size=9)
-    pdf.ln(5)
-    pdf.cell(190, 8, f"Payment Status: {sale['payment_status']}", align='C')
+    conn.close()
     
-    file_name = f"{sale_num}.pdf"
-    pdf.output(file_name)
+    return json_response('{"items":' + items + ',"sale":' + sale + '}')
+
+def get_invoice_renderer():
+    renderer = current_app.extensions.get('invoice_renderer')
+    if renderer is None:
+        renderer = InvoiceRenderer(workers=current_app.config['PDF_WORKERS'],
+                                   max_pending=current_app.config['PDF_MAX_PENDING'],
+                                   wait=current_app.config['PDF_WAIT'])
+        current_app.extensions['invoice_renderer'] = renderer
+    return renderer
+
+def get_document_store():
+    store = current_app.extensions.get('document_store')
+    if store is None:
+        store = DocumentStore(current_app.config['DOCUMENT_STORE_DIR'],
+                              max_bytes=current_app.config['DOCUMENT_STORE_MAX_BYTES'],
+                              max_age=current_app.config['DOCUMENT_STORE_MAX_AGE_DAYS'] * 86400)
+        current_app.extensions['document_store'] = store
+    return store
+
+def load_invoice_document(cursor, doc_num):
+    """Everything printed on invoice ``doc_num`` as ``(kind, doc)``, or None."""
+    cursor.execute("SELECT sale_num, customer, date, time, total_amount, payment_status FROM sales WHERE sale_num=?",
+                   (doc_num,))
+    sale = cursor.fetchone()
+    if sale:
+        cursor.execute("SELECT item_name, quantity, price, total FROM sale_items WHERE sale_num=? ORDER BY id",
+                       (doc_num,))
+        return 'sale', {'sale': sale, 'items': cursor.fetchall()}
+    
+    cursor.execute("SELECT invoice_num, date, customer, total_items FROM invoices WHERE invoice_num=?", (doc_num,))
+    invoice = cursor.fetchone()
+    if invoice:
+        # Invoices made before ledger rows carried a ref have no item on record
+        cursor.execute("SELECT item_name FROM transactions WHERE ref=? LIMIT 1", (doc_num,))
+        ledger = cursor.fetchone()
+        return 'invoice', dict(invoice, item=ledger['item_name'] if ledger else '')
+    return None
+
+@bp.route('/api/invoice/<doc_num>')
+def get_invoice_pdf(doc_num):
+    """The PDF for a sale (SALE-...) or stock invoice (INV-...), rendered on demand."""
+    conn = get_db_connection()
+    document = load_invoice_document(conn.cursor(), doc_num)
+    conn.close()
+    if document is None:
+        return jsonify({'success': False, 'error': 'Invoice not found'}), 404
+    
+    # Stored under the hash of what it prints, so an unchanged sale is never re-rendered
+    store = get_document_store()
+    digest = document_hash(*document)
+    path = store.get(digest, '.pdf')
+    if path is None:
+        try:
+            pdf, digest = get_invoice_renderer().render(*document)
+        except RendererBusy as e:
+            return jsonify({'success': False, 'error': str(e)}), 503
+        path = store.put(pdf, '.pdf', key=digest)
+    return send_file(path, mimetype='application/pdf', as_attachment=True, download_name=f'{doc_num}.pdf',
+                     etag=digest, conditional=True, max_age=0)
+
+# --- INVOICE EXPORT ---
+EXPORT_BATCH = 100  # sales read per query while streaming an export
+
+def sales_report(cursor, start, end):
+    """Cover page document for an export: sales in the range by status and by day."""
+    cursor.execute("""SELECT payment_status, SUM(count) as count, SUM(total) as total FROM sales_daily
+                      WHERE date >= ? AND date <= ? GROUP BY payment_status ORDER BY payment_status""", (start, end))
+    by_status = cursor.fetchall()
+    cursor.execute("""SELECT date, SUM(count) as count, SUM(total) as total FROM sales_daily
+                      WHERE date >= ? AND date <= ? GROUP BY date ORDER BY date""", (start, end))
+    by_day = cursor.fetchall()
+    return {'start': start, 'end': end, 'count': sum(row['count'] for row in by_status),
+            'total': sum(row['total'] for row in by_status), 'by_status': by_status, 'by_day': by_day}
+
+def iter_sale_documents(start, end):
+    """Yield ``('sale', doc)`` for every sale from ``start`` to ``end``, oldest first.
+
+    Reads EXPORT_BATCH sales at a time, each batch in its own short read, so
+    a long download neither holds a connection nor keeps the database's
+    write-ahead log from being checkpointed. Documents are built exactly as
+    load_invoice_document() builds them, so they hash to the same key.
+    """
+    after = None
+    while True:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            conn.execute("BEGIN")
+            if after is None:
+                cursor.execute("""SELECT id, sale_num, customer, date, time, total_amount, payment_status FROM sales
+                                  WHERE date >= ? AND date <= ? ORDER BY date, time, id LIMIT ?""",
+                               (start, end, EXPORT_BATCH))
+            else:
+                cursor.execute("""SELECT id, sale_num, customer, date, time, total_amount, payment_status FROM sales
+                                  WHERE (date, time, id) > (?, ?, ?) AND date <= ? ORDER BY date, time, id LIMIT ?""",
+                               after + (end, EXPORT_BATCH))
+            sales = cursor.fetchall()
+            items = {sale['sale_num']: [] for sale in sales}
+            if sales:
+                cursor.execute(f"""SELECT sale_num, item_name, quantity, price, total FROM sale_items
+                                   WHERE sale_num IN ({','.join('?' * len(items))}) ORDER BY id""", list(items))
+                for item in cursor.fetchall():
+                    items[item.pop('sale_num')].append(item)
+        finally:
+            conn.rollback()
+            conn.close()
+        if sales:
+            after = (sales[-1]['date'], sales[-1]['time'], sales[-1]['id'])
+        for sale in sales:
+            del sale['id']
+            yield 'sale', {'sale': sale, 'items': items[sale['sale_num']]}
+        if len(sales) < EXPORT_BATCH:
+            return
+
+class ChunkSink:
+    """Write-only file for ZipFile that hands back what was written so far."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+@bp.route('/api/invoices/export')
+def export_invoices():
+    """Every sale invoice from ``start`` to ``end`` as one PDF or a ZIP of PDFs.
+
+    ``format=pdf`` (default) streams a report cover page followed by each
+    sale's invoice pages; ``format=zip`` streams ``report.pdf`` plus one
+    ``<sale number>.pdf`` per sale. Invoices render in the PDF workers a few
+    at a time and are sent as they finish, so the download starts at once
+    and memory does not grow with the number of sales.
+    """
+    start = request.args.get('start', '').strip()
+    end = request.args.get('end', '').strip() or start
+    fmt = request.args.get('format', 'pdf').strip().lower()
+    try:
+        first = datetime.date.fromisoformat(start)
+        last = datetime.date.fromisoformat(end)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'start and end must be YYYY-MM-DD dates'}), 400
+    if last < first:
+        return jsonify({'success': False, 'error': 'end is before start'}), 400
+    if (last - first).days >= current_app.config['EXPORT_MAX_DAYS']:
+        return jsonify({'success': False,
+                        'error': f"Export at most {current_app.config['EXPORT_MAX_DAYS']} days at a time"}), 400
+    if fmt not in ('pdf', 'zip'):
+        return jsonify({'success': False, 'error': 'format must be pdf or zip'}), 400
     
-    return jsonify({'success': True, 'file': file_name})
+    conn = get_db_connection()
+    report = sales_report(conn.cursor(), start, end)
+    conn.close()
+    if not report['count']:
+        return jsonify({'success': False, 'error': 'No sales in that period'}), 404
+    
+    renderer = get_invoice_renderer()
+    
+    def documents():
+        yield 'report', report
+        yield from iter_sale_documents(start, end)
+    
+    if fmt == 'pdf':
+        def generate():
+            merged = MergedPdf()
+            yield merged.header()
+            for kind, doc, (pages, fonts), hit in renderer.render_many(documents(), render_pages):
+                yield merged.add(pages, fonts)
+            yield merged.finish()
+        mimetype = 'application/pdf'
+    else:
+        store = get_document_store()
+        
+        def lookup(kind, doc):
+            path = store.get(document_hash(kind, doc), '.pdf')
+            if path is None:
+                return None
+            try:
+                with open(path, 'rb') as f:
+                    return f.read()
+            except FileNotFoundError:  # pruned in between
+                return None
+        
+        def generate():
+            sink = ChunkSink()
+            # PDFs are already deflated; storing them keeps the workers' output as-is
+            with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+                for kind, doc, pdf, hit in renderer.render_many(documents(), lookup=lookup):
+                    if not hit:
+                        store.put(pdf, '.pdf', key=document_hash(kind, doc))
+                    name = 'report.pdf' if kind == 'report' else f"{doc['sale']['sale_num']}.pdf"
+                    archive.writestr(name, pdf)
+                    yield sink.take()
+            yield sink.take()
+        mimetype = 'application/zip'
+    
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="invoices-{start}-to-{end}.{fmt}"',
+                             'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-@app.route('/api/update-sale-status/<sale_num>', methods=['POST'])
+@bp.route('/api/update-sale-status/<sale_num>', methods=['POST'])
 def update_sale_status(sale_num):
     data = request.json
     new_status = data.get('status', '').strip()
@@ -631,14 +1333,13 @@ def update_sale_status(sale_num):
     
     cursor.execute("UPDATE sales SET payment_status=? WHERE sale_num=?", (new_status, sale_num))
     conn.commit()
+    announce(('sales',))
     conn.close()
     
     return jsonify({'success': True, 'message': f'Payment status updated to {new_status}'})
 
 # --- EXPENSES ROUTES ---
-@app.route('/api/add-expense', methods=['POST'])
-def add_expense():
-    data = request.json
+def record_expense(conn, data):
     description = data.get('description', '').strip()
     category = data.get('category', '').strip()
     amount = data.get('amount')
@@ -646,75 +1347,60 @@ def add_expense():
     notes = data.get('notes', '').strip()
     
     if not description or not category or not isinstance(amount, (int, float)) or amount <= 0 or not date_str:
-        return jsonify({'success': False, 'error': 'Invalid expense data'}), 400
+        raise ValueError('Invalid expense data')
     
     time_str = datetime.datetime.now().strftime("%H:%M:%S")
     
-    conn = get_db_connection()
     cursor = conn.cursor()
-    
-    try:
-        cursor.execute("INSERT INTO expenses (description, category, amount, date, time, notes) VALUES (?,?,?,?,?,?)",
-                      (description, category, amount, date_str, time_str, notes))
-        conn.commit()
-        conn.close()
-        
-        return jsonify({'success': True, 'message': 'Expense recorded successfully'})
-    except Exception as e:
-        conn.close()
-        return jsonify({'success': False, 'error': str(e)}), 400
+    cursor.execute("INSERT INTO expenses (description, category, amount, date, time, notes) VALUES (?,?,?,?,?,?)",
+                  (description, category, amount, date_str, time_str, notes))
+    return ({'success': True, 'message': 'Expense recorded successfully'},
+            ('expenses',))
 
-@app.route('/api/expenses')
+@bp.route('/api/add-expense', methods=['POST'])
+def add_expense():
+    return run_write(record_expense, request.json)
+
+@bp.route('/api/expenses')
+@conditional('expenses')
 def get_expenses():
     date_filter = request.args.get('date', '').strip()
     category_filter = request.args.get('category', '').strip()
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    if date_filter and category_filter:
-        cursor.execute("SELECT * FROM expenses WHERE date=? AND category=? ORDER BY date DESC, time DESC", 
-                      (date_filter, category_filter))
-    elif date_filter:
-        cursor.execute("SELECT * FROM expenses WHERE date=? ORDER BY date DESC, time DESC", (date_filter,))
-    elif category_filter:
-        cursor.execute("SELECT * FROM expenses WHERE category=? ORDER BY date DESC, time DESC", (category_filter,))
-    else:
-        cursor.execute("SELECT * FROM expenses ORDER BY date DESC, time DESC")
+    conditions, params = [], []
+    if category_filter:
+        conditions.append('category=?')
+        params.append(category_filter)
     
-    expenses = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return jsonify(expenses)
+    conn = get_db_connection()
+    try:
+        return list_page(conn, 'expenses', conditions, params, date=date_filter)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    finally:
+        conn.close()
 
-@app.route('/api/expenses-summary')
+@bp.route('/api/expenses-summary')
+@conditional('expenses')
 def get_expenses_summary():
     date_filter = request.args.get('date', '').strip()
     
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    if date_filter:
-        cursor.execute("SELECT SUM(amount) as total_expenses FROM expenses WHERE date=?", (date_filter,))
-    else:
-        cursor.execute("SELECT SUM(amount) as total_expenses FROM expenses")
-    
-    result = cursor.fetchone()
-    
-    if date_filter:
-        cursor.execute("SELECT category, SUM(amount) as total FROM expenses WHERE date=? GROUP BY category ORDER BY total DESC",
-                      (date_filter,))
-    else:
-        cursor.execute("SELECT category, SUM(amount) as total FROM expenses GROUP BY category ORDER BY total DESC")
-    
-    categories = [dict(row) for row in cursor.fetchall()]
+    # Read from the per-day rollup, never the expenses table itself
+    where, params = date_clause(date_filter)
+    cursor.execute(f"SELECT category, SUM(total) as total FROM expenses_daily {where} GROUP BY category ORDER BY total DESC",
+                  params)
+    categories = cursor.fetchall()
     conn.close()
     
     return jsonify({
-        'total_expenses': result['total_expenses'] or 0,
+        'total_expenses': sum(row['total'] for row in categories),
         'by_category': categories
     })
 
-@app.route('/api/delete-expense/<int:expense_id>', methods=['DELETE'])
+@bp.route('/api/delete-expense/<int:expense_id>', methods=['DELETE'])
 def delete_expense(expense_id):
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -727,38 +1413,37 @@ def delete_expense(expense_id):
     
     cursor.execute("DELETE FROM expenses WHERE id=?", (expense_id,))
     conn.commit()
+    announce(('expenses',))
     conn.close()
     
     return jsonify({'success': True, 'message': 'Expense deleted successfully'})
 
-@app.route('/api/delete-sale/<sale_num>', methods=['DELETE'])
+@bp.route('/api/delete-sale/<sale_num>', methods=['DELETE'])
 def delete_sale(sale_num):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    # Get sale details before deleting
-    cursor.execute("SELECT * FROM sales WHERE sale_num=?", (sale_num,))
-    sale = cursor.fetchone()
-    
-    if not sale:
-        return jsonify({'success': False, 'error': 'Sale not found'}), 404
-    
     try:
-        # Get all items in this sale to reverse inventory
-        cursor.execute("SELECT * FROM sale_items WHERE sale_num=?", (sale_num,))
-        items = [dict(row) for row in cursor.fetchall()]
+        begin_write(conn)
+        
+        # Get sale details before deleting
+        cursor.execute("SELECT * FROM sales WHERE sale_num=?", (sale_num,))
+        sale = cursor.fetchone()
         
-        # Reverse the inventory for each item
-        for item in items:
-            item_name = item['item_name']
-            quantity = item['quantity']
-            
-            cursor.execute("SELECT quantity FROM products WHERE name=?", (item_name,))
-            product = cursor.fetchone()
-            
-            if product:
-                new_qty = product['quantity'] + quantity
-                cursor.execute("UPDATE products SET quantity=? WHERE name=?", (new_qty, item_name))
+        if not sale:
+            conn.rollback()
+            return jsonify({'success': False, 'error': 'Sale not found'}), 404
+        
+        # Reverse exactly the stock movements this sale recorded in the ledger
+        cursor.execute("SELECT id, item_name, quantity FROM transactions WHERE ref=? AND type='Supply'", (sale_num,))
+        ledger = cursor.fetchall()
+        restock = {}
+        for row in ledger:
+            restock[row['item_name']] = restock.get(row['item_name'], 0) + row['quantity']
+        adjust_stock(conn, restock)
+        
+        # Delete related transactions (Supply type)
+        cursor.execute("DELETE FROM transactions WHERE ref=? AND type='Supply'", (sale_num,))
         
         # Delete sale items
         cursor.execute("DELETE FROM sale_items WHERE sale_num=?", (sale_num,))
@@ -766,20 +1451,19 @@ def delete_sale(sale_num):
         # Delete the sale
         cursor.execute("DELETE FROM sales WHERE sale_num=?", (sale_num,))
         
-        # Delete related transactions (Supply type)
-        cursor.execute("DELETE FROM transactions WHERE type='Supply' AND item_name IN (SELECT item_name FROM sale_items WHERE sale_num=?)", (sale_num,))
-        
         conn.commit()
-        conn.close()
+        announce(('products', 'transactions', 'sales', 'sale_items'))
         
         return jsonify({'success': True, 'message': f'Sale {sale_num} deleted successfully. Inventory reversed.'})
     except Exception as e:
-        conn.close()
+        conn.rollback()
         return jsonify({'success': False, 'error': str(e)}), 400
+    finally:
+        conn.close()
 
 
 # --- USER MANAGEMENT ROUTES ---
-@app.route('/api/users', methods=['GET'])
+@bp.route('/api/users', methods=['GET'])
 @admin_required
 def get_users():
     """Get all users (admin only)"""
@@ -789,10 +1473,10 @@ def get_users():
     
     return jsonify({
         'success': True,
-        'users': [dict(user) for user in users]
+        'users': users
     })
 
-@app.route('/api/users', methods=['POST'])
+@bp.route('/api/users', methods=['POST'])
 @admin_required
 def create_user():
     """Create new user (admin only)"""
@@ -809,18 +1493,24 @@ def create_user():
     if role not in ['admin', 'manager', 'staff']:
         return jsonify({'success': False, 'error': 'Invalid role'}), 400
     
+    try:
+        password_hash = get_password_hasher().hash(password)
+    except HasherBusy as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+    
     conn = get_db_connection()
     try:
-        password_hash = generate_password_hash(password)
         created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        conn.execute("""INSERT INTO users (username, password_hash, full_name, email, role, created_at, is_active)
+        cursor = conn.execute("""INSERT INTO users (username, password_hash, full_name, email, role, created_at, is_active)
                        VALUES (?, ?, ?, ?, ?, ?, ?)""",
                     (username, password_hash, full_name, email, role, created_at, 1))
         conn.commit()
         
-        user_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+        user_id = cursor.lastrowid
         conn.close()
+        # SQLite may hand out a deleted user's id again
+        get_user_cache().invalidate(user_id)
         
         return jsonify({
             'success': True,
@@ -834,7 +1524,7 @@ def create_user():
         conn.close()
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/users/<int:user_id>', methods=['PUT'])
+@bp.route('/api/users/<int:user_id>', methods=['PUT'])
 @admin_required
 def update_user(user_id):
     """Update user details (admin only)"""
@@ -870,13 +1560,14 @@ def update_user(user_id):
         conn.execute(query, params)
         conn.commit()
         conn.close()
+        get_user_cache().invalidate(user_id)
         
         return jsonify({'success': True, 'message': 'User updated successfully'})
     except Exception as e:
         conn.close()
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/users/<int:user_id>/toggle-active', methods=['POST'])
+@bp.route('/api/users/<int:user_id>/toggle-active', methods=['POST'])
 @admin_required
 def toggle_user_active(user_id):
     """Enable/disable user account (admin only)"""
@@ -895,6 +1586,7 @@ def toggle_user_active(user_id):
         conn.execute('UPDATE users SET is_active = ? WHERE id = ?', (new_status, user_id))
         conn.commit()
         conn.close()
+        get_user_cache().invalidate(user_id)
         
         status_text = 'activated' if new_status else 'deactivated'
         return jsonify({'success': True, 'message': f'User {status_text} successfully'})
@@ -902,7 +1594,7 @@ def toggle_user_active(user_id):
         conn.close()
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/users/<int:user_id>/change-password', methods=['POST'])
+@bp.route('/api/users/<int:user_id>/change-password', methods=['POST'])
 @login_required
 def change_password(user_id):
     """Change user password"""
@@ -912,9 +1604,7 @@ def change_password(user_id):
     
     # Users can only change their own password, unless they're admin
     if user_id != session.get('user_id'):
-        conn = get_db_connection()
-        user = conn.execute('SELECT role FROM users WHERE id = ?', (session['user_id'],)).fetchone()
-        conn.close()
+        user = get_user_cache().get(session['user_id'])
         if not user or user['role'] != 'admin':
             return jsonify({'success': False, 'error': 'Unauthorized'}), 403
     
@@ -930,21 +1620,25 @@ def change_password(user_id):
         
         # Verify current password if changing own password
         if user_id == session.get('user_id'):
-            if not current_password or not check_password_hash(user['password_hash'], current_password):
+            if not current_password or not get_password_hasher().verify(user['password_hash'], current_password):
                 conn.close()
                 return jsonify({'success': False, 'error': 'Current password is incorrect'}), 401
         
-        new_hash = generate_password_hash(new_password)
+        new_hash = get_password_hasher().hash(new_password)
         conn.execute('UPDATE users SET password_hash = ? WHERE id = ?', (new_hash, user_id))
         conn.commit()
         conn.close()
+        get_user_cache().invalidate(user_id)
         
         return jsonify({'success': True, 'message': 'Password changed successfully'})
+    except HasherBusy as e:
+        conn.close()
+        return jsonify({'success': False, 'error': str(e)}), 503
     except Exception as e:
         conn.close()
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/users/<int:user_id>', methods=['DELETE'])
+@bp.route('/api/users/<int:user_id>', methods=['DELETE'])
 @admin_required
 def delete_user(user_id):
     """Delete user (admin only)"""
@@ -957,19 +1651,218 @@ def delete_user(user_id):
         conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
         conn.commit()
         conn.close()
+        get_user_cache().invalidate(user_id)
         
         return jsonify({'success': True, 'message': 'User deleted successfully'})
     except Exception as e:
         conn.close()
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/login')
+# --- OFFLINE SYNC ---
+SYNC_OPERATIONS = {
+    ('POST', '/api/add-entry'): record_entry,
+    ('POST', '/api/update-reorder'): set_reorder_level,
+    ('POST', '/api/add-expense'): record_expense,
+    ('POST', '/api/create-sale'): record_sale,
+}
+
+def replay_operations(conn, operations, results, changes):
+    """Apply queued operations in the current write transaction, once per key.
+
+    Each operation runs under a savepoint, so a refused one is undone on its
+    own and the rest of the chunk still applies. Every outcome, refusals
+    included, is stored under the operation's key; a key seen before gets its
+    stored outcome back instead of being applied again.
+    """
+    cursor = raw_cursor(conn)
+    created_at = datetime.datetime.now().isoformat(timespec='seconds')
+    for op in operations:
+        key = op.get('key') if isinstance(op, dict) else None
+        if not isinstance(key, str) or not key or len(key) > 200:
+            results.append({'key': key, 'status': 400, 'replayed': False,
+                            'body': {'success': False, 'error': 'Missing or invalid idempotency key'}})
+            continue
+        
+        cursor.execute("SELECT status, response FROM sync_operations WHERE key=?", (key,))
+        stored = cursor.fetchone()
+        if stored:
+            results.append({'key': key, 'status': stored[0], 'replayed': True, 'body': json.loads(stored[1])})
+            continue
+        
+        operation = SYNC_OPERATIONS.get((str(op.get('method', 'POST')).upper(), op.get('endpoint')))
+        data = op.get('data')
+        if operation is None or not isinstance(data, dict):
+            status, body = 400, {'success': False, 'error': 'Unsupported operation'}
+        else:
+            cursor.execute("SAVEPOINT sync_op")
+            try:
+                body, tables = operation(conn, data)
+                status = 200
+                changes.update(tables)
+            except sqlite3.OperationalError:
+                # The database itself failed; let the whole chunk be retried
+                raise
+            except Exception as e:
+                cursor.execute("ROLLBACK TO sync_op")
+                status, body = 400, {'success': False, 'error': str(e)}
+            cursor.execute("RELEASE sync_op")
+        
+        cursor.execute("INSERT INTO sync_operations (key, status, response, created_at) VALUES (?,?,?,?)",
+                       (key, status, json.dumps(body), created_at))
+        results.append({'key': key, 'status': status, 'replayed': False, 'body': body})
+
+@bp.route('/api/sync/batch', methods=['POST'])
+def sync_batch():
+    """Replay an ordered list of queued offline operations.
+
+    Body: ``{"operations": [{"key", "method", "endpoint", "data"}, ...]}``.
+    Operations are applied in order, SYNC_CHUNK_SIZE per transaction, and
+    answered with one result per operation. If a chunk cannot be committed,
+    it and everything after it come back with status 503 and can be resent
+    under the same keys.
+    """
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list):
+        return jsonify({'success': False, 'error': 'Expected a list of operations'}), 400
+    if len(operations) > current_app.config['SYNC_MAX_OPERATIONS']:
+        return jsonify({'success': False,
+                        'error': f"At most {current_app.config['SYNC_MAX_OPERATIONS']} operations per request"}), 413
+    
+    chunk_size = max(1, current_app.config['SYNC_CHUNK_SIZE'])
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=current_app.config['SYNC_KEY_RETENTION_DAYS'])).isoformat()
+    results = []
+    for start in range(0, len(operations), chunk_size):
+        changes = set()
+        conn = get_db_connection()
+        try:
+            begin_write(conn)
+            if start == 0:
+                conn.execute("DELETE FROM sync_operations WHERE created_at < ?", (cutoff,))
+            replay_operations(conn, operations[start:start + chunk_size], results, changes)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            conn.close()
+            del results[start:]
+            results.extend({'key': op.get('key') if isinstance(op, dict) else None, 'status': 503,
+                            'replayed': False, 'body': {'success': False, 'error': f'Not applied: {e}'}}
+                           for op in operations[start:])
+            break
+        announce(changes)
+        conn.close()
+    
+    return jsonify({'success': True, 'results': results})
+
+CHANGES_DEFAULT_LIMIT = 1000
+CHANGES_MAX_LIMIT = 5000
+
+@bp.route('/api/changes')
+def get_changes():
+    """Rows of the offline-mirrored tables changed after sequence ``since``.
+
+    Returns ``{"seq", "more", "reset", "changes": {table: {"upsert": [rows],
+    "delete": [ids]}}}``. Each row appears once, in its current state, however
+    often it changed; follow ``seq`` while ``more`` is true. ``reset`` means
+    the client's sequence is from another database and it must start again
+    from 0.
+    """
+    try:
+        since = int(request.args.get('since', 0))
+        limit = min(max(int(request.args.get('limit', CHANGES_DEFAULT_LIMIT)), 1), CHANGES_MAX_LIMIT)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid since or limit'}), 400
+    
+    conn = get_db_connection()
+    cursor = raw_cursor(conn)
+    # One snapshot for the log and the rows it points at
+    conn.execute("BEGIN")
+    cursor.execute("SELECT ifnull(max(seq), 0) FROM change_log")
+    latest = cursor.fetchone()[0]
+    if since > latest:
+        conn.rollback()
+        conn.close()
+        return json_response(json.dumps({'seq': latest, 'more': False, 'reset': True, 'changes': {}}))
+    
+    cursor.execute("SELECT seq, tbl, row_id, deleted FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?",
+                   (since, limit + 1))
+    entries = cursor.fetchall()
+    more = len(entries) > limit
+    entries = entries[:limit]
+    
+    upserts = {table: [] for table in CHANGE_LOG_TABLES}
+    deletes = {table: [] for table in CHANGE_LOG_TABLES}
+    for seq, table, row_id, deleted in entries:
+        (deletes if deleted else upserts)[table].append(row_id)
+    
+    parts = []
+    for table in CHANGE_LOG_TABLES:
+        if not upserts[table] and not deletes[table]:
+            continue
+        rows = '[]'
+        if upserts[table]:
+            cursor.execute(f"SELECT {json_select(conn, table)} FROM {table} WHERE id IN ({','.join('?' * len(upserts[table]))})",
+                           upserts[table])
+            rows = json_rows(cursor)
+        parts.append(f'"{table}":{{"upsert":{rows},"delete":{json.dumps(deletes[table])}}}')
+    conn.rollback()
+    conn.close()
+    
+    seq = entries[-1][0] if entries else since
+    return json_response(f'{{"seq":{seq},"more":{json.dumps(more)},"reset":false,"changes":{{{",".join(parts)}}}}}')
+
+@bp.route('/api/events')
+def stream_events():
+    """Server-Sent Events feed of changes made through the write routes."""
+    feed = get_change_feed()
+    sub = feed.subscribe()
+    heartbeat = current_app.config['EVENTS_HEARTBEAT']
+    
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    item = sub.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    if sub.overflowed:
+                        yield 'event: resync\ndata: {}\n\n'
+                        return
+                    yield ': keep-alive\n\n'
+                    continue
+                if sub.closed:
+                    # The worker is shutting down; the client reconnects to another
+                    return
+                event, data = item
+                yield f'event: {event}\ndata: {data}\n\n'
+                if sub.overflowed and sub.queue.empty():
+                    # Events were dropped; the client must reload what it shows
+                    yield 'event: resync\ndata: {}\n\n'
+                    return
+        finally:
+            feed.unsubscribe(sub)
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@bp.route('/api/db-stats')
+@admin_required
+def get_db_stats():
+    """Connection pool, read cache, event feed, invoice, document store and sign-in counters (admin only)"""
+    return jsonify({'success': True, 'pool': get_db_pool().stats(), 'cache': get_read_cache().stats(),
+                    'events': get_change_feed().stats(), 'invoices': get_invoice_renderer().stats(),
+                    'documents': get_document_store().stats(), 'auth': get_user_cache().stats(),
+                    'passwords': get_password_hasher().stats(),
+                    'login_throttle': {'username': get_login_throttle('username').stats(),
+                                       'address': get_login_throttle('address').stats()}})
+
+@bp.route('/login')
 def login_page():
     if 'user_id' in session:
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     return render_template('login.html')
 
-@app.route('/api/login', methods=['POST'])
+@bp.route('/api/login', methods=['POST'])
 def api_login():
     data = request.json
     username = data.get('username', '').strip()
@@ -978,24 +1871,52 @@ def api_login():
     if not username or not password:
         return jsonify({'success': False, 'error': 'Username and password required'}), 400
     
+    # Refuse before hashing anything, so guessing costs the server nothing
+    by_username, by_address = get_login_throttle('username'), get_login_throttle('address')
+    username_key, address = username.lower(), request.remote_addr or ''
+    retry_after = max(by_username.retry_after(username_key), by_address.retry_after(address))
+    if retry_after:
+        response = jsonify({'success': False, 'error': 'Too many failed sign-ins, try again later'})
+        response.headers['Retry-After'] = str(int(retry_after) + 1)
+        return response, 429
+    
+    def failed(error):
+        by_username.failed(username_key)
+        by_address.failed(address)
+        return jsonify({'success': False, 'error': error}), 401
+    
     conn = get_db_connection()
     user = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
     conn.close()
     
     if not user:
-        return jsonify({'success': False, 'error': 'Invalid credentials'}), 401
+        return failed('Invalid credentials')
     
     if not user['is_active']:
-        return jsonify({'success': False, 'error': 'Account is disabled'}), 401
+        return failed('Account is disabled')
     
-    if not check_password_hash(user['password_hash'], password):
-        return jsonify({'success': False, 'error': 'Invalid credentials'}), 401
+    hasher = get_password_hasher()
+    try:
+        if not hasher.verify(user['password_hash'], password):
+            return failed('Invalid credentials')
+        # Hashed with settings since changed: upgrade while the password is at hand
+        if hasher.needs_rehash(user['password_hash']):
+            new_hash = hasher.hash(password)
+            conn = get_db_connection()
+            conn.execute('UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                         (new_hash, user['id'], user['password_hash']))
+            conn.commit()
+            conn.close()
+    except HasherBusy as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+    by_username.reset(username_key)
     
     # Set session
     session['user_id'] = user['id']
     session['username'] = user['username']
     session['role'] = user['role']
     session['full_name'] = user['full_name']
+    get_user_cache().put(user['id'], {key: user[key] for key in ('id', 'username', 'full_name', 'role', 'is_active')})
     
     return jsonify({
         'success': True,
@@ -1007,23 +1928,27 @@ def api_login():
         }
     })
 
-@app.route('/api/logout', methods=['POST'])
+@bp.route('/api/logout', methods=['POST'])
 def api_logout():
     session.clear()
     return jsonify({'success': True})
 
-@app.route('/api/current-user')
+@bp.route('/api/current-user')
 @login_required
 def current_user():
+    # From the user cache, so a role change shows without signing in again
+    user = get_user_cache().get(session['user_id'])
     return jsonify({
         'success': True,
         'user': {
-            'id': session.get('user_id'),
-            'username': session.get('username'),
-            'full_name': session.get('full_name'),
-            'role': session.get('role')
+            'id': user['id'],
+            'username': user['username'],
+            'full_name': user['full_name'],
+            'role': user['role']
         }
     })
 
+app = create_app()
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,240 @@
+"""Authentication helpers: user cache, password hashing and login throttling.
+
+Every admin route needs the caller's role and whether the account is still
+active. Both change rarely, so they are loaded once per user and reused for
+a short TTL instead of being read from SQLite on every request. Each
+lookup reads only a version counter that the database bumps whenever a user
+changes. So a role change or deactivation made through any worker process
+takes effect in all of them on the next request.
+
+Password hashes are deliberately slow. They run on a few dedicated threads
+(hashlib releases the GIL while it hashes), so a rush of logins queues there
+instead of occupying every web thread, and repeated failures for one
+username or one address are turned away before any hashing happens. Those
+failures are counted in SQLite, so the limit holds across worker processes.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+_MISSING = object()
+
+
+class UserCache:
+    """Bounded TTL cache of ``loader(user_id)`` results, unknown users included.
+
+    ``loader`` returns a dict for the user or None if there is no such user;
+    None is cached too, so a stale session for a deleted account does not
+    cost a query per request either. ``version()``, if given, returns a
+    counter that changes with any user; an entry loaded at another version
+    is a miss, whichever process made the change.
+    """
+
+    def __init__(self, loader, ttl=5.0, max_entries=1024, version=None):
+        self.loader = loader
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = version
+        self._entries = OrderedDict()  # user_id -> (user or None, expires, version)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def get(self, user_id):
+        # Read before loading, so an entry is never newer than its version says
+        version = self.version() if self.version is not None else None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id, _MISSING)
+            if entry is not _MISSING and entry[1] >= now and entry[2] == version:
+                self._entries.move_to_end(user_id)
+                self._stats['hits'] += 1
+                return entry[0]
+            self._stats['misses'] += 1
+        user = self.loader(user_id)
+        self.put(user_id, user, version)
+        return user
+
+    def put(self, user_id, user, version=None):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (user, time.monotonic() + self.ttl, version)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        """Forget ``user_id``, or every user when it is None."""
+        with self._lock:
+            if user_id is None:
+                self._stats['invalidations'] += len(self._entries)
+                self._entries.clear()
+            elif self._entries.pop(user_id, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        stats['max_entries'] = self.max_entries
+        stats['ttl'] = self.ttl
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+class HasherBusy(Exception):
+    """Every hashing slot stayed taken for the whole wait."""
+
+
+class PasswordHasher:
+    """Bounded pool for generating and checking password hashes.
+
+    ``method`` is any werkzeug method string, e.g. ``scrypt`` or
+    ``pbkdf2:sha256:600000``. At most ``workers`` hashes run at once and at
+    most ``max_pending`` are queued or running; a caller that cannot get a
+    slot within ``wait`` seconds gets HasherBusy. With ``workers=0`` hashing
+    happens in the calling thread.
+    """
+
+    def __init__(self, method='scrypt', workers=2, max_pending=32, wait=10.0):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='password-hash') if workers > 0 else None
+        self._prefix = None
+        self._lock = threading.Lock()
+        self._stats = {'hashes': 0, 'checks': 0, 'busy': 0}
+
+    def _run(self, stat, func, *args):
+        if not self._slots.acquire(timeout=self.wait):
+            with self._lock:
+                self._stats['busy'] += 1
+            raise HasherBusy('Too many sign-ins at once, try again shortly')
+        try:
+            if self._executor is None:
+                result = func(*args)
+            else:
+                result = self._executor.submit(func, *args).result()
+        finally:
+            self._slots.release()
+        with self._lock:
+            self._stats[stat] += 1
+        return result
+
+    def hash(self, password):
+        return self._run('hashes', generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run('checks', check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if ``pwhash`` was made with other settings than ``method``."""
+        if self._prefix is None:
+            # werkzeug fills in default parameters ("scrypt" -> "scrypt:32768:8:1"),
+            # so ask it once what the configured method expands to
+            self._prefix = self.hash('').split('$', 1)[0]
+        return pwhash.split('$', 1)[0] != self._prefix
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['method'] = self.method
+        stats['workers'] = self.workers
+        stats['max_pending'] = self.max_pending
+        return stats
+
+
+class LoginThrottle:
+    """Failed sign-ins per key (a username or an address) in a sliding window.
+
+    Failures are recorded in the ``login_failures`` table under ``scope``,
+    so every worker process counts the same ones and the limit applies to
+    the server as a whole. ``connect()`` returns a database connection;
+    closing it hands it back. Once a key has ``max_failures`` failures
+    within ``window`` seconds, ``retry_after(key)`` says how long until the
+    oldest one ages out. Only the last ``max_failures`` failures per key are
+    kept, and rows older than the window are deleted as new ones come in.
+    So a flood of made-up usernames cannot grow the table beyond what
+    arrives within one window.
+    """
+
+    def __init__(self, connect, scope, max_failures=5, window=300.0):
+        self.connect = connect
+        self.scope = scope
+        self.max_failures = max_failures
+        self.window = window
+        self._lock = threading.Lock()
+        self._stats = {'failures': 0, 'throttled': 0}
+
+    def retry_after(self, key):
+        """Seconds ``key`` must wait before trying again, or 0."""
+        if self.max_failures <= 0:
+            return 0
+        now = time.time()  # wall clock: timestamps are compared across processes
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            rows = cursor.execute("""SELECT at FROM login_failures WHERE scope = ? AND key = ? AND at > ?
+                                     ORDER BY at DESC LIMIT ?""",
+                                  (self.scope, key, now - self.window, self.max_failures)).fetchall()
+        finally:
+            conn.close()
+        if len(rows) < self.max_failures:
+            return 0
+        with self._lock:
+            self._stats['throttled'] += 1
+        return rows[-1][0] + self.window - now
+
+    def failed(self, key):
+        if self.max_failures <= 0:
+            return
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT INTO login_failures (scope, key, at) VALUES (?,?,?)", (self.scope, key, now))
+            conn.execute("DELETE FROM login_failures WHERE at <= ?", (now - self.window,))
+            conn.execute("""DELETE FROM login_failures WHERE scope = ? AND key = ? AND at < (
+                                SELECT at FROM login_failures WHERE scope = ? AND key = ?
+                                ORDER BY at DESC LIMIT 1 OFFSET ?)""",
+                         (self.scope, key, self.scope, key, self.max_failures - 1))
+            conn.commit()
+        finally:
+            conn.close()  # rolls back whatever did not commit
+        with self._lock:
+            self._stats['failures'] += 1
+
+    def reset(self, key):
+        conn = self.connect()
+        try:
+            conn.execute("DELETE FROM login_failures WHERE scope = ? AND key = ?", (self.scope, key))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def stats(self):
+        """This process's counters, and the keys currently failing across all processes."""
+        with self._lock:
+            stats = dict(self._stats)
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            stats['keys'] = cursor.execute("SELECT COUNT(DISTINCT key) FROM login_failures WHERE scope = ? AND at > ?",
+                                           (self.scope, time.time() - self.window)).fetchone()[0]
+        finally:
+            conn.close()
+        stats['max_failures'] = self.max_failures
+        stats['window'] = self.window
+        return stats
@@ -0,0 +1,278 @@
+"""Benchmark: a mixed POS workload over HTTP, with latency percentiles per endpoint.
+
+Seeds a scratch database with a catalogue and some sales history, starts
+serve.py on it and replays a weighted mix of till and back-office traffic:
+sales, stock intakes, dashboard polls, inventory reloads, product searches
+and sales listings. Each connection keeps its ETags and sends If-None-Match
+the way a browser does, so polls that find nothing new are answered 304.
+
+Writes a JSON report (throughput and p50/p95/p99 per endpoint plus the
+settings used) to --output, and a table to stderr. --baseline compares the
+run with an earlier report.
+
+    python benchmarks/bench_api.py --concurrency 16 --seconds 20 --output after.json --baseline before.json
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_serve import ROOT, free_port, wait_until_up
+
+BRANDS = ('Oraimo', 'Itel', 'Tecno', 'Linkco', 'Connect', 'Turbo')
+KINDS = ('CABLE TYPE C', 'CABLE IPHONE', 'CHARGER', 'POWER BANK 20000MAH', 'EARPIECE', 'EARBUDS')
+CUSTOMERS = ('Walk-in', 'Ade Stores', 'Bola Ventures', 'Chika Mart', 'Dayo Phones', 'Emeka Gadgets')
+
+
+def product_names(count):
+    return [f"{BRANDS[i % len(BRANDS)].upper()} {KINDS[i // len(BRANDS) % len(KINDS)]} {i:04d}" for i in range(count)]
+
+
+def make_mix(products):
+    """Endpoint name -> (weight, request builder returning method, path, body)."""
+    def sale(rng):
+        items = [{'name': rng.choice(products), 'quantity': rng.randint(1, 3), 'price': rng.choice((1500, 2500, 12000))}
+                 for _ in range(rng.randint(1, 4))]
+        return 'POST', '/api/create-sale', {'customer': rng.choice(CUSTOMERS), 'items': items,
+                                           'payment_status': rng.choice(('Paid', 'Paid', 'Paid', 'Pending'))}
+
+    def intake(rng):
+        return 'POST', '/api/add-entry', {'name': rng.choice(products), 'quantity': rng.randint(5, 50),
+                                          'type': 'Intake'}
+
+    def search(rng):
+        name = rng.choice(products)
+        return 'GET', f"/api/products/search?q={name.split()[0][:rng.randint(2, 5)].lower()}", None
+
+    return {
+        'create-sale': (15, sale),
+        'add-entry': (5, intake),
+        'products/search': (25, search),
+        'inventory': (15, lambda rng: ('GET', '/api/inventory', None)),
+        'dashboard-metrics': (20, lambda rng: ('GET', '/api/dashboard-metrics', None)),
+        'dashboard': (10, lambda rng: ('GET', '/api/dashboard', None)),
+        'sales': (10, lambda rng: ('GET', '/api/sales?limit=50', None)),
+    }
+
+
+def seed(workdir, products, sales):
+    """Create the scratch database: migrated schema, catalogue and sales history."""
+    sys.path.insert(0, ROOT)
+    import app as inventory_app
+
+    database = os.path.join(workdir, 'inventory.db')
+    app = inventory_app.create_app({'DATABASE': database, 'DOCUMENT_STORE_DIR': os.path.join(workdir, 'documents'),
+                                    'PDF_WORKERS': 0})
+    inventory_app.init_db(app)
+    conn = sqlite3.connect(database)
+    conn.executemany("INSERT INTO products (name, quantity, reorder_level, price, brand) VALUES (?,?,?,?,?)",
+                     ((name, 10 ** 9, 5, 2500.0, name.split()[0].title()) for name in products))
+    conn.commit()
+    conn.close()
+    client, rng = app.test_client(), random.Random(0)
+    sale = make_mix(products)['create-sale'][1]
+    for _ in range(sales):
+        client.post('/api/create-sale', json=sale(rng)[2])
+    return database
+
+
+def client(port, connections, products, start_at, warmup, seconds, conditional, seed_value):
+    """One client process: ``connections`` threads, each with its own keep-alive connection.
+
+    Returns endpoint name -> {'latencies': [...], 'status': {code: count}}, for
+    requests started after the warm-up.
+    """
+    import threading
+
+    results, lock = {}, threading.Lock()
+    mix = make_mix(products)
+    names = list(mix)
+    weights = [mix[name][0] for name in names]
+
+    def run(index):
+        rng = random.Random(seed_value * 1000 + index)
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        etags, mine = {}, {name: {'latencies': [], 'status': {}} for name in names}
+        while time.time() < start_at:
+            time.sleep(0.01)
+        measure_from, end = start_at + warmup, start_at + warmup + seconds
+        while True:
+            now = time.time()
+            if now >= end:
+                break
+            name = rng.choices(names, weights)[0]
+            method, path, body = mix[name][1](rng)
+            headers = {}
+            if body is not None:
+                body = json.dumps(body)
+                headers['Content-Type'] = 'application/json'
+            elif conditional and path in etags:
+                headers['If-None-Match'] = etags[path]
+            begin = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+                if response.getheader('ETag'):
+                    etags[path] = response.getheader('ETag')
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                status = 'error'
+            elapsed = time.perf_counter() - begin
+            if now < measure_from:
+                continue
+            entry = mine[name]
+            entry['status'][status] = entry['status'].get(status, 0) + 1
+            if status in (200, 304):
+                entry['latencies'].append(elapsed)
+        conn.close()
+        with lock:
+            for name, entry in mine.items():
+                total = results.setdefault(name, {'latencies': [], 'status': {}})
+                total['latencies'].extend(entry['latencies'])
+                for status, count in entry['status'].items():
+                    total['status'][status] = total['status'].get(status, 0) + count
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000 if ordered else None
+
+
+def summarize(latencies, status, seconds):
+    ordered = sorted(latencies)
+    requests = sum(status.values())
+    return {
+        'requests': requests,
+        'errors': requests - len(ordered),
+        'rps': round(len(ordered) / seconds, 2),
+        'p50_ms': round(percentile(ordered, 0.50), 3) if ordered else None,
+        'p95_ms': round(percentile(ordered, 0.95), 3) if ordered else None,
+        'p99_ms': round(percentile(ordered, 0.99), 3) if ordered else None,
+        'max_ms': round(ordered[-1] * 1000, 3) if ordered else None,
+        'status': {str(code): count for code, count in sorted(status.items(), key=str)},
+    }
+
+
+def print_table(report, baseline=None):
+    def delta(name, key):
+        before = ((baseline or {}).get('endpoints', {}).get(name) or {}).get(key) if name != 'all' \
+            else (baseline or {}).get('total', {}).get(key)
+        after = report['endpoints'][name][key] if name != 'all' else report['total'][key]
+        if not before or after is None:
+            return ''
+        return f"{(after - before) / before * 100:+.0f}%"
+
+    header = f"{'endpoint':<18} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}"
+    if baseline:
+        header += f" {'Δreq/s':>7} {'Δp50':>6} {'Δp95':>6} {'Δp99':>6}"
+    print(header, file=sys.stderr)
+    rows = [(name, report['endpoints'][name]) for name in report['endpoints']] + [('all', report['total'])]
+    for name, stats in rows:
+        cells = [f"{stats[key]:>8.2f}" if stats[key] is not None else f"{'-':>8}"
+                 for key in ('p50_ms', 'p95_ms', 'p99_ms')]
+        line = f"{name:<18} {stats['rps']:>8.1f} {' '.join(cells)} {stats['errors']:>7}"
+        if baseline:
+            line += f" {delta(name, 'rps'):>7}" + ''.join(f" {delta(name, key):>6}" for key in ('p50_ms', 'p95_ms', 'p99_ms'))
+        print(line, file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=8, help='keep-alive connections in total')
+    parser.add_argument('--clients', type=int, default=0,
+                        help='client processes the connections are spread over (default: up to the CPU count)')
+    parser.add_argument('--seconds', type=float, default=20.0, help='measured duration')
+    parser.add_argument('--warmup', type=float, default=3.0, help='seconds of traffic before measuring')
+    parser.add_argument('--workers', type=int, default=1, help='serve.py worker processes')
+    parser.add_argument('--threads', type=int, default=16, help='serve.py threads per worker')
+    parser.add_argument('--products', type=int, default=500, help='catalogue size')
+    parser.add_argument('--sales', type=int, default=300, help='sales created before the run')
+    parser.add_argument('--no-conditional', dest='conditional', action='store_false',
+                        help='never send If-None-Match, so every read is answered in full')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='-', help='JSON report file; - for stdout')
+    parser.add_argument('--baseline', help='earlier JSON report to compare with')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_api_')
+    products = product_names(args.products)
+    database = seed(workdir, products, args.sales)
+    mix = make_mix(products)
+
+    clients = args.clients or max(1, min(args.concurrency, os.cpu_count() or 1))
+    shares = [args.concurrency // clients + (i < args.concurrency % clients) for i in range(clients)]
+    shares = [share for share in shares if share]
+
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=ROOT, DATABASE=database, DOCUMENT_STORE_DIR=os.path.join(workdir, 'documents'))
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'serve.py'), '--host', '127.0.0.1',
+                               '--port', str(port), '--workers', str(args.workers), '--threads', str(args.threads),
+                               '--no-access-log'],
+                              cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(port)
+        start_at = time.time() + 1.0
+        with multiprocessing.get_context('spawn').Pool(len(shares)) as pool:
+            parts = pool.starmap(client, [(port, share, products, start_at, args.warmup, args.seconds, args.conditional,
+                                           args.seed * 100 + i) for i, share in enumerate(shares)])
+    finally:
+        server.terminate()
+        server.wait()
+
+    endpoints, all_latencies, all_status = {}, [], {}
+    for name in mix:
+        latencies, status = [], {}
+        for part in parts:
+            entry = part.get(name, {'latencies': [], 'status': {}})
+            latencies.extend(entry['latencies'])
+            for code, count in entry['status'].items():
+                status[code] = status.get(code, 0) + count
+        endpoints[name] = summarize(latencies, status, args.seconds)
+        all_latencies.extend(latencies)
+        for code, count in status.items():
+            all_status[code] = all_status.get(code, 0) + count
+
+    report = {
+        'benchmark': 'bench_api',
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(start_at)),
+        'settings': {key: getattr(args, key) for key in ('concurrency', 'seconds', 'warmup', 'workers', 'threads',
+                                                         'products', 'sales', 'conditional', 'seed')},
+        'mix': {name: weight for name, (weight, _) in mix.items()},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count(), 'clients': len(shares)},
+        'total': summarize(all_latencies, all_status, args.seconds),
+        'endpoints': endpoints,
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_table(report, baseline)
+    text = json.dumps(report, indent=2)
+    if args.output == '-':
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
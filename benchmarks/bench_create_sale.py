@@ -0,0 +1,61 @@
+"""Benchmark: /api/create-sale latency against the number of lines per sale.
+
+Runs the real endpoint through Flask's test client on a scratch database
+seeded with a catalogue, so validation, locking and every write are included.
+
+    python benchmarks/bench_create_sale.py --lines 1 5 10 20 40 80 --sales 50
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, nargs='+', default=[1, 5, 10, 20, 40, 80])
+    parser.add_argument('--sales', type=int, default=50, help='sales timed per line count')
+    parser.add_argument('--products', type=int, default=500)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_sale_')
+    import app as inventory_app  # noqa: E402
+
+    app = inventory_app.create_app({'DATABASE': os.path.join(workdir, 'inventory.db')})
+    inventory_app.init_db(app)
+    seed = sqlite3.connect(os.path.join(workdir, 'inventory.db'))
+    seed.executemany("INSERT INTO products (name, quantity, reorder_level, price, brand) VALUES (?,?,?,?,?)",
+                     ((f"ITEM {i:05d}", 10 ** 9, 5, 100.0, 'Bench') for i in range(args.products)))
+    seed.commit()
+
+    client = app.test_client()
+    print(f"{'lines':>6} {'median ms':>10} {'p95 ms':>10} {'ms/line':>10}")
+    for count in args.lines:
+        # One duplicated name per sale keeps the aggregation path honest
+        items = [{'name': f"ITEM {i % args.products:05d}", 'quantity': 1, 'price': 100} for i in range(count - 1)]
+        items.append({'name': 'ITEM 00000', 'quantity': 1, 'price': 100})
+        timings = []
+        for _ in range(args.sales):
+            start = time.perf_counter()
+            response = client.post('/api/create-sale', json={'customer': 'Bench', 'items': items,
+                                                             'payment_status': 'Paid'})
+            timings.append(time.perf_counter() - start)
+            result = response.get_json()
+            if not result.get('success'):
+                sys.exit(f"create-sale failed: {result}")
+        timings.sort()
+        median = statistics.median(timings) * 1000
+        p95 = timings[int(len(timings) * 0.95) - 1] * 1000
+        print(f"{count:>6} {median:>10.2f} {p95:>10.2f} {median / count:>10.3f}")
+
+    seed.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Benchmark: /api/invoice/<sale_num> rendered inline versus in the worker pool.
+
+Runs the real endpoint through Flask's test client on a scratch database
+with a batch of multi-line sales. Each mode first renders every sale once
+from several threads at the same time (cold), then requests them all again
+(cached, served from the document store). Each mode gets an empty store.
+
+    python benchmarks/bench_invoices.py --sales 40 --lines 20 --threads 8
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def run(app, sale_nums, threads):
+    """Fetch every sale's PDF from ``threads`` threads; return per-request latencies."""
+    timings, lock = [], threading.Lock()
+    pending = list(sale_nums)
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                if not pending:
+                    return
+                sale_num = pending.pop()
+            start = time.perf_counter()
+            response = client.get(f'/api/invoice/{sale_num}')
+            elapsed = time.perf_counter() - start
+            if response.status_code != 200:
+                sys.exit(f"invoice {sale_num} failed: {response.status_code}")
+            with lock:
+                timings.append(elapsed)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return timings, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sales', type=int, default=40)
+    parser.add_argument('--lines', type=int, default=20, help='lines per sale')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='render processes in pool mode')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_invoices_')
+    import app as inventory_app
+
+    app = inventory_app.create_app({'DATABASE': os.path.join(workdir, 'inventory.db'),
+                                    'DOCUMENT_STORE_DIR': os.path.join(workdir, 'documents')})
+    client = app.test_client()
+    sale_nums = []
+    for i in range(args.sales):
+        items = [{'name': f"BENCH ITEM {line:03d}", 'quantity': 1, 'price': 100 + line} for line in range(args.lines)]
+        sale_nums.append(client.post('/api/create-sale', json={'customer': f'Bench {i}', 'items': items}).get_json()['sale_num'])
+
+    print(f"{'mode':<8} {'pass':<7} {'wall s':>8} {'median ms':>10} {'p95 ms':>10}")
+    for mode, workers in (('inline', 0), ('pool', args.workers)):
+        app.config['PDF_WORKERS'] = workers
+        app.config['DOCUMENT_STORE_DIR'] = os.path.join(workdir, f'documents-{mode}')
+        app.extensions.pop('invoice_renderer', None)
+        app.extensions.pop('document_store', None)
+        for label in ('cold', 'cached'):
+            timings, wall = run(app, sale_nums, args.threads)
+            timings.sort()
+            print(f"{mode:<8} {label:<7} {wall:>8.2f} {statistics.median(timings) * 1000:>10.2f} "
+                  f"{timings[int(len(timings) * 0.95) - 1] * 1000:>10.2f}")
+        with app.app_context():
+            inventory_app.get_invoice_renderer().shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Micro-benchmark: row factories and JSON encoding for listing endpoints.
+
+Compares the original per-row ``dict_factory`` + ``json.dumps`` path with the
+cached-column ``RowFactory`` and the SQLite-encoded ``json_select`` path.
+
+    python benchmarks/bench_rows.py --rows 100000
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import RowFactory, json_select, json_rows  # noqa: E402
+
+
+def legacy_dict_factory(cursor, row):
+    d = {}
+    for idx, col in enumerate(cursor.description):
+        d[col[0]] = row[idx]
+    return d
+
+
+def build_db(rows):
+    conn = sqlite3.connect(':memory:')
+    conn.execute('''CREATE TABLE sales
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT, sale_num TEXT UNIQUE, customer TEXT,
+                     date TEXT, time TEXT, total_amount REAL, payment_status TEXT)''')
+    conn.executemany("INSERT INTO sales (sale_num, customer, date, time, total_amount, payment_status) "
+                     "VALUES (?,?,?,?,?,?)",
+                     ((f"SALE-{i:08d}", f"Customer {i % 500}", f"2026-01-{i % 28 + 1:02d}",
+                       "12:00:00", i * 1.5, 'Paid') for i in range(rows)))
+    conn.commit()
+    return conn
+
+
+def bench(label, fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<40} {best * 1000:9.1f} ms")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    conn = build_db(args.rows)
+    query = "SELECT * FROM sales ORDER BY date DESC, time DESC"
+
+    def legacy():
+        conn.row_factory = legacy_dict_factory
+        rows = [dict(row) for row in conn.execute(query).fetchall()]
+        return json.dumps(rows)
+
+    def cached_factory():
+        conn.row_factory = RowFactory()
+        return json.dumps(conn.execute(query).fetchall())
+
+    def zero_copy():
+        conn.row_factory = None
+        return json_rows(conn.execute(query.replace('*', json_select(conn, 'sales'), 1)))
+
+    print(f"{args.rows} rows, best of {args.repeat}")
+    base = bench('dict_factory + dict() copy + json.dumps', legacy, args.repeat)
+    for label, fn in (('RowFactory + json.dumps', cached_factory),
+                      ('json_select + json_rows', zero_copy)):
+        took = bench(label, fn, args.repeat)
+        print(f"{'':<40} {base / took:9.2f}x")
+
+    assert json.loads(legacy()) == json.loads(zero_copy())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Benchmark: throughput of serve.py as the number of worker processes grows.
+
+Starts serve.py on a copy of inventory.db once per worker count and drives it
+over real HTTP from separate client processes, each with a few keep-alive
+connections cycling through read endpoints, for a fixed time. Prints
+requests per second and latency percentiles per worker count.
+
+    python benchmarks/bench_serve.py --workers 1 2 4 --clients 4 --connections 4 --seconds 10
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PATHS = ('/api/inventory', '/api/dashboard', '/api/sales?limit=50', '/api/transactions?limit=50',
+         '/api/sales-summary')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(port, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/login')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    sys.exit(f"server on port {port} did not come up")
+
+
+def client(port, connections, seconds, start_at):
+    """One client process: ``connections`` threads, each with its own keep-alive connection."""
+    import threading
+
+    latencies, errors, lock = [], [0], threading.Lock()
+
+    def run(offset):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        mine, i = [], offset
+        while time.time() < start_at:
+            time.sleep(0.01)
+        end = start_at + seconds
+        while time.time() < end:
+            path = PATHS[i % len(PATHS)]
+            i += 1
+            begin = time.perf_counter()
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                ok = False
+            if ok:
+                mine.append(time.perf_counter() - begin)
+            else:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def measure(workers, args, workdir):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'serve.py'), '--port', str(port),
+                               '--host', '127.0.0.1', '--workers', str(workers), '--threads', str(args.threads),
+                               '--no-access-log'],
+                              cwd=workdir, env=dict(os.environ, PYTHONPATH=ROOT),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(port)
+        start_at = time.time() + 1.0
+        with multiprocessing.get_context('spawn').Pool(args.clients) as pool:
+            results = pool.starmap(client, [(port, args.connections, args.seconds, start_at)] * args.clients)
+    finally:
+        server.terminate()
+        server.wait()
+    latencies = sorted(latency for result, _ in results for latency in result)
+    errors = sum(count for _, count in results)
+    if not latencies:
+        sys.exit(f"no successful requests with {workers} workers")
+    pick = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+    return len(latencies) / args.seconds, pick(0.5), pick(0.95), pick(0.99), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='worker counts to compare')
+    parser.add_argument('--threads', type=int, default=8, help='threads per worker')
+    parser.add_argument('--clients', type=int, default=4, help='client processes')
+    parser.add_argument('--connections', type=int, default=4, help='keep-alive connections per client process')
+    parser.add_argument('--seconds', type=float, default=10.0, help='measured seconds per worker count')
+    parser.add_argument('--db', default=os.path.join(ROOT, 'inventory.db'), help='database to copy and serve')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_serve_')
+    if os.path.exists(args.db):
+        shutil.copy(args.db, os.path.join(workdir, 'inventory.db'))
+
+    print(f"{os.cpu_count()} CPUs, {args.clients * args.connections} connections, {args.threads} threads per worker")
+    print(f"{'workers':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for workers in args.workers:
+        rate, p50, p95, p99, errors = measure(workers, args, workdir)
+        print(f"{workers:>7} {rate:>9.0f} {p50:>8.2f} {p95:>8.2f} {p99:>8.2f} {errors:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ReadCache:
+    """Bounded LRU cache with TTL for rendered read responses.
+
+    Entries are tagged with the tables they were built from;
+    ``invalidate(*tags)`` drops every entry touching any of them. Each entry
+    also remembers the data version it was built at, so a lookup with a newer
+    version misses even if the write happened in another process.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=16 * 1024 * 1024, ttl=30.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (version, body, mimetype, expires, tags)
+        self._tags = {}  # tag -> set of keys
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version or entry[3] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[1], entry[2]
+
+    def set(self, key, version, body, mimetype, tags):
+        if self.max_entries <= 0 or len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (version, body, mimetype, time.monotonic() + self.ttl, tags)
+            self._bytes += len(body)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            self._stats['stores'] += 1
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self._stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        # Caller holds the lock
+        version, body, mimetype, expires, tags = self._entries.pop(key)
+        self._bytes -= len(body)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        stats['max_entries'] = self.max_entries
+        stats['max_bytes'] = self.max_bytes
+        stats['ttl'] = self.ttl
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,111 @@
+"""Check that a request never picks up a connection another thread checked out.
+
+Runs on a scratch database. First a fixed interleaving: thread A gets a
+connection and closes it, thread B checks the same connection out of the
+pool, then A asks for a connection again and must get a different one.
+Then several threads repeat get / close / get / write / read in their own
+app contexts while the others do the same, and every connection handed out
+must belong to the thread using it.
+
+    python check_connection_reuse.py --threads 8 --rounds 500
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--rounds', type=int, default=500, help='get/close cycles per thread')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='conn_reuse_')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as inventory_app
+
+    app = inventory_app.create_app({'DATABASE': os.path.join(workdir, 'inventory.db'),
+                                    'DATABASE_POOL_SIZE': args.threads})
+    inventory_app.init_db(app)
+    problems = []
+
+    # Fixed interleaving
+    closed, taken, done = threading.Event(), threading.Event(), threading.Event()
+    seen = {}
+
+    def thread_a():
+        with app.app_context():
+            first = inventory_app.get_db_connection()
+            first.close()
+            closed.set()
+            taken.wait()
+            again = inventory_app.get_db_connection()
+            seen['a'] = (first, again, again._owner == threading.get_ident())
+            done.set()
+
+    def thread_b():
+        closed.wait()
+        with app.app_context():
+            conn = inventory_app.get_db_connection()
+            seen['b'] = conn
+            taken.set()
+            done.wait()
+
+    pair = [threading.Thread(target=thread_a), threading.Thread(target=thread_b)]
+    for thread in pair:
+        thread.start()
+    for thread in pair:
+        thread.join()
+    first, again, owned = seen['a']
+    if again is seen['b'] or not owned:
+        problems.append("a closed connection was reused after another thread checked it out")
+    elif seen['b'] is not first:
+        print("note  the pool did not hand A's connection to B; interleaving not exercised")
+
+    # Free-running threads
+    errors, lock = [], threading.Lock()
+
+    def worker(index):
+        for round_ in range(args.rounds):
+            try:
+                with app.app_context():
+                    conn = inventory_app.get_db_connection()
+                    conn.execute("SELECT 1").fetchone()
+                    conn.close()
+                    conn = inventory_app.get_db_connection()
+                    if conn._owner != threading.get_ident():
+                        raise AssertionError("got a connection owned by another thread")
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.execute("INSERT INTO expenses (description, amount, category, date) VALUES (?,?,?,?)",
+                                 (f"reuse {index} {round_}", 1, 'Check', '2026-01-01'))
+                    conn.commit()
+                    conn.close()
+            except Exception as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        problems.append(f"{len(errors)} of {args.threads * args.rounds} rounds failed, e.g. {errors[0]}")
+
+    with app.app_context():
+        conn = inventory_app.get_db_connection()
+        count = conn.execute("SELECT COUNT(*) AS n FROM expenses WHERE category = 'Check'").fetchone()['n']
+    if not errors and count != args.threads * args.rounds:
+        problems.append(f"{count} of {args.threads * args.rounds} writes stored")
+
+    for problem in problems:
+        print(f"FAIL  {problem}")
+    if problems:
+        sys.exit(1)
+    print(f"ok    {args.threads} threads x {args.rounds} rounds, every connection owned by its user")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Create sales concurrently from several processes and threads; none may be lost.
+
+Runs on a scratch database in a temporary directory. Every worker process
+imports the app against the same inventory.db and fires sales from its own
+threads as fast as it can. Afterwards every request must have succeeded,
+every sale number must be unique and present in the sales table, and sale
+numbers must sort in the order the sales were written. It also checks that
+more than MAX_SEQ numbers within one second still sort in issue order.
+
+    python check_document_numbers.py --processes 4 --threads 4 --sales 100
+"""
+import argparse
+import datetime
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_process(workdir, threads, sales):
+    sys.path.insert(0, ROOT)
+    import app as inventory_app
+
+    app = inventory_app.create_app({'DATABASE': os.path.join(workdir, 'inventory.db')})
+    inventory_app.init_db(app)
+
+    issued, failures, lock = [], [], threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        for _ in range(sales):
+            # Unknown items move no stock, so only numbering and inserts contend
+            response = client.post('/api/create-sale', json={'customer': 'Numbering', 'payment_status': 'Paid',
+                                                             'items': [{'name': 'NUMBERING', 'quantity': 1, 'price': 1}]})
+            result = response.get_json() or {}
+            with lock:
+                if result.get('success'):
+                    issued.append(result['sale_num'])
+                else:
+                    failures.append(f"{response.status_code} {result.get('error')}")
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return issued, failures
+
+
+def check_rollover():
+    """More than MAX_SEQ numbers in one frozen second must stay unique and ordered."""
+    sys.path.insert(0, ROOT)
+    from migrations import m009_document_numbers
+    from numbering import MAX_SEQ, next_document_number
+
+    conn = sqlite3.connect(':memory:')
+    m009_document_numbers(conn)
+    now = datetime.datetime(2026, 1, 2, 3, 4, 5)
+    nums = [next_document_number(conn, 'SALE', now) for _ in range(MAX_SEQ + 2)]
+    nums.append(next_document_number(conn, 'SALE', now + datetime.timedelta(seconds=1)))
+    conn.close()
+    return len(set(nums)) == len(nums) and nums == sorted(nums)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4, help='threads per process')
+    parser.add_argument('--sales', type=int, default=100, help='sales per thread')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='numbering_')
+    # Migrate once up front rather than racing the workers' first requests
+    run_process(workdir, 0, 0)
+
+    start = time.perf_counter()
+    with multiprocessing.get_context('spawn').Pool(args.processes) as pool:
+        results = pool.starmap(run_process, [(workdir, args.threads, args.sales)] * args.processes)
+    elapsed = time.perf_counter() - start
+
+    issued = [num for nums, _ in results for num in nums]
+    failures = [failure for _, errors in results for failure in errors]
+    expected = args.processes * args.threads * args.sales
+
+    conn = sqlite3.connect(os.path.join(workdir, 'inventory.db'))
+    stored = [row[0] for row in conn.execute("SELECT sale_num FROM sales ORDER BY id")]
+    conn.close()
+
+    print(f"{len(issued)} of {expected} sales in {elapsed:.2f}s ({len(issued) / elapsed:.0f}/s)")
+    problems = []
+    if failures:
+        problems.append(f"{len(failures)} failed, e.g. {failures[0]}")
+    if len(set(issued)) != len(issued):
+        problems.append(f"{len(issued) - len(set(issued))} duplicate sale numbers")
+    if sorted(stored) != sorted(issued):
+        problems.append("sales table does not match the numbers handed out")
+    if stored != sorted(stored):
+        problems.append("sale numbers do not sort in insertion order")
+    if not check_rollover():
+        problems.append("numbers past the per-second counter do not sort in issue order")
+    for problem in problems:
+        print(f"FAIL  {problem}")
+    if problems:
+        sys.exit(1)
+    print("ok    all sale numbers unique, stored and in order")
+
+
+if __name__ == '__main__':
+    main()
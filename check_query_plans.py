@@ -0,0 +1,92 @@
+"""Check that the hot query shapes are answered from an index, not a table scan.
+
+Builds a scratch database from the migrations and runs EXPLAIN QUERY PLAN on
+the queries issued by the listing, summary and delete routes. Exits non-zero
+if any of them falls back to a full scan or a temporary sort.
+
+    python check_query_plans.py
+"""
+import re
+import sqlite3
+import sys
+
+from migrations import migrate
+
+# Listing routes go through list_page(): newest first on (date, time, id)
+PAGE_ORDER = " ORDER BY date DESC, time DESC, id DESC LIMIT 101"
+ALLOW_SORT = 'allow_sort'
+
+QUERIES = {
+    'get_transactions date': ("SELECT * FROM transactions WHERE date >= ? AND date <= ?"
+                              " ORDER BY date DESC, time DESC, id DESC", ('2026-01-01', '2026-01-01')),
+    'get_transactions date+type': ("SELECT * FROM transactions WHERE type=? AND date >= ? AND date <= ?"
+                                   " ORDER BY date DESC, time DESC, id DESC", ('Supply', '2026-01-01', '2026-01-01')),
+    'get_transactions latest': ("SELECT * FROM transactions" + PAGE_ORDER, ()),
+    'get_transactions type': ("SELECT * FROM transactions WHERE type=?" + PAGE_ORDER, ('Intake',)),
+    'get_transactions range page': ("SELECT * FROM transactions WHERE type=? AND date >= ? AND (date, time, id) < (?, ?, ?)"
+                                    + PAGE_ORDER, ('Intake', '2026-01-01', '2026-01-31', '12:00:00', 500)),
+    'get_sales date': ("SELECT * FROM sales WHERE date >= ? AND date <= ? ORDER BY date DESC, time DESC, id DESC",
+                       ('2026-01-01', '2026-01-01')),
+    'get_sales latest': ("SELECT * FROM sales" + PAGE_ORDER, ()),
+    'get_sales page': ("SELECT * FROM sales WHERE (date, time, id) < (?, ?, ?)" + PAGE_ORDER,
+                       ('2026-01-31', '12:00:00', 500)),
+    # Only the matching rows are sorted, never the whole table
+    'get_sales customer': ("SELECT * FROM sales WHERE id IN (SELECT rowid FROM sales_customer_fts "
+                           "WHERE sales_customer_fts MATCH ?)" + PAGE_ORDER, ('"deli"*',), ALLOW_SORT),
+    'get_sales_summary date': ("SELECT SUM(count), SUM(total) FROM sales_daily WHERE date=?", ('2026-01-01',)),
+    'get_sale_details items': ("SELECT * FROM sale_items WHERE sale_num=?", ('SALE-1',)),
+    'get_expenses date': ("SELECT * FROM expenses WHERE date >= ? AND date <= ? ORDER BY date DESC, time DESC, id DESC",
+                          ('2026-01-01', '2026-01-01')),
+    'get_expenses category': ("SELECT * FROM expenses WHERE category=?" + PAGE_ORDER, ('Rent',)),
+    'get_expenses date+category': ("SELECT * FROM expenses WHERE category=? AND date >= ? AND date <= ?"
+                                   " ORDER BY date DESC, time DESC, id DESC", ('Rent', '2026-01-01', '2026-01-01')),
+    'get_expenses range page': ("SELECT * FROM expenses WHERE date >= ? AND (date, time, id) < (?, ?, ?)" + PAGE_ORDER,
+                                ('2026-01-01', '2026-01-31', '12:00:00', 500)),
+    'get_expenses_summary date': ("SELECT category, SUM(total) FROM expenses_daily WHERE date=? GROUP BY category",
+                                  ('2026-01-01',)),
+    'products_search prefix': ("SELECT p.id FROM products_fts JOIN products p ON p.id = products_fts.rowid "
+                               "WHERE products_fts MATCH ? ORDER BY bm25(products_fts) LIMIT 10",
+                               ('"chr"*',), ALLOW_SORT),
+    'product by name': ("SELECT quantity FROM products WHERE name=?", ('Cable',)),
+    'delete_sale items': ("DELETE FROM sale_items WHERE sale_num=?", ('SALE-1',)),
+    'delete_sale transactions': ("DELETE FROM transactions WHERE ref=? AND type='Supply'", ('SALE-1',)),
+    'changes since': ("SELECT seq, tbl, row_id, deleted FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?", (0, 1000)),
+    'sync_operations prune': ("DELETE FROM sync_operations WHERE created_at < ?", ('2026-01-01',)),
+    'login_failures recent': ("SELECT at FROM login_failures WHERE scope = ? AND key = ? AND at > ? ORDER BY at DESC"
+                              " LIMIT ?", ('username', 'admin', 0.0, 5)),
+    'login_failures prune': ("DELETE FROM login_failures WHERE at <= ?", (0.0,)),
+    # export_invoices() walks the range oldest first, a batch at a time
+    'export first batch': ("SELECT * FROM sales WHERE date >= ? AND date <= ? ORDER BY date, time, id LIMIT 100",
+                           ('2026-01-01', '2026-01-31')),
+    'export next batch': ("SELECT * FROM sales WHERE (date, time, id) > (?, ?, ?) AND date <= ? ORDER BY date, time, id"
+                          " LIMIT 100", ('2026-01-01', '12:00:00', 500, '2026-01-31')),
+    'export items': ("SELECT * FROM sale_items WHERE sale_num IN (?, ?) ORDER BY id", ('SALE-1', 'SALE-2'), ALLOW_SORT),
+    'export report': ("SELECT payment_status, SUM(count), SUM(total) FROM sales_daily WHERE date >= ? AND date <= ?"
+                      " GROUP BY payment_status", ('2026-01-01', '2026-01-31'), ALLOW_SORT),
+}
+
+# A bare "SCAN <table>" is a full table scan; "SCAN t USING INDEX" walks an index in order
+FULL_SCAN = re.compile(r'^SCAN \w+$')
+
+
+def check(conn):
+    failures = []
+    for label, (sql, params, *flags) in QUERIES.items():
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        bad = [step for step in plan
+               if FULL_SCAN.match(step) or ('TEMP B-TREE' in step and ALLOW_SORT not in flags)]
+        status = 'FAIL' if bad else 'ok'
+        print(f"{status:<5} {label:<30} {' | '.join(plan)}")
+        if bad:
+            failures.append(label)
+    return failures
+
+
+if __name__ == '__main__':
+    conn = sqlite3.connect(':memory:')
+    migrate(conn)
+    failures = check(conn)
+    conn.close()
+    if failures:
+        print(f"{len(failures)} query plan(s) regressed to a scan: {', '.join(failures)}")
+        sys.exit(1)
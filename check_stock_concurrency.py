@@ -0,0 +1,107 @@
+"""Stress the stock-moving routes from many threads and check stock against the ledger.
+
+Runs on a scratch database in a temporary directory. Worker threads mix
+intakes, supplies, bulk entries, multi-line sales (with repeated names),
+invoices and deletes of transactions and sales on a small catalogue so they
+contend for the same rows. Afterwards every product's quantity must equal its intakes
+minus its supplies in the transactions ledger, and none may be negative.
+
+    python check_stock_concurrency.py --threads 8 --ops 200
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+
+
+def worker(app, seed, ops, products, counts, lock):
+    rng = random.Random(seed)
+    client = app.test_client()
+    my_sales = []
+    for _ in range(ops):
+        op = rng.choices(['intake', 'supply', 'bulk', 'sale', 'invoice', 'delete_tx', 'delete_sale'],
+                         weights=[4, 4, 2, 6, 1, 2, 2])[0]
+        name = rng.choice(products)
+        qty = rng.randint(1, 5)
+        if op == 'intake' or op == 'supply':
+            response = client.post('/api/add-entry', json={'name': name, 'quantity': qty,
+                                                           'type': 'Intake' if op == 'intake' else 'Supply'})
+        elif op == 'bulk':
+            entries = [{'name': rng.choice(products), 'quantity': rng.randint(1, 5),
+                        'type': rng.choice(['Intake', 'Supply'])} for _ in range(rng.randint(2, 10))]
+            response = client.post('/api/add-entries', json={'entries': entries})
+        elif op == 'sale':
+            items = [{'name': rng.choice(products), 'quantity': rng.randint(1, 4), 'price': 10}
+                     for _ in range(rng.randint(1, 4))]
+            items.append(dict(items[0]))  # repeated name on one order
+            response = client.post('/api/create-sale', json={'customer': 'Stress', 'items': items})
+            result = response.get_json() or {}
+            if result.get('success'):
+                my_sales.append(result['sale_num'])
+        elif op == 'invoice':
+            response = client.post('/api/generate-invoice', json={'customer': 'Stress', 'item': name, 'quantity': qty})
+        elif op == 'delete_tx':
+            transactions = client.get('/api/transactions?limit=20').get_json()
+            if not transactions:
+                continue
+            response = client.delete(f"/api/delete-transaction/{rng.choice(transactions)['id']}")
+        else:
+            if not my_sales:
+                continue
+            response = client.delete(f"/api/delete-sale/{my_sales.pop(rng.randrange(len(my_sales)))}")
+        with lock:
+            key = f"{op} {response.status_code}"
+            counts[key] = counts.get(key, 0) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=200, help='operations per thread')
+    parser.add_argument('--products', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='stock_stress_')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as inventory_app
+
+    app = inventory_app.create_app({'DATABASE': os.path.join(workdir, 'inventory.db'),
+                                    'DOCUMENT_STORE_DIR': os.path.join(workdir, 'documents')})
+    products = [f"STRESS {i}" for i in range(args.products)]
+    client = app.test_client()
+    for name in products:
+        client.post('/api/add-entry', json={'name': name, 'quantity': 20, 'type': 'Intake'})
+
+    counts, lock = {}, threading.Lock()
+    threads = [threading.Thread(target=worker, args=(app, i, args.ops, products, counts, lock))
+               for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for key in sorted(counts):
+        print(f"{key:<24} {counts[key]}")
+
+    conn = sqlite3.connect(os.path.join(workdir, 'inventory.db'))
+    rows = conn.execute("""SELECT p.name, p.quantity,
+                                  (SELECT ifnull(SUM(CASE type WHEN 'Intake' THEN quantity ELSE -quantity END), 0)
+                                   FROM transactions t WHERE t.item_name = p.name)
+                           FROM products p ORDER BY p.name""").fetchall()
+    conn.close()
+
+    failures = 0
+    for name, quantity, ledger in rows:
+        ok = quantity == ledger and quantity >= 0
+        failures += not ok
+        print(f"{'ok' if ok else 'FAIL':<5} {name:<12} stock {quantity:>6}  ledger {ledger:>6}")
+    if failures:
+        print(f"{failures} product(s) disagree with the ledger")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+
+class RowFactory:
+    """Row factory returning plain dicts, resolving column names once per cursor.
+
+    sqlite3 keeps the same ``cursor.description`` object for every row of a
+    statement, so the names are only rebuilt when a new statement runs.
+    """
+
+    __slots__ = ('_cache',)
+
+    def __init__(self):
+        self._cache = (None, ())
+
+    def __call__(self, cursor, row):
+        cache = self._cache
+        desc = cursor.description
+        if cache[0] is not desc:
+            cache = self._cache = (desc, tuple(col[0] for col in desc))
+        return dict(zip(cache[1], row))
+
+
+_json_select_cache = {}
+
+
+def json_select(conn, table):
+    """Select-list expression that renders a whole ``table`` row as JSON in SQLite.
+
+    Column names are looked up once per table and cached; call
+    ``clear_json_select_cache()`` after the schema changes.
+    """
+    expr = _json_select_cache.get(table)
+    if expr is None:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
+        expr = 'json_object(' + ', '.join(f"'{col}', \"{col}\"" for col in columns) + ')'
+        _json_select_cache[table] = expr
+    return expr
+
+
+def clear_json_select_cache():
+    _json_select_cache.clear()
+
+
+def json_rows(cursor):
+    """Join a cursor of single-column JSON text rows into a JSON array string.
+
+    Pair with ``json_select()`` so SQLite encodes each row and Python never
+    builds a dict or re-encodes a value.
+    """
+    return '[' + ','.join([row[0] for row in cursor]) + ']'
+
+
+def json_row(cursor):
+    """Return the cursor's next JSON text row, or None."""
+    row = cursor.fetchone()
+    return row[0] if row is not None else None
+
+
+class PooledConnection(sqlite3.Connection):
+    """SQLite connection that goes back to its pool on close() instead of closing."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool = None
+        self._owner = None
+        self._lease = 0  # bumped on every checkout
+
+    def close(self):
+        # Only the thread that checked the connection out may hand it back;
+        # a stray second close() after release is a no-op.
+        if self._pool is None or self._owner != threading.get_ident():
+            return
+        self._pool.release(self)
+
+    def really_close(self):
+        super().close()
+
+
+class ConnectionPool:
+    """Bounded pool of tuned SQLite connections shared by request threads.
+
+    Connections are opened lazily with WAL journaling and the configured
+    pragmas, handed out LIFO so the warmest page cache is reused first, and
+    rolled back on release so no transaction leaks between requests.
+    """
+
+    def __init__(self, database, max_size=8, busy_timeout=5.0, cache_size=-16000,
+                 mmap_size=134217728, acquire_timeout=30.0, row_factory=None):
+        self.database = database
+        self.max_size = max_size
+        self.busy_timeout = busy_timeout
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.acquire_timeout = acquire_timeout
+        self.row_factory = row_factory  # called once per new connection
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._all = []
+        self._stats = {'hits': 0, 'misses': 0, 'waits': 0, 'wait_time': 0.0, 'max_wait': 0.0}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, timeout=self.busy_timeout,
+                               check_same_thread=False, factory=PooledConnection)
+        conn.row_factory = self.row_factory() if self.row_factory else None
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout * 1000)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    def _check_fork(self):
+        # A forked worker must never share file handles with its parent.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = queue.LifoQueue()
+            self._slots = threading.BoundedSemaphore(self.max_size)
+            self._all = []
+
+    def acquire(self):
+        self._check_fork()
+        start = time.perf_counter()
+        if not self._slots.acquire(blocking=False):
+            if not self._slots.acquire(timeout=self.acquire_timeout):
+                raise sqlite3.OperationalError('Timed out waiting for a database connection')
+            waited = time.perf_counter() - start
+            with self._lock:
+                self._stats['waits'] += 1
+                self._stats['wait_time'] += waited
+                self._stats['max_wait'] = max(self._stats['max_wait'], waited)
+
+        try:
+            conn = self._idle.get_nowait()
+            hit = True
+        except queue.Empty:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._slots.release()
+                raise
+            hit = False
+
+        with self._lock:
+            self._stats['hits' if hit else 'misses'] += 1
+        conn._pool = self
+        conn._owner = threading.get_ident()
+        conn._lease += 1
+        return conn
+
+    def release(self, conn):
+        conn._owner = None
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+        except sqlite3.Error:
+            with self._lock:
+                if conn in self._all:
+                    self._all.remove(conn)
+            conn.really_close()
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                if conn in self._all:
+                    self._all.remove(conn)
+            conn.really_close()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['open'] = len(self._all)
+        stats['idle'] = self._idle.qsize()
+        stats['max_size'] = self.max_size
+        requests = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / requests, 4) if requests else 0.0
+        stats['avg_wait'] = round(stats['wait_time'] / stats['waits'], 6) if stats['waits'] else 0.0
+        return stats
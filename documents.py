@@ -0,0 +1,193 @@
+"""Size- and age-bounded store for generated documents (invoice PDFs, exports).
+
+Files are named by a content key, ``<root>/ab/cd/abcd....pdf``, so lookups
+are a single stat however many documents exist, and two requests for the
+same document share one file. Reading a document bumps its mtime; when the
+store goes over its byte budget the least recently used files are removed
+until it is back down to ``low_water`` of the budget, so the next few puts
+do not each set off another prune. Files older than the age budget are
+removed regardless.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+
+class DocumentStore:
+
+    def __init__(self, root, max_bytes=512 * 1024 * 1024, max_age=90 * 86400, prune_interval=3600.0,
+                 min_keep=60.0, low_water=0.9):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.prune_interval = prune_interval
+        self.min_keep = min_keep  # never evict a file read this recently; it may be mid-download
+        self.low_water = low_water
+        self._bytes = None  # approximate until the next prune; other processes write too
+        self._last_prune = 0.0
+        self._hold_until = 0.0  # no size-triggered prune before this; see prune()
+        self._pruning = False
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expired': 0}
+
+    def _path(self, key, suffix):
+        return os.path.join(self.root, key[:2], key[2:4], key + suffix)
+
+    def get(self, key, suffix=''):
+        """Path of document ``key`` if it is stored, marking it recently used."""
+        path = self._path(key, suffix)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._stats['misses'] += 1
+            return None
+        with self._lock:
+            self._stats['hits'] += 1
+        return path
+
+    def put(self, data, suffix='', key=None):
+        """Store ``data`` under ``key`` (default: its SHA-256) and return its path."""
+        with self.writer(suffix, key) as f:
+            f.write(data)
+        return f.path
+
+    @contextmanager
+    def writer(self, suffix='', key=None):
+        """Stream a document into the store without holding it in memory.
+
+        Yields a binary file object; once the block exits, ``f.key`` and
+        ``f.path`` say where it landed. It is written to a temporary file and
+        renamed into place, so readers never see a partial document.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.incoming-')
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as raw:
+                f = _HashingWriter(raw, digest)
+                yield f
+            f.key = key or digest.hexdigest()
+            f.path = self._path(f.key, suffix)
+            os.makedirs(os.path.dirname(f.path), exist_ok=True)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, f.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        now = time.monotonic()
+        with self._lock:
+            self._stats['stores'] += 1
+            if self._bytes is not None:
+                self._bytes += size
+            due = not self._pruning and (
+                self._bytes is None or (self._bytes > self.max_bytes and now >= self._hold_until)
+                or now - self._last_prune > self.prune_interval)
+        if due:
+            self.prune()
+
+    def _scan(self):
+        entries = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir() or len(shard.name) != 2:
+                continue
+            for sub in os.scandir(shard.path):
+                if not sub.is_dir():
+                    continue
+                for entry in os.scandir(sub.path):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def prune(self):
+        """Drop expired documents, then the least recently used down to the low-water mark.
+
+        The directory walk and the deletions run without the lock, so puts and
+        lookups carry on meanwhile. A prune already in progress makes this a
+        no-op.
+        """
+        with self._lock:
+            if self._pruning:
+                return
+            self._pruning = True
+        try:
+            total, expired, evicted = self._prune()
+        except BaseException:
+            with self._lock:
+                self._pruning = False
+            raise
+        now = time.monotonic()
+        with self._lock:
+            self._pruning = False
+            self._bytes = total
+            self._last_prune = now
+            # Still over budget means what is left was read within min_keep;
+            # scanning again before that has passed would find the same
+            self._hold_until = now + self.min_keep if total > self.max_bytes else 0.0
+            self._stats['expired'] += expired
+            self._stats['evictions'] += evicted
+
+    def _prune(self):
+        if not os.path.isdir(self.root):
+            return 0, 0, 0
+        now = time.time()
+        # Leftovers from writers that died mid-document
+        for entry in os.scandir(self.root):
+            try:
+                if entry.name.startswith('.incoming-') and now - entry.stat().st_mtime > 3600:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+        entries = sorted(self._scan())
+        total = sum(size for mtime, size, path in entries)
+        target = self.max_bytes * self.low_water if total > self.max_bytes else self.max_bytes
+        expired = evicted = 0
+        for mtime, size, path in entries:
+            too_old = self.max_age and now - mtime > self.max_age
+            if not too_old and total <= target:
+                break
+            if now - mtime < self.min_keep:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            if too_old:
+                expired += 1
+            else:
+                evicted += 1
+        return total, expired, evicted
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['bytes'] = self._bytes
+        stats['max_bytes'] = self.max_bytes
+        stats['max_age'] = self.max_age
+        return stats
+
+
+class _HashingWriter:
+    __slots__ = ('_raw', '_digest', 'key', 'path')
+
+    def __init__(self, raw, digest):
+        self._raw = raw
+        self._digest = digest
+        self.key = self.path = None
+
+    def write(self, data):
+        self._digest.update(data)
+        return self._raw.write(data)
+
+    def flush(self):
+        self._raw.flush()
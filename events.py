@@ -0,0 +1,142 @@
+import queue
+import threading
+
+
+class Subscription:
+    __slots__ = ('queue', 'overflowed', 'closed')
+
+    def __init__(self, max_pending):
+        self.queue = queue.Queue(max_pending)
+        self.overflowed = False
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+        try:
+            self.queue.put_nowait(None)  # wakes a stream waiting for its next event
+        except queue.Full:
+            pass
+
+
+class EventBroker:
+    """Fan-out of small change events to Server-Sent Events subscribers.
+
+    Each subscriber gets a bounded queue; one that falls too far behind is
+    flagged as overflowed instead of blocking writers, and its stream tells
+    the client to resync from scratch. ``close()`` ends every stream, so a
+    process shutting down is not held open by them.
+    """
+
+    def __init__(self, max_pending=256):
+        self.max_pending = max_pending
+        self.closed = False
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        sub = Subscription(self.max_pending)
+        with self._lock:
+            if self.closed:
+                sub.close()
+            else:
+                self._subscribers.add(sub)
+        return sub
+
+    def close(self):
+        """End every subscription, and those made from now on straight away."""
+        with self._lock:
+            self.closed = True
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            sub.close()
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def publish(self, event, data):
+        """Queue ``event`` with ``data`` (JSON text) for every subscriber."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            try:
+                sub.queue.put_nowait((event, data))
+            except queue.Full:
+                sub.overflowed = True
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': len(self._subscribers)}
+
+
+class ChangeFeed:
+    """Publishes changes read back from the database to an EventBroker.
+
+    Writes may be made by any worker process, while a broker only reaches
+    the subscribers of its own process. So rather than each write publishing
+    what it changed, a thread in every process tails a sequence shared
+    through the database: ``latest()`` returns its current position and
+    ``fetch(since)`` returns ``(position, [(event, data), ...])`` for what
+    changed after ``since``. The thread runs only while the broker has
+    subscribers, looks every ``interval`` seconds, and straight away after
+    ``wake()``, which the process that made a write calls once it commits.
+    """
+
+    def __init__(self, broker, latest, fetch, interval=1.0):
+        self.broker = broker
+        self.interval = interval
+        self._latest = latest
+        self._fetch = fetch
+        self._since = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {'polls': 0, 'published': 0, 'errors': 0}
+
+    def subscribe(self):
+        with self._lock:
+            if self._thread is None:
+                # Subscribers get what changes from now on
+                self._since = self._latest()
+                self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+                self._thread.start()
+            return self.broker.subscribe()
+
+    def unsubscribe(self, sub):
+        self.broker.unsubscribe(sub)
+
+    def wake(self):
+        self._wake.set()
+
+    def close(self):
+        self.broker.close()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            with self._lock:
+                if not self.broker.has_subscribers():
+                    self._thread = None
+                    return
+            try:
+                since, events = self._fetch(self._since)
+            except Exception:
+                self._stats['errors'] += 1
+                continue
+            self._since = since
+            self._stats['polls'] += 1
+            self._stats['published'] += len(events)
+            for event, data in events:
+                self.broker.publish(event, data)
+
+    def stats(self):
+        stats = dict(self._stats, **self.broker.stats())
+        stats['seq'] = self._since
+        stats['running'] = self._thread is not None
+        stats['interval'] = self.interval
+        return stats
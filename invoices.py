@@ -0,0 +1,367 @@
+"""Invoice PDFs rendered off the request thread.
+
+Rendering with FPDF is CPU-bound pure Python, so it runs in a small pool of
+worker processes and the request thread only waits for the bytes. Callers
+keep finished PDFs in the document store, keyed by document_hash(), so an
+unchanged sale or invoice is rendered once.
+
+Exports render many documents through the same pool, a few at a time and in
+order, and MergedPdf stitches their pages into one PDF as they arrive.
+"""
+import hashlib
+import json
+import multiprocessing
+import threading
+import zlib
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Bump when a layout changes so stored PDFs are not served for the old one
+RENDER_VERSION = 1
+
+
+class RendererBusy(Exception):
+    """Every render slot stayed taken for the whole wait."""
+
+
+class RendererFailed(RendererBusy):
+    """The render pool broke, and broke again on a fresh one."""
+
+
+def _pdf_bytes(pdf):
+    out = pdf.output(dest='S')
+    # fpdf 1.7 returns a latin-1 str, fpdf2 a bytearray
+    return out.encode('latin-1') if isinstance(out, str) else bytes(out)
+
+
+def _layout_sale(pdf, doc):
+    sale, items = doc['sale'], doc['items']
+    pdf.add_page()
+    pdf.set_font("Arial", 'B', 20)
+    pdf.cell(190, 10, "KEL-B PHONE ACCESSORIES", ln=True, align='C')
+    pdf.set_font("Arial", size=16)
+    pdf.cell(190, 10, "SHOP 16 GOLDEN POINT PLAZA", ln=True, align='C')
+    pdf.cell(190, 10, "TEL: 08034746191, 09033762556", ln=True, align='C')
+    pdf.set_font("Arial", size=12)
+    pdf.cell(190, 10, "SALES INVOICE", ln=True, align='C')
+    pdf.set_font("Arial", size=11)
+    pdf.ln(5)
+    pdf.cell(95, 8, f"Sale No: {sale['sale_num']}", border=0)
+    pdf.cell(95, 8, f"Date: {sale['date']}", border=0, ln=True)
+    pdf.cell(95, 8, f"Customer: {sale['customer']}", border=0)
+    pdf.cell(95, 8, f"Time: {sale['time']}", border=0, ln=True)
+    pdf.ln(5)
+
+    # Table header
+    pdf.set_font("Arial", 'B', 10)
+    pdf.cell(80, 8, "Item", border=1)
+    pdf.cell(30, 8, "Qty", border=1)
+    pdf.cell(30, 8, "Price", border=1)
+    pdf.cell(40, 8, "Total", border=1, ln=True)
+
+    # Table rows
+    pdf.set_font("Arial", size=10)
+    for item in items:
+        pdf.cell(80, 8, item['item_name'][:25], border=1)
+        pdf.cell(30, 8, str(item['quantity']), border=1)
+        pdf.cell(30, 8, f"{item['price']:.2f}", border=1)
+        pdf.cell(40, 8, f"{item['total']:.2f}", border=1, ln=True)
+
+    # Total
+    pdf.set_font("Arial", 'B', 11)
+    pdf.cell(140, 10, "Total Amount:", border=0, align='R')
+    pdf.cell(40, 10, f"{sale['total_amount']:.2f}", border=1, ln=True)
+
+    pdf.set_font("Arial", size=9)
+    pdf.ln(5)
+    pdf.cell(190, 8, f"Payment Status: {sale['payment_status']}", align='C')
+
+
+def _layout_stock(pdf, doc):
+    pdf.add_page()
+    pdf.set_font("Arial", 'B', 20)
+    pdf.cell(190, 10, "INVOICE", ln=True, align='C')
+    pdf.set_font("Arial", size=12)
+    pdf.cell(100, 10, f"Invoice No: {doc['invoice_num']}", ln=True)
+    pdf.cell(100, 10, f"Customer: {doc['customer']}", ln=True)
+    pdf.cell(100, 10, f"Date: {doc['date']}", ln=True)
+    pdf.ln(10)
+    pdf.cell(100, 10, "Item Name", border=1)
+    pdf.cell(40, 10, "Quantity", border=1)
+    pdf.ln()
+    pdf.cell(100, 10, doc['item'], border=1)
+    pdf.cell(40, 10, str(doc['total_items']), border=1)
+
+
+def _layout_report(pdf, doc):
+    """Cover page of an export: sales in the period by payment status and by day."""
+    pdf.add_page()
+    pdf.set_font("Arial", 'B', 20)
+    pdf.cell(190, 10, "KEL-B PHONE ACCESSORIES", ln=True, align='C')
+    pdf.set_font("Arial", size=12)
+    pdf.cell(190, 10, "SALES REPORT", ln=True, align='C')
+    pdf.cell(190, 8, f"{doc['start']} to {doc['end']}", ln=True, align='C')
+    pdf.ln(5)
+    pdf.set_font("Arial", 'B', 11)
+    pdf.cell(95, 8, f"Sales: {doc['count']}")
+    pdf.cell(95, 8, f"Total: {doc['total']:.2f}", ln=True)
+    pdf.ln(5)
+
+    pdf.set_font("Arial", 'B', 10)
+    pdf.cell(80, 8, "Payment Status", border=1)
+    pdf.cell(30, 8, "Sales", border=1)
+    pdf.cell(40, 8, "Total", border=1, ln=True)
+    pdf.set_font("Arial", size=10)
+    for row in doc['by_status']:
+        pdf.cell(80, 8, row['payment_status'] or '-', border=1)
+        pdf.cell(30, 8, str(row['count']), border=1)
+        pdf.cell(40, 8, f"{row['total']:.2f}", border=1, ln=True)
+    pdf.ln(5)
+
+    pdf.set_font("Arial", 'B', 10)
+    pdf.cell(80, 8, "Date", border=1)
+    pdf.cell(30, 8, "Sales", border=1)
+    pdf.cell(40, 8, "Total", border=1, ln=True)
+    pdf.set_font("Arial", size=10)
+    for row in doc['by_day']:
+        pdf.cell(80, 8, row['date'], border=1)
+        pdf.cell(30, 8, str(row['count']), border=1)
+        pdf.cell(40, 8, f"{row['total']:.2f}", border=1, ln=True)
+
+
+LAYOUTS = {
+    'sale': _layout_sale,
+    'invoice': _layout_stock,
+    'report': _layout_report,
+}
+
+
+def _build(kind, doc):
+    # Imported on first render, so processes that never draw a PDF skip it
+    from fpdf import FPDF
+    pdf = FPDF()
+    LAYOUTS[kind](pdf, doc)
+    return pdf
+
+
+def render(kind, doc):
+    """Worker-process entry point; must stay a picklable module-level function."""
+    return _pdf_bytes(_build(kind, doc))
+
+
+def render_pages(kind, doc):
+    """Worker-process entry point returning pages for MergedPdf instead of a file.
+
+    Returns ``(pages, fonts)``: each page as ``(compressed_content, (width,
+    height))`` in points, and the ``{resource_name: base_font}`` the content
+    refers to. This reads fpdf 1.7's page buffers (pinned in requirements.txt),
+    which hold the finished content once the layout has drawn it; only the
+    core fonts are used, so there is nothing to embed.
+    """
+    pdf = _build(kind, doc)
+    size = (pdf.fw_pt, pdf.fh_pt) if pdf.def_orientation == 'P' else (pdf.fh_pt, pdf.fw_pt)
+    pages = []
+    for n in range(1, pdf.page + 1):
+        box = size[::-1] if n in pdf.orientation_changes else size
+        pages.append((zlib.compress(pdf.pages[n].encode('latin-1')), box))
+    fonts = {f"F{font['i']}": font['name'] for font in pdf.fonts.values()}
+    return pages, fonts
+
+
+class MergedPdf:
+    """Write one PDF from the pages of many documents without holding them.
+
+    Each method returns the bytes to send next: ``header()`` first, then
+    ``add(pages, fonts)`` per document from render_pages(), and ``finish()``
+    for the page tree and cross-reference table. Only object offsets and
+    page object numbers are kept, a few bytes per page.
+    """
+
+    def __init__(self):
+        self._offsets = {}
+        self._size = 0
+        self._next = 3  # 1 is the page tree and 2 the catalog, both written last
+        self._fonts = {}
+        self._kids = []
+
+    def _object(self, body, number=None):
+        if number is None:
+            number, self._next = self._next, self._next + 1
+        self._offsets[number] = self._size
+        data = f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+        self._size += len(data)
+        return number, data
+
+    def header(self):
+        data = b"%PDF-1.3\n"
+        self._size += len(data)
+        return data
+
+    def add(self, pages, fonts):
+        chunks, resources = [], []
+        for name, base in sorted(fonts.items()):
+            if base not in self._fonts:
+                encoding = '' if base in ('Symbol', 'ZapfDingbats') else ' /Encoding /WinAnsiEncoding'
+                self._fonts[base], data = self._object(
+                    f"<</Type /Font /BaseFont /{base} /Subtype /Type1{encoding}>>".encode())
+                chunks.append(data)
+            resources.append(f"/{name} {self._fonts[base]} 0 R")
+        font_dict = ' '.join(resources)
+        for content, (width, height) in pages:
+            contents, data = self._object(b"<</Filter /FlateDecode /Length %d>>\nstream\n" % len(content)
+                                          + content + b"\nendstream")
+            chunks.append(data)
+            page, data = self._object(
+                f"<</Type /Page /Parent 1 0 R /MediaBox [0 0 {width:.2f} {height:.2f}] "
+                f"/Resources <</ProcSet [/PDF /Text] /Font <<{font_dict}>>>> /Contents {contents} 0 R>>".encode())
+            chunks.append(data)
+            self._kids.append(page)
+        return b"".join(chunks)
+
+    def finish(self):
+        kids = ' '.join(f"{kid} 0 R" for kid in self._kids)
+        chunks = [self._object(f"<</Type /Pages /Kids [{kids}] /Count {len(self._kids)}>>".encode(), 1)[1],
+                  self._object(b"<</Type /Catalog /Pages 1 0 R>>", 2)[1]]
+        xref = self._size
+        lines = [f"xref\n0 {self._next}\n", "0000000000 65535 f \n"]
+        lines.extend(f"{self._offsets[n]:010d} 00000 n \n" for n in range(1, self._next))
+        lines.append(f"trailer\n<</Size {self._next} /Root 2 0 R>>\nstartxref\n{xref}\n%%EOF\n")
+        chunks.append(''.join(lines).encode())
+        return b"".join(chunks)
+
+
+def document_hash(kind, doc):
+    raw = json.dumps([RENDER_VERSION, kind, doc], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class InvoiceRenderer:
+    """Bounded process pool for rendering PDFs.
+
+    At most ``workers`` PDFs render at once and at most ``max_pending`` are
+    queued or running; a caller that cannot get a slot within ``wait``
+    seconds gets RendererBusy instead of piling up behind the others. A pool
+    whose worker died is replaced. With ``workers=0`` rendering happens
+    inline in the calling thread.
+    """
+
+    def __init__(self, workers=2, max_pending=8, wait=10.0):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats = {'renders': 0, 'busy': 0, 'broken_pools': 0}
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: the web process is threaded and holds SQLite handles
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _discard(self, executor):
+        """Drop a pool that broke (a worker died), so the next caller starts a fresh one."""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self._stats['broken_pools'] += 1
+        executor.shutdown(wait=False)
+
+    def render(self, kind, doc):
+        """Return ``(pdf_bytes, content_hash)`` for document ``doc`` of type ``kind``.
+
+        If the pool breaks, the render is retried once on a fresh pool;
+        failing that, RendererFailed.
+        """
+        if not self._slots.acquire(timeout=self.wait):
+            with self._lock:
+                self._stats['busy'] += 1
+            raise RendererBusy('Invoice rendering is busy, try again shortly')
+        try:
+            if self.workers > 0:
+                for attempt in range(2):
+                    executor = self._get_executor()
+                    try:
+                        pdf = executor.submit(render, kind, doc).result()
+                        break
+                    except BrokenProcessPool as e:
+                        self._discard(executor)
+                        if attempt:
+                            raise RendererFailed('Invoice rendering failed, try again shortly') from e
+            else:
+                pdf = render(kind, doc)
+        finally:
+            self._slots.release()
+
+        with self._lock:
+            self._stats['renders'] += 1
+        return pdf, document_hash(kind, doc)
+
+    def render_many(self, jobs, func=None, lookup=None):
+        """Yield ``(kind, doc, result, hit)`` for each ``(kind, doc)`` in ``jobs``, in order.
+
+        ``func`` runs in the pool (render, or render_pages) with at most
+        ``workers`` documents in flight, so memory stays flat however many
+        jobs there are and the first results come back while later ones
+        still render. ``lookup(kind, doc)`` may return a ready result to
+        skip rendering; ``hit`` says whether it did. Unlike render() this
+        waits for slots rather than raising RendererBusy, since a caller
+        part-way through a download cannot answer 503 any more. Results do
+        not go into the document store; ``lookup`` and the caller handle that.
+        """
+        func = func or render
+        window = []
+        executor = self._get_executor() if self.workers > 0 else None
+        try:
+            for kind, doc in jobs:
+                ready = lookup(kind, doc) if lookup else None
+                if ready is not None:
+                    future = Future()
+                    future.set_result(ready)
+                elif executor is None:
+                    future = Future()
+                    future.set_result(func(kind, doc))
+                else:
+                    self._slots.acquire()
+                    try:
+                        future = executor.submit(func, kind, doc)
+                    except BaseException:
+                        self._slots.release()
+                        raise
+                    future.add_done_callback(lambda f: self._slots.release())
+                window.append((kind, doc, future, ready is not None))
+                while len(window) > max(1, self.workers) or (window and window[0][2].done()):
+                    yield self._collect(window.pop(0), executor)
+            while window:
+                yield self._collect(window.pop(0), executor)
+        finally:
+            # The consumer went away (client disconnected): drop what has not started
+            for kind, doc, future, hit in window:
+                future.cancel()
+
+    def _collect(self, entry, executor):
+        kind, doc, future, hit = entry
+        try:
+            result = future.result()
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+        if not hit:
+            with self._lock:
+                self._stats['renders'] += 1
+        return kind, doc, result, hit
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['workers'] = self.workers
+        stats['max_pending'] = self.max_pending
+        return stats
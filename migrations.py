@@ -0,0 +1,351 @@
+"""Versioned schema migrations.
+
+The schema version lives in SQLite's ``PRAGMA user_version``. Each entry in
+MIGRATIONS runs once, in order, inside its own transaction, and bumps the
+version when it commits. Append new migrations to the end; never edit one
+that has already shipped.
+"""
+import sqlite3
+
+
+def _columns(conn, table):
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    return {row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def _add_column(conn, table, column, decl):
+    if column not in _columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def m001_base_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS products
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     name TEXT UNIQUE,
+                     quantity INTEGER,
+                     reorder_level INTEGER,
+                     price REAL DEFAULT 0,
+                     brand TEXT)''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS transactions
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     item_name TEXT,
+                     quantity INTEGER,
+                     type TEXT,
+                     date TEXT,
+                     time TEXT)''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS sales
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     sale_num TEXT UNIQUE,
+                     customer TEXT,
+                     date TEXT,
+                     time TEXT,
+                     total_amount REAL,
+                     payment_status TEXT)''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS sale_items
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     sale_num TEXT,
+                     item_name TEXT,
+                     quantity INTEGER,
+                     price REAL,
+                     total REAL)''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS expenses
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     description TEXT,
+                     category TEXT,
+                     amount REAL,
+                     date TEXT,
+                     time TEXT,
+                     notes TEXT)''')
+
+    # Written by /api/generate-invoice; older databases got it from the desktop app
+    conn.execute('''CREATE TABLE IF NOT EXISTS invoices
+                    (invoice_num TEXT PRIMARY KEY,
+                     date TEXT,
+                     customer TEXT,
+                     total_items INTEGER)''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS users
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     username TEXT UNIQUE NOT NULL,
+                     password_hash TEXT NOT NULL,
+                     full_name TEXT,
+                     email TEXT,
+                     role TEXT NOT NULL DEFAULT 'staff',
+                     created_at TEXT,
+                     is_active BOOLEAN DEFAULT 1)''')
+
+
+def m002_product_columns(conn):
+    # Databases created by the desktop app predate these columns
+    _add_column(conn, 'products', 'price', 'REAL DEFAULT 0')
+    _add_column(conn, 'products', 'brand', 'TEXT')
+
+
+def m003_query_indexes(conn):
+    # get_transactions: date=? [AND type=?] ORDER BY time, or latest-first by (date, time)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_date_time ON transactions (date, time)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_type_date_time ON transactions (type, date, time)")
+    # delete_sale removes Supply rows by item name
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_item_type ON transactions (item_name, type)")
+
+    # get_sales: date=? ORDER BY date, time / latest 100
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_date_time ON sales (date, time)")
+    # Summaries: SUM(total_amount) by payment_status for a date, answered from the index alone
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_date_status_amount ON sales (date, payment_status, total_amount)")
+
+    # get_sale_details, generate_sale_invoice, delete_sale
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sale_items_sale_num ON sale_items (sale_num)")
+
+    # get_expenses: date=? / category=? ORDER BY date, time
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_date_time ON expenses (date, time)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_category_date_time ON expenses (category, date, time)")
+    # get_expenses_summary: SUM(amount) GROUP BY category for a date, covering
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_date_category_amount ON expenses (date, category, amount)")
+
+
+def _create_fts_index(conn, table, source, columns, tokenize, options=''):
+    cols = ', '.join(columns)
+    new_cols = ', '.join(f'new.{c}' for c in columns)
+    old_cols = ', '.join(f'old.{c}' for c in columns)
+    conn.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS {table}
+                     USING fts5({cols}, content='{source}', content_rowid='id', tokenize='{tokenize}'{options})""")
+    # External-content FTS tables are kept in step with their source table by
+    # triggers, so every write path updates them in the same transaction.
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON {source} BEGIN
+                         INSERT INTO {table} (rowid, {cols}) VALUES (new.id, {new_cols});
+                     END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON {source} BEGIN
+                         INSERT INTO {table} ({table}, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+                     END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE OF {cols} ON {source} BEGIN
+                         INSERT INTO {table} ({table}, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+                         INSERT INTO {table} (rowid, {cols}) VALUES (new.id, {new_cols});
+                     END""")
+    conn.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+
+
+def _create_trigram_index(conn, table, source, columns):
+    # The trigram tokenizer needs SQLite 3.34+; callers fall back without it
+    try:
+        conn.execute("SAVEPOINT trigram")
+        _create_fts_index(conn, table, source, columns, 'trigram')
+        conn.execute("RELEASE trigram")
+    except sqlite3.OperationalError:
+        conn.execute("ROLLBACK TO trigram")
+        conn.execute("RELEASE trigram")
+
+
+def m004_customer_search(conn):
+    # Word-prefix search ("del" finds "DELIGHT", "mr b" finds "MR B")
+    _create_fts_index(conn, 'sales_customer_fts', 'sales', ['customer'], 'unicode61 remove_diacritics 2')
+    # Substring search for match=contains
+    _create_trigram_index(conn, 'sales_customer_trigram', 'sales', ['customer'])
+
+
+def m005_product_search(conn):
+    # Autocomplete on name and brand; prefix indexes make 1-3 letter prefixes cheap
+    _create_fts_index(conn, 'products_fts', 'products', ['name', 'brand'], 'unicode61 remove_diacritics 2',
+                      ", prefix='1 2 3'")
+    # Typo-tolerant fallback: candidates sharing trigrams with the query
+    _create_trigram_index(conn, 'products_trigram', 'products', ['name', 'brand'])
+
+
+# Per-day rollups read by the summary and dashboard endpoints. Triggers keep
+# them in the same transaction as every write to sales and expenses; a day's
+# row is removed once its count drops to zero.
+ROLLUPS = {
+    'sales_daily': ('sales', 'payment_status', 'total_amount'),
+    'expenses_daily': ('expenses', 'category', 'amount'),
+}
+
+
+def _create_rollup(conn, table, source, key, value):
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {table}
+                     (date TEXT NOT NULL,
+                      {key} TEXT NOT NULL,
+                      count INTEGER NOT NULL,
+                      total REAL NOT NULL,
+                      PRIMARY KEY (date, {key})) WITHOUT ROWID""")
+    add = f"""INSERT INTO {table} (date, {key}, count, total)
+              VALUES (ifnull(new.date, ''), ifnull(new.{key}, ''), 1, ifnull(new.{value}, 0))
+              ON CONFLICT (date, {key}) DO UPDATE SET count = count + 1, total = total + excluded.total;"""
+    remove = f"""UPDATE {table} SET count = count - 1, total = total - ifnull(old.{value}, 0)
+                 WHERE date = ifnull(old.date, '') AND {key} = ifnull(old.{key}, '');
+                 DELETE FROM {table} WHERE date = ifnull(old.date, '') AND {key} = ifnull(old.{key}, '') AND count <= 0;"""
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON {source} BEGIN {add} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON {source} BEGIN {remove} END")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE OF date, {key}, {value} ON {source}
+                     BEGIN {remove} {add} END""")
+
+
+def rebuild_rollups(conn):
+    """Recompute every rollup table from its source table (caller commits)."""
+    for table, (source, key, value) in ROLLUPS.items():
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f"""INSERT INTO {table} (date, {key}, count, total)
+                         SELECT ifnull(date, ''), ifnull({key}, ''), COUNT(*), ifnull(SUM({value}), 0)
+                         FROM {source} GROUP BY 1, 2""")
+
+
+def m006_daily_rollups(conn):
+    for table, (source, key, value) in ROLLUPS.items():
+        _create_rollup(conn, table, source, key, value)
+    rebuild_rollups(conn)
+    # The summaries no longer aggregate the base tables, so their covering
+    # indexes would only slow down writes
+    conn.execute("DROP INDEX IF EXISTS idx_sales_date_status_amount")
+    conn.execute("DROP INDEX IF EXISTS idx_expenses_date_category_amount")
+
+
+# Tables whose change counter is exposed to the app (ETags on read endpoints)
+VERSIONED_TABLES = ('products', 'transactions', 'sales', 'sale_items', 'expenses')
+
+
+def m007_data_versions(conn):
+    # One counter per table, bumped by triggers in the writer's transaction,
+    # so every process sees the same value once the write commits
+    conn.execute("""CREATE TABLE IF NOT EXISTS data_versions
+                    (name TEXT PRIMARY KEY,
+                     version INTEGER NOT NULL DEFAULT 0)""")
+    for table in VERSIONED_TABLES:
+        conn.execute("INSERT OR IGNORE INTO data_versions (name) VALUES (?)", (table,))
+        bump = f"UPDATE data_versions SET version = version + 1 WHERE name = '{table}';"
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()}
+                             AFTER {event} ON {table} BEGIN {bump} END""")
+
+
+def m008_transaction_refs(conn):
+    # The sale or invoice number that produced a ledger row, so reversing a
+    # sale removes exactly its own stock movements
+    _add_column(conn, 'transactions', 'ref', 'TEXT')
+    # Older sales wrote their Supply rows with the sale's own date and time,
+    # and sale numbers were unique per second
+    conn.execute("""UPDATE transactions SET ref = (
+                        SELECT s.sale_num FROM sales s JOIN sale_items si ON si.sale_num = s.sale_num
+                        WHERE s.date = transactions.date AND s.time = transactions.time
+                          AND si.item_name = transactions.item_name
+                        LIMIT 1)
+                    WHERE type = 'Supply' AND ref IS NULL""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_ref ON transactions (ref)")
+    # delete_sale no longer matches ledger rows by item name
+    conn.execute("DROP INDEX IF EXISTS idx_transactions_item_type")
+
+
+def m009_document_numbers(conn):
+    # Last sale/invoice number issued per prefix; see numbering.py
+    conn.execute("""CREATE TABLE IF NOT EXISTS document_numbers
+                    (prefix TEXT PRIMARY KEY,
+                     stamp TEXT NOT NULL,
+                     seq INTEGER NOT NULL)""")
+
+
+def m010_sync_operations(conn):
+    # Outcome of each replayed offline operation by its client-generated key,
+    # so a batch resent after a lost response is answered, not re-applied
+    conn.execute("""CREATE TABLE IF NOT EXISTS sync_operations
+                    (key TEXT PRIMARY KEY,
+                     status INTEGER NOT NULL,
+                     response TEXT NOT NULL,
+                     created_at TEXT NOT NULL)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sync_operations_created ON sync_operations (created_at)")
+
+
+# Tables mirrored by the client's offline stores, fed by /api/changes
+CHANGE_LOG_TABLES = ('products', 'sales', 'expenses', 'transactions')
+
+
+def m011_change_log(conn):
+    # One entry per row, moved to a new sequence number by every insert,
+    # update or delete, so reading from a sequence yields each changed row
+    # once and the log never outgrows the tables it mirrors
+    conn.execute("""CREATE TABLE IF NOT EXISTS change_log
+                    (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                     tbl TEXT NOT NULL,
+                     row_id INTEGER NOT NULL,
+                     deleted INTEGER NOT NULL DEFAULT 0,
+                     UNIQUE (tbl, row_id))""")
+    for table in CHANGE_LOG_TABLES:
+        for event, ref, deleted in (('INSERT', 'new', 0), ('UPDATE', 'new', 0), ('DELETE', 'old', 1)):
+            conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_log_{event.lower()}
+                             AFTER {event} ON {table} BEGIN
+                                 INSERT OR REPLACE INTO change_log (tbl, row_id, deleted)
+                                 VALUES ('{table}', {ref}.id, {deleted});
+                             END""")
+        # Existing rows count as changed, so a client starting from 0 gets everything
+        conn.execute(f"""INSERT OR IGNORE INTO change_log (tbl, row_id)
+                         SELECT '{table}', id FROM {table} ORDER BY id""")
+
+
+def m012_login_failures(conn):
+    # Recent failed sign-ins per username and per address; see auth.LoginThrottle
+    conn.execute("""CREATE TABLE IF NOT EXISTS login_failures
+                    (scope TEXT NOT NULL,
+                     key TEXT NOT NULL,
+                     at REAL NOT NULL)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_login_failures_key ON login_failures (scope, key, at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_login_failures_at ON login_failures (at)")
+
+
+def m013_users_version(conn):
+    # Bumped by any change to what auth.UserCache holds, so every worker
+    # drops its cached role and active flag as soon as the change commits
+    conn.execute("INSERT OR IGNORE INTO data_versions (name) VALUES ('users')")
+    bump = "UPDATE data_versions SET version = version + 1 WHERE name = 'users';"
+    for event in ('INSERT', 'UPDATE OF username, full_name, role, is_active', 'DELETE'):
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS users_version_{event.split()[0].lower()}
+                         AFTER {event} ON users BEGIN {bump} END""")
+
+
+MIGRATIONS = [
+    (1, 'base tables', m001_base_tables),
+    (2, 'products.price and products.brand', m002_product_columns),
+    (3, 'indexes for listing, summary and delete queries', m003_query_indexes),
+    (4, 'full-text customer search on sales', m004_customer_search),
+    (5, 'full-text product search on name and brand', m005_product_search),
+    (6, 'daily sales and expense rollups', m006_daily_rollups),
+    (7, 'per-table data version counters', m007_data_versions),
+    (8, 'transactions.ref linking ledger rows to sales and invoices', m008_transaction_refs),
+    (9, 'document_numbers counters for sale and invoice numbers', m009_document_numbers),
+    (10, 'sync_operations idempotency keys for offline replay', m010_sync_operations),
+    (11, 'change_log feeding /api/changes delta sync', m011_change_log),
+    (12, 'login_failures shared by every worker\'s sign-in throttle', m012_login_failures),
+    (13, 'users data version for the signed-in user caches', m013_users_version),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    return cursor.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Apply every pending migration; returns the list of versions applied."""
+    applied = []
+    current = get_schema_version(conn)
+    for version, description, step in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Another process may have migrated while we waited for the lock
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        applied.append(version)
+        print(f"Applied migration {version}: {description}")
+    return applied
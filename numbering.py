@@ -0,0 +1,42 @@
+"""Sale and invoice numbers that never collide.
+
+Numbers look like ``SALE-20260203100508-0001``: the second the document was
+issued, then a counter within that second. The last number handed out per
+prefix lives in the ``document_numbers`` table and is advanced inside the
+caller's write transaction, so allocation is serialised by SQLite's write
+lock across threads and worker processes alike. Numbers sort in issue
+order, and still sort after the older ``SALE-%Y%m%d%H%M%S`` ones.
+
+The counter is four digits, which is what keeps plain string order right.
+Past ``MAX_SEQ`` numbers in one second, allocation rolls over to the next
+second rather than growing a fifth digit; the real clock catches up with
+that borrowed stamp and carries on from its counter.
+"""
+import datetime
+
+STAMP_FORMAT = '%Y%m%d%H%M%S'
+MAX_SEQ = 9999
+
+
+def next_document_number(conn, prefix, now=None):
+    """Allocate the next ``prefix`` number; call after BEGIN IMMEDIATE.
+
+    If the clock steps backwards the previous stamp is kept, so numbers stay
+    monotonic rather than repeating.
+    """
+    stamp = (now or datetime.datetime.now()).strftime(STAMP_FORMAT)
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    row = cursor.execute("SELECT stamp, seq FROM document_numbers WHERE prefix = ?", (prefix,)).fetchone()
+    if row is None or stamp > row[0]:
+        seq = 1
+    else:
+        stamp, seq = row[0], row[1] + 1
+        if seq > MAX_SEQ:
+            stamp = (datetime.datetime.strptime(stamp, STAMP_FORMAT)
+                     + datetime.timedelta(seconds=1)).strftime(STAMP_FORMAT)
+            seq = 1
+    cursor.execute("""INSERT INTO document_numbers (prefix, stamp, seq) VALUES (?,?,?)
+                      ON CONFLICT (prefix) DO UPDATE SET stamp = excluded.stamp, seq = excluded.seq""",
+                   (prefix, stamp, seq))
+    return f"{prefix}-{stamp}-{seq:04d}"
@@ -0,0 +1,412 @@
+"""Production server: a master process and several threaded worker processes.
+
+    python serve.py --workers 4 --threads 16 --port 8000
+
+The master binds the listening socket, runs the app module's init_db(app)
+(migrations) once in a short-lived child, then forks the workers. Workers
+load the app only after the fork, so no SQLite handle, thread or process
+pool is ever shared between processes. Each worker serves requests on a fixed pool of threads and only
+accepts a connection when one of them is free; the rest wait in the shared
+listen backlog for whichever worker frees up first.
+
+Signals to the master:
+
+    HUP         graceful reload: start fresh workers (new code included),
+                then let the old ones finish their requests and exit,
+                killing those still busy after --graceful-timeout seconds
+    TERM, INT   graceful stop, forced after --graceful-timeout seconds
+
+A stopping worker first calls the app module's shutdown_app(app), if it
+has one, so requests that would otherwise never end (event streams) can
+finish, and closes kept-alive connections after their current response.
+
+A worker that dies is replaced. Without fork (Windows) a single worker runs
+in this process; its thread pool still applies.
+"""
+import argparse
+import importlib
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from werkzeug.wsgi import LimitedStream
+
+
+def load_app(spec):
+    """``module:attribute``, or ``module:factory()`` to build the app in the worker."""
+    module, _, name = spec.partition(':')
+    name = name or 'app'
+    if name.endswith('()'):
+        return getattr(importlib.import_module(module), name[:-2])()
+    return getattr(importlib.import_module(module), name)
+
+
+def app_hook(spec, name):
+    """The app module's ``name`` function, or None."""
+    return getattr(importlib.import_module(spec.partition(':')[0]), name, None)
+
+
+def prepare_app(spec):
+    """Load the app and run its module's ``init_db(app)``, if it has one."""
+    app = load_app(spec)
+    init_db = app_hook(spec, 'init_db')
+    if init_db is not None:
+        init_db(app)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug's WSGI server with a fixed pool of request threads."""
+
+    multithread = True
+    draining = False  # set once stopping; kept-alive connections close after their response
+
+    def __init__(self, host, port, app, threads, handler, fd=None):
+        super().__init__(host, port, app, handler=handler, fd=fd)
+        # Several workers wait on the same socket; the losers of a race for
+        # a connection must get EAGAIN instead of blocking in accept()
+        self.socket.setblocking(False)
+        self._free = threading.Semaphore(threads)
+        self._pool = ThreadPoolExecutor(threads, thread_name_prefix='request')
+
+    def _handle_request_noblock(self):
+        # Accept only with a thread free to serve the connection
+        if not self._free.acquire(timeout=0.5):
+            return
+        try:
+            request, client_address = self.get_request()
+        except OSError:
+            self._free.release()
+            return
+        if request.family != socket.AF_UNIX:
+            # werkzeug writes headers and body separately; with Nagle on, the
+            # body of a kept-alive response waits for the client's delayed ACK
+            request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._pool.submit(self._serve, request, client_address)
+
+    def _serve(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._free.release()
+
+    def drain(self):
+        """Wait for the requests in progress, after serve_forever() returns."""
+        self._pool.shutdown(wait=True)
+        self.server_close()
+
+
+class _NoInput:
+    """Stands in for rfile while werkzeug drains leftover input after a response.
+
+    That drain reads whatever the socket has, which on a kept-alive
+    connection is the client's next request.
+    """
+
+    def read(self, size=-1):
+        return b''
+
+
+def make_handler(keepalive, timeout, access_log):
+    class Handler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        _body = None
+
+        def handle_one_request(self):
+            # An idle connection gets ``keepalive`` seconds to send its next request...
+            self._body = None
+            self.connection.settimeout(keepalive or timeout)
+            super().handle_one_request()
+
+        def parse_request(self):
+            # ...and a request in progress ``timeout`` seconds per read or write
+            self.connection.settimeout(timeout)
+            return super().parse_request()
+
+        def make_environ(self):
+            environ = super().make_environ()
+            # werkzeug closes every connection; keep HTTP/1.1 ones open when the
+            # request body has a known length, so it can be skipped exactly
+            if (keepalive and not self.close_connection and not self.server.draining
+                    and self.request_version == 'HTTP/1.1'
+                    and not environ.get('wsgi.input_terminated')):
+                self._body = LimitedStream(self.rfile, int(environ.get('CONTENT_LENGTH') or 0))
+                environ['wsgi.input'] = self._body
+                self._rfile, self.rfile = self.rfile, _NoInput()
+            return environ
+
+        def send_header(self, keyword, value):
+            if self._body is not None and keyword.lower() == 'connection':
+                return
+            super().send_header(keyword, value)
+
+        def run_wsgi(self):
+            try:
+                super().run_wsgi()
+            finally:
+                if self._body is not None:
+                    self.rfile = self._rfile
+                    try:
+                        self._body.exhaust()  # whatever of the body the app left unread
+                    except OSError:
+                        self.close_connection = True
+
+        def log_request(self, *args, **kwargs):
+            if access_log:
+                super().log_request(*args, **kwargs)
+
+        def log_error(self, format, *args):
+            if not format.startswith('Request timed out'):  # an idle keep-alive closing
+                super().log_error(format, *args)
+
+    return Handler
+
+
+def run_worker(sock, args, ready_fd=None, forked=True):
+    """Worker process body: import the app, serve until told to stop."""
+    if forked:
+        # Ctrl-C reaches the whole process group; the master decides what happens
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    app = load_app(args.app)
+    server = PooledWSGIServer(args.host, args.port, app, args.threads,
+                              make_handler(args.keepalive, args.timeout, args.access_log), fd=sock.fileno())
+
+    shutdown_app = app_hook(args.app, 'shutdown_app')
+
+    def shutdown():
+        server.draining = True
+        if shutdown_app is not None:
+            shutdown_app(app)
+        server.shutdown()
+
+    def stop(*_):
+        threading.Thread(target=shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    if forked:
+        master = os.getppid()
+
+        def watch_master():
+            # Do not outlive a master that was killed outright
+            while os.getppid() == master:
+                time.sleep(1.0)
+            stop()
+
+        threading.Thread(target=watch_master, daemon=True).start()
+    if ready_fd is not None:
+        os.write(ready_fd, b'.')
+        os.close(ready_fd)
+    server.serve_forever()
+    server.drain()
+
+
+class Master:
+    def __init__(self, sock, args):
+        self.sock = sock
+        self.args = args
+        self.workers = {}  # pid -> generation
+        self.retiring = {}  # pid -> time by which an old-generation worker must have exited
+        self.generation = 0
+        self.pending = []  # signals received, handled by the main loop
+        self.stopping = False
+
+    def log(self, message):
+        print(f"[serve {os.getpid()}] {message}", file=sys.stderr, flush=True)
+
+    def fork(self, body):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                body()
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        return pid
+
+    def preflight(self):
+        """Set up the app once in a throwaway child, so migrations run before any worker."""
+        pid = self.fork(lambda: prepare_app(self.args.app))
+        _, status = os.waitpid(pid, 0)
+        if os.waitstatus_to_exitcode(status) != 0:
+            self.log("the app failed to import; not starting")
+            sys.exit(1)
+
+    def spawn(self, count):
+        """Start ``count`` workers of a new generation and wait until they serve."""
+        self.generation += 1
+        read_fd, write_fd = os.pipe()
+        pids = []
+        for _ in range(count):
+            pid = self.fork(lambda: run_worker(self.sock, self.args, write_fd))
+            self.workers[pid] = self.generation
+            pids.append(pid)
+        os.close(write_fd)
+        ready, deadline = 0, time.monotonic() + self.args.graceful_timeout
+        while ready < count and time.monotonic() < deadline:
+            try:
+                readable, _, _ = select.select([read_fd], [], [], 0.5)
+                if readable:
+                    data = os.read(read_fd, count)
+                    if not data:
+                        break  # every worker of this generation exited or wrote
+                    ready += len(data)
+            except InterruptedError:
+                continue
+        os.close(read_fd)
+        return ready == count, pids
+
+    def signal_workers(self, pids, sig):
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            generation = self.workers.pop(pid, None)
+            self.retiring.pop(pid, None)
+            if generation == self.generation and not self.stopping:
+                self.log(f"worker {pid} exited with {os.waitstatus_to_exitcode(status)}; replacing it")
+                time.sleep(1.0)  # do not spin if the app fails to start
+                self.spawn_one()
+
+    def spawn_one(self):
+        pid = self.fork(lambda: run_worker(self.sock, self.args))
+        self.workers[pid] = self.generation
+
+    def reload(self):
+        old = [pid for pid, generation in self.workers.items() if generation == self.generation]
+        ok, new = self.spawn(self.args.workers)
+        if not ok:
+            self.log("new workers did not start; keeping the running ones")
+            self.generation -= 1
+            for pid in new:
+                self.workers[pid] = -1  # not replaced when they exit
+            self.signal_workers(new, signal.SIGKILL)
+            return
+        self.log(f"reloaded: {len(new)} new workers, stopping {len(old)} old ones")
+        self.signal_workers(old, signal.SIGTERM)
+        deadline = time.monotonic() + self.args.graceful_timeout
+        self.retiring.update((pid, deadline) for pid in old)
+
+    def kill_overdue(self):
+        """SIGKILL old-generation workers still busy past their graceful timeout."""
+        now = time.monotonic()
+        overdue = [pid for pid, deadline in self.retiring.items() if deadline <= now]
+        if overdue:
+            self.log(f"{len(overdue)} old workers still busy after {self.args.graceful_timeout}s; killing them")
+            self.signal_workers(overdue, signal.SIGKILL)
+            for pid in overdue:
+                del self.retiring[pid]
+
+    def stop(self):
+        self.stopping = True
+        self.signal_workers(list(self.workers), signal.SIGTERM)
+        deadline = time.monotonic() + self.args.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        if self.workers:
+            self.log(f"{len(self.workers)} workers still busy after {self.args.graceful_timeout}s; killing them")
+            self.signal_workers(list(self.workers), signal.SIGKILL)
+            while self.workers:
+                pid, _ = os.waitpid(-1, 0)
+                self.workers.pop(pid, None)
+
+    def run(self):
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda signum, frame: self.pending.append(signum))
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)  # wakes the sleep below
+
+        self.preflight()
+        ok, pids = self.spawn(self.args.workers)
+        if not ok:
+            self.log("workers failed to start")
+            self.stop()
+            sys.exit(1)
+        self.log(f"serving on http://{self.args.host}:{self.args.port} with {self.args.workers} workers "
+                 f"x {self.args.threads} threads")
+        while True:
+            while self.pending:
+                signum = self.pending.pop(0)
+                if signum == signal.SIGHUP:
+                    self.reload()
+                else:
+                    self.log("stopping")
+                    self.stop()
+                    return
+            self.reap()
+            self.kill_overdue()
+            time.sleep(1.0)
+
+
+def main(argv=None):
+    env = os.environ.get
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--app', default=env('SERVE_APP', 'app:app'),
+                        help='module:attribute of the WSGI app, or module:factory()')
+    parser.add_argument('--host', default=env('SERVE_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(env('SERVE_PORT', 8000)))
+    parser.add_argument('--workers', type=int, default=int(env('SERVE_WORKERS', os.cpu_count() or 1)),
+                        help='worker processes')
+    parser.add_argument('--threads', type=int, default=int(env('SERVE_THREADS', 16)),
+                        help='request threads per worker; each open /api/events feed holds one')
+    parser.add_argument('--keepalive', type=float, default=float(env('SERVE_KEEPALIVE', 2.0)),
+                        help='seconds an idle connection is kept open (holding a thread); 0 closes after each response')
+    parser.add_argument('--timeout', type=float, default=float(env('SERVE_TIMEOUT', 60.0)),
+                        help='seconds a request may stall reading or writing before it is dropped')
+    parser.add_argument('--backlog', type=int, default=int(env('SERVE_BACKLOG', 256)))
+    parser.add_argument('--graceful-timeout', type=float, default=float(env('SERVE_GRACEFUL_TIMEOUT', 30.0)),
+                        help='seconds workers get to finish their requests on stop or reload')
+    parser.add_argument('--no-access-log', dest='access_log', action='store_false')
+    parser.add_argument('--pid', help='write the master process id to this file')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.getcwd())
+    sock = socket.create_server((args.host, args.port), backlog=args.backlog)
+    args.port = sock.getsockname()[1]
+    if args.pid:
+        with open(args.pid, 'w') as f:
+            f.write(f"{os.getpid()}\n")
+    try:
+        if hasattr(os, 'fork'):
+            Master(sock, args).run()
+        else:
+            print(f"serving on http://{args.host}:{args.port} with 1 worker x {args.threads} threads "
+                  "(no fork on this platform)", file=sys.stderr, flush=True)
+            try:
+                run_worker(sock, args, forked=False)
+            except KeyboardInterrupt:
+                pass
+    finally:
+        sock.close()
+        if args.pid:
+            try:
+                os.remove(args.pid)
+            except FileNotFoundError:
+                pass
+
+
+if __name__ == '__main__':
+    main()
@@ -248,10 +248,29 @@ function showNotification(message, type = 'success') {
     setTimeout(() => notification.classList.remove('show'), 3000);
 }
 
+// --- LIST PAGING ---
+// /api/transactions, /api/sales and /api/expenses answer a page at a time and
+// name the next page in X-Next-Cursor; the views show every matching row
+const LIST_PAGE_SIZE = 1000;
+
+async function fetchAllPages(url) {
+    url = new URL(url, window.location);
+    if (!url.searchParams.has('limit')) url.searchParams.set('limit', LIST_PAGE_SIZE);
+    const rows = [];
+    for (;;) {
+        const response = await fetch(url);
+        if (!response.ok) throw new Error(`${url.pathname} answered ${response.status}`);
+        rows.push(...await response.json());
+        const cursor = response.headers.get('X-Next-Cursor');
+        if (!cursor) return rows;
+        url.searchParams.set('cursor', cursor);
+    }
+}
+
 // ==================== OFFLINE FUNCTIONALITY ====================
 // IndexedDB Setup
 const DB_NAME = 'InventoryAppDB';
-const DB_VERSION = 1;
+const DB_VERSION = 2;
 let db;
 
 // Initialize IndexedDB
@@ -284,6 +303,9 @@ async function initIndexedDB() {
             if (!db.objectStoreNames.contains('syncQueue')) {
                 db.createObjectStore('syncQueue', { keyPath: 'id', autoIncrement: true });
             }
+            if (!db.objectStoreNames.contains('meta')) {
+                db.createObjectStore('meta', { keyPath: 'key' });
+            }
         };
     });
 }
@@ -321,6 +343,12 @@ async function getFromIndexedDB(storeName) {
     });
 }
 
+// Idempotency key sent with a queued operation, so a resend is never applied twice
+function newSyncKey() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}${Math.random().toString(36).slice(2)}`;
+}
+
 // Add operation to sync queue
 async function addToSyncQueue(method, endpoint, data) {
     if (!db) return;
@@ -330,6 +358,7 @@ async function addToSyncQueue(method, endpoint, data) {
         const store = transaction.objectStore('syncQueue');
 
         store.add({
+            key: newSyncKey(),
             method,
             endpoint,
             data,
@@ -359,22 +388,24 @@ async function getPendingSyncOperations() {
     });
 }
 
-// Mark operation as synced
-async function markAsSynced(id) {
+// Mark operation(s) as synced
+async function markAsSynced(ids) {
     if (!db) return;
 
     return new Promise((resolve, reject) => {
         const transaction = db.transaction(['syncQueue'], 'readwrite');
         const store = transaction.objectStore('syncQueue');
-        const getRequest = store.get(id);
 
-        getRequest.onsuccess = () => {
-            const operation = getRequest.result;
-            if (operation) {
-                operation.synced = true;
-                store.put(operation);
-            }
-        };
+        (Array.isArray(ids) ? ids : [ids]).forEach(id => {
+            const getRequest = store.get(id);
+            getRequest.onsuccess = () => {
+                const operation = getRequest.result;
+                if (operation) {
+                    operation.synced = true;
+                    store.put(operation);
+                }
+            };
+        });
 
         transaction.oncomplete = () => resolve();
         transaction.onerror = () => reject(transaction.error);
@@ -382,6 +413,8 @@ async function markAsSynced(id) {
 }
 
 // Sync pending operations when online
+const SYNC_BATCH_SIZE = 100;
+
 async function syncOfflineChanges() {
     const pending = await getPendingSyncOperations();
 
@@ -389,28 +422,48 @@ async function syncOfflineChanges() {
 
     updateSyncStatus(`Syncing ${pending.length} changes...`, 'syncing');
 
-    for (const operation of pending) {
+    // Operations queued before keys existed get one, stored before it is sent
+    const unkeyed = pending.filter(op => !op.key);
+    unkeyed.forEach(op => { op.key = newSyncKey(); });
+    if (unkeyed.length > 0) await saveToIndexedDB('syncQueue', unkeyed);
+
+    // The server applies each batch in order; stop at the first one that
+    // does not fully land so later operations never overtake earlier ones
+    for (let start = 0; start < pending.length; start += SYNC_BATCH_SIZE) {
+        const batch = pending.slice(start, start + SYNC_BATCH_SIZE);
+        let results;
         try {
-            const response = await fetch(operation.endpoint, {
-                method: operation.method,
+            const response = await fetch('/api/sync/batch', {
+                method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(operation.data)
+                body: JSON.stringify({
+                    operations: batch.map(op => ({ key: op.key, method: op.method, endpoint: op.endpoint, data: op.data }))
+                })
             });
+            if (!response.ok) break;
+            results = (await response.json()).results;
+        } catch (error) {
+            console.error('Failed to sync batch', error);
+            break;
+        }
 
-            if (response.ok) {
-                await markAsSynced(operation.id);
+        const done = [];
+        results.forEach((result, i) => {
+            const operation = batch[i];
+            if (result.status >= 500) return;  // kept, and resent later under the same key
+            done.push(operation.id);
+            if (result.status === 200) {
                 console.log(`Synced: ${operation.method} ${operation.endpoint}`);
+            } else {
+                console.warn(`Rejected: ${operation.method} ${operation.endpoint}`, result.body.error);
             }
-        } catch (error) {
-            console.error(`Failed to sync: ${operation.method} ${operation.endpoint}`, error);
-        }
+        });
+        await markAsSynced(done);
+        if (done.length < batch.length) break;
     }
 
     updateSyncStatus('', 'synced');
-    loadDashboard();
-    loadInventory();
-    loadSalesHistory();
-    loadExpenses();
+    refreshViews(loadDashboard, loadInventory, loadSalesHistory, loadExpenses);
 }
 
 // Update sync status display
@@ -436,6 +489,7 @@ window.addEventListener('online', async () => {
     console.log('Connection restored');
     updateSyncStatus('Syncing...', 'syncing');
     await syncOfflineChanges();
+    await pullChanges();
 });
 
 window.addEventListener('offline', () => {
@@ -449,47 +503,231 @@ if (!navigator.onLine) {
 }
 
 // Initialize IndexedDB on page load
-initIndexedDB().catch(error => console.error('Failed to initialize IndexedDB:', error));
+initIndexedDB().then(() => pullChanges()).catch(error => console.error('Failed to initialize IndexedDB:', error));
 
+// Remove one record from IndexedDB
+async function deleteFromIndexedDB(storeName, key) {
+    if (!db) return;
 
-// --- DASHBOARD ---
-async function loadDashboard() {
-    const dateFilter = document.getElementById('dashboardDateFilter').value || '';
+    return new Promise((resolve, reject) => {
+        const transaction = db.transaction([storeName], 'readwrite');
+        transaction.objectStore(storeName).delete(key);
+        transaction.oncomplete = () => resolve();
+        transaction.onerror = () => reject(transaction.error);
+    });
+}
 
-    try {
-        const response = await fetch('/api/inventory');
-        const products = await response.json();
+// --- DELTA SYNC ---
+// The offline stores follow /api/changes: each pull brings only the rows
+// changed since the last sequence number this browser applied.
+const CHANGE_STORES = { products: 'inventory', sales: 'sales', expenses: 'expenses', transactions: 'transactions' };
+let pullingChanges = null;
 
-        const transactions = await fetch('/api/transactions').then(r => r.json());
+function getChangeSeq() {
+    return new Promise((resolve, reject) => {
+        const request = db.transaction(['meta'], 'readonly').objectStore('meta').get('changeSeq');
+        request.onsuccess = () => resolve(request.result ? request.result.value : 0);
+        request.onerror = () => reject(request.error);
+    });
+}
 
-        // Get sales summary
-        let salesUrl = '/api/sales-summary';
-        if (dateFilter) {
-            salesUrl += `?date=${dateFilter}`;
+// Rows and the sequence they bring the stores up to are saved together
+function applyChanges(delta) {
+    return new Promise((resolve, reject) => {
+        const transaction = db.transaction([...Object.values(CHANGE_STORES), 'meta'], 'readwrite');
+        if (delta.reset) {
+            Object.values(CHANGE_STORES).forEach(name => transaction.objectStore(name).clear());
         }
-        const salesSummary = await fetch(salesUrl).then(r => r.json());
+        Object.entries(delta.changes).forEach(([table, { upsert, delete: removed }]) => {
+            const store = transaction.objectStore(CHANGE_STORES[table]);
+            upsert.forEach(row => store.put(row));
+            removed.forEach(id => store.delete(id));
+        });
+        transaction.objectStore('meta').put({ key: 'changeSeq', value: delta.reset ? 0 : delta.seq });
 
-        // Get dashboard metrics (revenue, expenses, profit)
-        let metricsUrl = '/api/dashboard-metrics';
-        if (dateFilter) {
-            metricsUrl += `?date=${dateFilter}`;
+        transaction.oncomplete = () => resolve();
+        transaction.onerror = () => reject(transaction.error);
+    });
+}
+
+async function pullChanges() {
+    if (!db || !navigator.onLine) return;
+    if (pullingChanges) return pullingChanges;
+
+    pullingChanges = (async () => {
+        try {
+            let since = await getChangeSeq();
+            for (;;) {
+                const response = await fetch(`/api/changes?since=${since}`);
+                if (!response.ok) return;
+                const delta = await response.json();
+                await applyChanges(delta);
+                if (delta.reset) {
+                    since = 0;
+                } else if (delta.more) {
+                    since = delta.seq;
+                } else {
+                    return;
+                }
+            }
+        } catch (error) {
+            console.error('Failed to pull changes:', error);
+        } finally {
+            pullingChanges = null;
         }
-        const metrics = await fetch(metricsUrl).then(r => r.json());
+    })();
+    return pullingChanges;
+}
 
-        // Get recent sales
-        let recentSalesUrl = '/api/sales' + (dateFilter ? `?date=${dateFilter}` : '');
-        const recentSales = await fetch(recentSalesUrl).then(r => r.json());
+// --- LIVE UPDATES ---
+// While the /api/events change feed is connected, views are patched from the
+// events instead of being re-fetched after every write.
+let liveUpdates = false;
+const refreshTimers = {};
 
-        // Calculate stats
-        const totalItems = products.length;
-        const lowStock = products.filter(p => p.quantity <= p.reorder_level).length;
-        const healthyStock = totalItems - lowStock;
-        const totalUnits = products.reduce((sum, p) => sum + p.quantity, 0);
+// Without the change feed, fall back to re-fetching the affected views
+function refreshViews(...loaders) {
+    if (!liveUpdates) loaders.forEach(load => load());
+}
+
+function isPageActive(pageName) {
+    const page = document.getElementById(pageName);
+    return page && page.classList.contains('active');
+}
 
-        document.getElementById('totalItems').textContent = totalItems;
-        document.getElementById('lowStock').textContent = lowStock;
-        document.getElementById('healthyStock').textContent = healthyStock;
-        document.getElementById('totalUnits').textContent = totalUnits;
+// Debounced reload for aggregate panels that cannot be patched row by row
+function refreshSoon(pageName, loader) {
+    if (!isPageActive(pageName)) return;
+    clearTimeout(refreshTimers[pageName]);
+    refreshTimers[pageName] = setTimeout(loader, 300);
+}
+
+// Replace the row matching `selector`, or insert it when `insert` is true
+function upsertRow(tableId, selector, html, insert, prepend = true) {
+    const table = document.getElementById(tableId);
+    if (!table) return;
+    const existing = table.querySelector(selector);
+    if (existing) {
+        existing.outerHTML = html;
+        return;
+    }
+    if (!insert) return;
+    // Drop the "No ... recorded" placeholder row
+    if (table.rows.length === 1 && table.querySelector('td[colspan]')) table.innerHTML = '';
+    table.insertAdjacentHTML(prepend ? 'afterbegin' : 'beforeend', html);
+}
+
+function removeRow(tableId, selector) {
+    const table = document.getElementById(tableId);
+    const row = table && table.querySelector(selector);
+    if (row) row.remove();
+}
+
+function filterMatches(inputId, value) {
+    const input = document.getElementById(inputId);
+    return !input || !input.value || input.value === value;
+}
+
+const changeHandlers = {
+    product(product) {
+        upsertRow('inventoryTable', `tr[data-product-id="${product.id}"]`, inventoryRow(product), true, false);
+        saveToIndexedDB('inventory', product);
+        refreshSoon('dashboard', loadDashboard);
+    },
+    product_deleted({ id }) {
+        removeRow('inventoryTable', `tr[data-product-id="${id}"]`);
+        deleteFromIndexedDB('inventory', id);
+        refreshSoon('dashboard', loadDashboard);
+    },
+    transaction(tx) {
+        const type = document.getElementById('transactionType').value;
+        const matches = filterMatches('transactionDate', tx.date) && (type === 'All' || type === tx.type);
+        upsertRow('transactionsTable', `tr[data-transaction-id="${tx.id}"]`, transactionRow(tx), matches);
+        refreshSoon('dashboard', loadDashboard);
+    },
+    transaction_deleted({ id }) {
+        removeRow('transactionsTable', `tr[data-transaction-id="${id}"]`);
+        refreshSoon('dashboard', loadDashboard);
+    },
+    sale(sale) {
+        const selector = `tr[data-sale-num="${sale.sale_num}"]`;
+        upsertRow('salesTable', selector, saleRow(sale), filterMatches('salesDateFilter', sale.date));
+        upsertRow('salesRecordsTable', selector, saleRow(sale, true), filterMatches('salesRecordsDateFilter', sale.date));
+        saveToIndexedDB('sales', sale);
+        refreshSoon('dashboard', loadDashboard);
+    },
+    sale_deleted({ id }) {
+        removeRow('salesTable', `tr[data-sale-id="${id}"]`);
+        removeRow('salesRecordsTable', `tr[data-sale-id="${id}"]`);
+        deleteFromIndexedDB('sales', id);
+        refreshSoon('dashboard', loadDashboard);
+    },
+    expense(expense) {
+        upsertRow('expensesTable', `tr[data-expense-id="${expense.id}"]`, expenseRow(expense),
+            filterMatches('expenseDateFilter', expense.date));
+        saveToIndexedDB('expenses', expense);
+        refreshSoon('expenses', loadExpensesSummary);
+        refreshSoon('dashboard', loadDashboard);
+    },
+    expense_deleted({ id }) {
+        removeRow('expensesTable', `tr[data-expense-id="${id}"]`);
+        deleteFromIndexedDB('expenses', id);
+        refreshSoon('expenses', loadExpensesSummary);
+        refreshSoon('dashboard', loadDashboard);
+    }
+};
+
+function connectChangeFeed() {
+    if (!window.EventSource) return;
+
+    const source = new EventSource('/api/events');
+    let disconnected = false;
+    source.onopen = () => {
+        liveUpdates = true;
+        // EventSource reconnects by itself; anything missed meanwhile is reloaded
+        if (disconnected) {
+            disconnected = false;
+            pullChanges();
+            const page = document.querySelector('.page.active');
+            if (page) showPage(page.id);
+        }
+    };
+    source.onerror = () => {
+        liveUpdates = false;
+        disconnected = true;
+    };
+
+    Object.entries(changeHandlers).forEach(([event, handler]) => {
+        source.addEventListener(event, (e) => handler(JSON.parse(e.data)));
+    });
+
+    // Events were dropped server-side: reload the current page from scratch
+    source.addEventListener('resync', () => {
+        pullChanges();
+        const page = document.querySelector('.page.active');
+        if (page) showPage(page.id);
+    });
+}
+
+connectChangeFeed();
+
+
+// --- DASHBOARD ---
+async function loadDashboard() {
+    const dateFilter = document.getElementById('dashboardDateFilter').value || '';
+
+    try {
+        // One request, one consistent snapshot of every panel
+        const url = new URL('/api/dashboard', window.location);
+        if (dateFilter) url.searchParams.append('date', dateFilter);
+        const response = await fetch(url);
+        const dashboard = await response.json();
+        const { stock, sales: salesSummary, metrics } = dashboard;
+
+        document.getElementById('totalItems').textContent = stock.total_items;
+        document.getElementById('lowStock').textContent = stock.low_stock;
+        document.getElementById('healthyStock').textContent = stock.healthy_stock;
+        document.getElementById('totalUnits').textContent = stock.total_units;
 
         // Sales stats
         document.getElementById('todaysSales').textContent = salesSummary.total_sales || 0;
@@ -517,7 +755,7 @@ async function loadDashboard() {
         }
 
         // Low stock items
-        const lowStockItems = products.filter(p => p.quantity <= p.reorder_level);
+        const lowStockItems = dashboard.low_stock_items;
         const lowStockTable = document.getElementById('lowStockTable');
         lowStockTable.innerHTML = lowStockItems.map(item => `
             <tr>
@@ -533,7 +771,7 @@ async function loadDashboard() {
         }
 
         // Recent transactions
-        const recentTx = transactions.slice(0, 5);
+        const recentTx = dashboard.recent_transactions;
         const txTable = document.getElementById('recentTransactions');
         txTable.innerHTML = recentTx.map(tx => `
             <tr>
@@ -549,7 +787,7 @@ async function loadDashboard() {
         }
 
         // Recent sales
-        const recentSalesLimited = recentSales.slice(0, 5);
+        const recentSalesLimited = dashboard.recent_sales;
         const recentSalesTable = document.getElementById('recentSalesTable');
         recentSalesTable.innerHTML = recentSalesLimited.map(sale => {
             const statusColor = sale.payment_status.toLowerCase();
@@ -574,6 +812,28 @@ async function loadDashboard() {
 }
 
 // --- INVENTORY ---
+function inventoryRow(item) {
+    return `
+        <tr data-product-id="${item.id}">
+            <td>${item.name}</td>
+            <td>${item.brand || '-'}</td>
+            <td>${item.quantity}</td>
+            <td>${item.reorder_level}</td>
+            <td>
+                <span class="status-badge ${item.quantity <= item.reorder_level ? 'danger' : 'healthy'}">
+                    ${item.quantity <= item.reorder_level ? 'Low Stock' : 'Healthy'}
+                </span>
+            </td>
+            <td>
+                <div class="action-buttons">
+                    <button class="action-btn edit" onclick="openReorderModal('${item.name}', ${item.reorder_level})">Update</button>
+                    <button class="action-btn delete" onclick="confirmDelete(${item.id}, 'product', '${item.name}')">Delete</button>
+                </div>
+            </td>
+        </tr>
+    `;
+}
+
 async function loadInventory() {
     try {
         const response = await fetch('/api/inventory');
@@ -582,29 +842,8 @@ async function loadInventory() {
         // Save to IndexedDB
         await saveToIndexedDB('inventory', products);
 
-        // Update item suggestions
-        updateItemSuggestions(products);
-
         const table = document.getElementById('inventoryTable');
-        table.innerHTML = products.map(item => `
-            <tr>
-                <td>${item.name}</td>
-                <td>${item.brand || '-'}</td>
-                <td>${item.quantity}</td>
-                <td>${item.reorder_level}</td>
-                <td>
-                    <span class="status-badge ${item.quantity <= item.reorder_level ? 'danger' : 'healthy'}">
-                        ${item.quantity <= item.reorder_level ? 'Low Stock' : 'Healthy'}
-                    </span>
-                </td>
-                <td>
-                    <div class="action-buttons">
-                        <button class="action-btn edit" onclick="openReorderModal('${item.name}', ${item.reorder_level})">Update</button>
-                        <button class="action-btn delete" onclick="confirmDelete(${item.id}, 'product', '${item.name}')">Delete</button>
-                    </div>
-                </td>
-            </tr>
-        `).join('');
+        table.innerHTML = products.map(inventoryRow).join('');
 
         if (products.length === 0) {
             table.innerHTML = '<tr><td colspan="5" style="text-align:center; color: var(--text-secondary);">No items in inventory</td></tr>';
@@ -626,25 +865,7 @@ async function loadInventory() {
 
         const table = document.getElementById('inventoryTable');
         if (products.length > 0) {
-            table.innerHTML = products.map(item => `
-                <tr>
-                    <td>${item.name}</td>
-                    <td>${item.brand || '-'}</td>
-                    <td>${item.quantity}</td>
-                    <td>${item.reorder_level}</td>
-                    <td>
-                        <span class="status-badge ${item.quantity <= item.reorder_level ? 'danger' : 'healthy'}">
-                            ${item.quantity <= item.reorder_level ? 'Low Stock' : 'Healthy'}
-                        </span>
-                    </td>
-                    <td>
-                        <div class="action-buttons">
-                            <button class="action-btn edit" onclick="openReorderModal('${item.name}', ${item.reorder_level})">Update</button>
-                            <button class="action-btn delete" onclick="confirmDelete(${item.id}, 'product', '${item.name}')">Delete</button>
-                        </div>
-                    </td>
-                </tr>
-            `).join('');
+            table.innerHTML = products.map(inventoryRow).join('');
             showNotification('Showing cached inventory - offline mode', 'warning');
         } else {
             table.innerHTML = '<tr><td colspan="5" style="text-align:center; color: var(--text-secondary);">No cached inventory available</td></tr>';
@@ -653,7 +874,52 @@ async function loadInventory() {
     }
 }
 
-// Update item suggestions for forms
+// --- PRODUCT AUTOCOMPLETE ---
+const PRODUCT_SEARCH_LIMIT = 10;
+let productSearchTimer = null;
+
+// Ranked, size-bounded product lookup on name and brand
+async function searchProducts(q, limit = PRODUCT_SEARCH_LIMIT) {
+    const url = new URL('/api/products/search', window.location);
+    url.searchParams.append('q', q);
+    url.searchParams.append('limit', limit);
+    const response = await fetch(url);
+    return response.json();
+}
+
+// Names among ``names`` that are not products, matched exactly as the server will
+async function findMissingProducts(names) {
+    const url = new URL('/api/products/exists', window.location);
+    names.forEach(name => url.searchParams.append('name', name));
+    const response = await fetch(url);
+    const result = await response.json();
+    if (!result.success) throw new Error(result.error || 'Product lookup failed');
+    return result.missing;
+}
+
+// Refresh the datalist behind whichever item-name input is being typed in
+document.addEventListener('input', (e) => {
+    const input = e.target;
+    const listId = input.getAttribute ? input.getAttribute('list') : null;
+    if (listId !== 'itemSuggestions' && listId !== 'saleItemSuggestions') return;
+
+    const q = input.value.trim();
+    clearTimeout(productSearchTimer);
+    if (!q) return;
+
+    productSearchTimer = setTimeout(async () => {
+        try {
+            const products = await searchProducts(q);
+            const list = document.getElementById(listId);
+            if (list) list.innerHTML = products.map(p => `<option value="${p.name}">`).join('');
+        } catch (error) {
+            // Offline: keep the suggestions filled from the IndexedDB cache
+            console.warn('Product search unavailable:', error);
+        }
+    }, 150);
+});
+
+// Fill item suggestions from a full product list (offline fallback)
 function updateItemSuggestions(products) {
     const itemNames = products.map(p => p.name);
 
@@ -708,8 +974,7 @@ async function handleEntrySubmit(e) {
             showNotification(result.message, 'success');
             document.getElementById('entryForm').reset();
             if (brandEl) brandEl.value = '';
-            loadInventory();
-            loadDashboard();
+            refreshViews(loadInventory, loadDashboard);
         } else {
             showNotification(result.error, 'error');
         }
@@ -752,7 +1017,7 @@ document.getElementById('reorderForm').addEventListener('submit', async (e) => {
         if (result.success) {
             showNotification('Reorder level updated', 'success');
             document.getElementById('reorderForm').reset();
-            loadInventory();
+            refreshViews(loadInventory);
         } else {
             showNotification('Error updating reorder level', 'error');
         }
@@ -773,6 +1038,23 @@ document.getElementById('reorderForm').addEventListener('submit', async (e) => {
 });
 
 // --- TRANSACTIONS ---
+function transactionRow(tx) {
+    return `
+        <tr data-transaction-id="${tx.id}">
+            <td>${tx.date}</td>
+            <td>${tx.time}</td>
+            <td>${tx.item_name}</td>
+            <td>${tx.quantity}</td>
+            <td><span class="status-badge ${tx.type === 'Intake' ? 'success' : 'warning'}">${tx.type}</span></td>
+            <td>
+                <div class="action-buttons">
+                    <button class="action-btn delete" onclick="confirmDelete(${tx.id}, 'transaction', '${tx.item_name}')">Delete</button>
+                </div>
+            </td>
+        </tr>
+    `;
+}
+
 async function loadTransactions() {
     const date = document.getElementById('transactionDate').value;
     const type = document.getElementById('transactionType').value;
@@ -782,24 +1064,10 @@ async function loadTransactions() {
         if (date) url.searchParams.append('date', date);
         if (type !== 'All') url.searchParams.append('type', type);
 
-        const response = await fetch(url);
-        const transactions = await response.json();
+        const transactions = await fetchAllPages(url);
 
         const table = document.getElementById('transactionsTable');
-        table.innerHTML = transactions.map(tx => `
-            <tr>
-                <td>${tx.date}</td>
-                <td>${tx.time}</td>
-                <td>${tx.item_name}</td>
-                <td>${tx.quantity}</td>
-                <td><span class="status-badge ${tx.type === 'Intake' ? 'success' : 'warning'}">${tx.type}</span></td>
-                <td>
-                    <div class="action-buttons">
-                        <button class="action-btn delete" onclick="confirmDelete(${tx.id}, 'transaction', '${tx.item_name}')">Delete</button>
-                    </div>
-                </td>
-            </tr>
-        `).join('');
+        table.innerHTML = transactions.map(transactionRow).join('');
 
         if (transactions.length === 0) {
             table.innerHTML = '<tr><td colspan="6" style="text-align:center; color: var(--text-secondary);">No transactions found</td></tr>';
@@ -840,8 +1108,8 @@ document.getElementById('invoiceForm').addEventListener('submit', async (e) => {
 
             // Download the PDF
             const link = document.createElement('a');
-            link.href = `/download/${result.file}`;
-            link.download = result.file;
+            link.href = result.url;
+            link.download = `${result.invoice_num}.pdf`;
             link.click();
         } else {
             showNotification(result.error, 'error');
@@ -890,7 +1158,7 @@ document.getElementById('quickReorderForm').addEventListener('submit', async (e)
         if (result.success) {
             showNotification('Reorder level updated', 'success');
             modal.classList.remove('show');
-            loadInventory();
+            refreshViews(loadInventory);
         }
     } catch (error) {
         showNotification('Error updating reorder level', 'error');
@@ -1203,9 +1471,7 @@ async function handleExpenseSubmit(e) {
         if (result.success) {
             showNotification(result.message, 'success');
             document.getElementById('expenseForm').reset();
-            loadExpenses();
-            loadExpensesSummary();
-            loadDashboard();
+            refreshViews(loadExpenses, loadExpensesSummary, loadDashboard);
         } else {
             showNotification(result.error, 'error');
         }
@@ -1223,6 +1489,23 @@ async function handleExpenseSubmit(e) {
     }
 }
 
+function expenseRow(expense) {
+    return `
+        <tr data-expense-id="${expense.id}">
+            <td>${expense.date}</td>
+            <td>${expense.description}</td>
+            <td><span class="status-badge healthy">${expense.category}</span></td>
+            <td><strong>₦${parseFloat(expense.amount).toLocaleString('en-NG', { minimumFractionDigits: 2, maximumFractionDigits: 2 })}</strong></td>
+            <td>${expense.notes || '-'}</td>
+            <td>
+                <div class="action-buttons">
+                    <button class="action-btn delete" onclick="confirmDeleteExpense(${expense.id})">Delete</button>
+                </div>
+            </td>
+        </tr>
+    `;
+}
+
 async function loadExpenses() {
     let dateFilter = document.getElementById('expenseDateFilter').value;
 
@@ -1239,27 +1522,13 @@ async function loadExpenses() {
             url += `?date=${dateFilter}`;
         }
 
-        const response = await fetch(url);
-        const expenses = await response.json();
+        const expenses = await fetchAllPages(url);
 
         // Cache expenses data
         await saveToIndexedDB('expenses', expenses);
 
         const table = document.getElementById('expensesTable');
-        table.innerHTML = expenses.map(expense => `
-            <tr>
-                <td>${expense.date}</td>
-                <td>${expense.description}</td>
-                <td><span class="status-badge healthy">${expense.category}</span></td>
-                <td><strong>₦${parseFloat(expense.amount).toLocaleString('en-NG', { minimumFractionDigits: 2, maximumFractionDigits: 2 })}</strong></td>
-                <td>${expense.notes || '-'}</td>
-                <td>
-                    <div class="action-buttons">
-                        <button class="action-btn delete" onclick="confirmDeleteExpense(${expense.id})">Delete</button>
-                    </div>
-                </td>
-            </tr>
-        `).join('');
+        table.innerHTML = expenses.map(expenseRow).join('');
 
         if (expenses.length === 0) {
             table.innerHTML = '<tr><td colspan="6" style="text-align:center; color: var(--text-secondary);">No expenses recorded</td></tr>';
@@ -1271,20 +1540,7 @@ async function loadExpenses() {
 
         const table = document.getElementById('expensesTable');
         if (expenses.length > 0) {
-            table.innerHTML = expenses.map(expense => `
-                <tr>
-                    <td>${expense.date}</td>
-                    <td>${expense.description}</td>
-                    <td><span class="status-badge healthy">${expense.category}</span></td>
-                    <td><strong>₦${parseFloat(expense.amount).toLocaleString('en-NG', { minimumFractionDigits: 2, maximumFractionDigits: 2 })}</strong></td>
-                    <td>${expense.notes || '-'}</td>
-                    <td>
-                        <div class="action-buttons">
-                            <button class="action-btn delete" onclick="confirmDeleteExpense(${expense.id})">Delete</button>
-                        </div>
-                    </td>
-                </tr>
-            `).join('');
+            table.innerHTML = expenses.map(expenseRow).join('');
             showNotification('Showing cached expenses - offline mode', 'warning');
         } else {
             table.innerHTML = '<tr><td colspan="6" style="text-align:center; color: var(--text-secondary);">No cached expenses available</td></tr>';
@@ -1382,20 +1638,13 @@ document.getElementById('confirmBtn').addEventListener('click', async () => {
 
             // Reload appropriate data
             if (deleteData.type === 'product') {
-                loadInventory();
-                loadDashboard();
+                refreshViews(loadInventory, loadDashboard);
             } else if (deleteData.type === 'transaction') {
-                loadTransactions();
-                loadInventory();
-                loadDashboard();
+                refreshViews(loadTransactions, loadInventory, loadDashboard);
             } else if (deleteData.type === 'expense') {
-                loadExpenses();
-                loadExpensesSummary();
+                refreshViews(loadExpenses, loadExpensesSummary);
             } else if (deleteData.type === 'sale') {
-                loadSalesHistory();
-                loadSalesRecords();
-                loadInventory();
-                loadDashboard();
+                refreshViews(loadSalesHistory, loadSalesRecords, loadInventory, loadDashboard);
             }
         } else {
             showNotification(result.error || 'Error deleting item', 'error');
@@ -1508,12 +1757,13 @@ document.getElementById('saleForm').addEventListener('submit', async (e) => {
         return;
     }
 
-    // Get inventory to validate items
-    let inventoryItems = [];
+    // Validate every item name in one exact-name lookup
+    let missingItems;
     try {
-        const inventoryResponse = await fetch('/api/inventory');
-        const inventoryData = await inventoryResponse.json();
-        inventoryItems = inventoryData.map(p => p.name.toLowerCase());
+        const names = [...new Set(Array.from(document.querySelectorAll('.sale-item-row .item-name'))
+            .map(el => el.value.trim())
+            .filter(name => name))];
+        missingItems = new Set(names.length ? await findMissingProducts(names) : []);
     } catch (error) {
         console.error('Error fetching inventory:', error);
         showNotification('Error validating items', 'error');
@@ -1530,7 +1780,7 @@ document.getElementById('saleForm').addEventListener('submit', async (e) => {
 
         if (name && qty > 0 && price >= 0) {
             // Check if item exists in inventory
-            if (!inventoryItems.includes(name.toLowerCase())) {
+            if (missingItems.has(name)) {
                 invalidItem = name;
             }
             items.push({ name, quantity: qty, price });
@@ -1595,9 +1845,7 @@ document.getElementById('saleForm').addEventListener('submit', async (e) => {
             });
 
             updateSaleSummary();
-            loadSalesHistory();
-            loadInventory();
-            loadDashboard();
+            refreshViews(loadSalesHistory, loadInventory, loadDashboard);
         } else {
             showNotification(result.error, 'error');
         }
@@ -1615,6 +1863,32 @@ document.getElementById('saleForm').addEventListener('submit', async (e) => {
     }
 });
 
+// Sale rows; the sales records table also gets a delete button
+function saleRow(sale, withDelete = false) {
+    const statusColor = sale.payment_status.toLowerCase();
+    return `
+        <tr data-sale-num="${sale.sale_num}" data-sale-id="${sale.id}">
+            <td><strong>${sale.sale_num}</strong></td>
+            <td>${sale.customer}</td>
+            <td>${sale.date}</td>
+            <td>₦${parseFloat(sale.total_amount).toFixed(2)}</td>
+            <td>
+                <span class="payment-status-badge ${statusColor}">
+                    ${sale.payment_status}
+                </span>
+            </td>
+            <td>
+                <div class="action-buttons">
+                    <button class="action-btn edit" onclick="viewSaleDetails('${sale.sale_num}')">View</button>
+                    ${sale.payment_status === 'Credit' ? `<button class="action-btn success" onclick="quickUpdateStatus('${sale.sale_num}', 'Paid')">Mark Paid</button>` : ''}
+                    ${sale.payment_status === 'Pending' ? `<button class="action-btn success" onclick="quickUpdateStatus('${sale.sale_num}', 'Paid')">Mark Paid</button>` : ''}
+                    ${withDelete ? `<button class="action-btn delete" onclick="confirmDeleteSale('${sale.sale_num}')">Delete</button>` : ''}
+                </div>
+            </td>
+        </tr>
+    `;
+}
+
 async function loadSalesHistory() {
     try {
         let dateFilter = '';
@@ -1635,36 +1909,13 @@ async function loadSalesHistory() {
             url += `?date=${dateFilter}`;
         }
 
-        const response = await fetch(url);
-        const sales = await response.json();
+        const sales = await fetchAllPages(url);
 
         // Cache sales data
         await saveToIndexedDB('sales', sales);
 
         const table = document.getElementById('salesTable');
-        table.innerHTML = sales.map(sale => {
-            const statusColor = sale.payment_status.toLowerCase();
-            return `
-                <tr>
-                    <td><strong>${sale.sale_num}</strong></td>
-                    <td>${sale.customer}</td>
-                    <td>${sale.date}</td>
-                    <td>₦${parseFloat(sale.total_amount).toFixed(2)}</td>
-                    <td>
-                        <span class="payment-status-badge ${statusColor}">
-                            ${sale.payment_status}
-                        </span>
-                    </td>
-                    <td>
-                        <div class="action-buttons">
-                            <button class="action-btn edit" onclick="viewSaleDetails('${sale.sale_num}')">View</button>
-                            ${sale.payment_status === 'Credit' ? `<button class="action-btn success" onclick="quickUpdateStatus('${sale.sale_num}', 'Paid')">Mark Paid</button>` : ''}
-                            ${sale.payment_status === 'Pending' ? `<button class="action-btn success" onclick="quickUpdateStatus('${sale.sale_num}', 'Paid')">Mark Paid</button>` : ''}
-                        </div>
-                    </td>
-                </tr>
-            `;
-        }).join('');
+        table.innerHTML = sales.map(sale => saleRow(sale)).join('');
 
         if (sales.length === 0) {
             table.innerHTML = '<tr><td colspan="6" style="text-align:center; color: var(--text-secondary);">No sales recorded</td></tr>';
@@ -1676,29 +1927,7 @@ async function loadSalesHistory() {
 
         const table = document.getElementById('salesTable');
         if (sales.length > 0) {
-            table.innerHTML = sales.map(sale => {
-                const statusColor = sale.payment_status.toLowerCase();
-                return `
-                    <tr>
-                        <td><strong>${sale.sale_num}</strong></td>
-                        <td>${sale.customer}</td>
-                        <td>${sale.date}</td>
-                        <td>₦${parseFloat(sale.total_amount).toFixed(2)}</td>
-                        <td>
-                            <span class="payment-status-badge ${statusColor}">
-                                ${sale.payment_status}
-                            </span>
-                        </td>
-                        <td>
-                            <div class="action-buttons">
-                                <button class="action-btn edit" onclick="viewSaleDetails('${sale.sale_num}')">View</button>
-                                ${sale.payment_status === 'Credit' ? `<button class="action-btn success" onclick="quickUpdateStatus('${sale.sale_num}', 'Paid')">Mark Paid</button>` : ''}
-                                ${sale.payment_status === 'Pending' ? `<button class="action-btn success" onclick="quickUpdateStatus('${sale.sale_num}', 'Paid')">Mark Paid</button>` : ''}
-                            </div>
-                        </td>
-                    </tr>
-                `;
-            }).join('');
+            table.innerHTML = sales.map(sale => saleRow(sale)).join('');
             showNotification('Showing cached sales - offline mode', 'warning');
         } else {
             table.innerHTML = '<tr><td colspan="6" style="text-align:center; color: var(--text-secondary);">No cached sales available</td></tr>';
@@ -1726,34 +1955,10 @@ async function loadSalesRecords() {
             url += `?date=${dateFilter}`;
         }
 
-        const response = await fetch(url);
-        const sales = await response.json();
+        const sales = await fetchAllPages(url);
 
         const table = document.getElementById('salesRecordsTable');
-        table.innerHTML = sales.map(sale => {
-            const statusColor = sale.payment_status.toLowerCase();
-            return `
-                <tr>
-                    <td><strong>${sale.sale_num}</strong></td>
-                    <td>${sale.customer}</td>
-                    <td>${sale.date}</td>
-                    <td>₦${parseFloat(sale.total_amount).toFixed(2)}</td>
-                    <td>
-                        <span class="payment-status-badge ${statusColor}">
-                            ${sale.payment_status}
-                        </span>
-                    </td>
-                    <td>
-                        <div class="action-buttons">
-                            <button class="action-btn edit" onclick="viewSaleDetails('${sale.sale_num}')">View</button>
-                            ${sale.payment_status === 'Credit' ? `<button class="action-btn success" onclick="quickUpdateStatus('${sale.sale_num}', 'Paid')">Mark Paid</button>` : ''}
-                            ${sale.payment_status === 'Pending' ? `<button class="action-btn success" onclick="quickUpdateStatus('${sale.sale_num}', 'Paid')">Mark Paid</button>` : ''}
-                            <button class="action-btn delete" onclick="confirmDeleteSale('${sale.sale_num}')">Delete</button>
-                        </div>
-                    </td>
-                </tr>
-            `;
-        }).join('');
+        table.innerHTML = sales.map(sale => saleRow(sale, true)).join('');
 
         if (sales.length === 0) {
             table.innerHTML = '<tr><td colspan="6" style="text-align:center; color: var(--text-secondary);">No sales recorded</td></tr>';
@@ -1819,21 +2024,12 @@ function closeSaleDetailsModal() {
 async function downloadSaleInvoice() {
     if (!currentSaleNum) return;
 
-    try {
-        const response = await fetch(`/api/generate-sale-invoice/${currentSaleNum}`);
-        const result = await response.json();
-
-        if (result.success) {
-            const link = document.createElement('a');
-            link.href = `/download/${result.file}`;
-            link.download = result.file;
-            link.click();
-            showNotification('Invoice downloaded', 'success');
-        }
-    } catch (error) {
-        console.error('Error:', error);
-        showNotification('Error downloading invoice', 'error');
-    }
+    // Rendered on demand and streamed back as an attachment
+    const link = document.createElement('a');
+    link.href = `/api/invoice/${encodeURIComponent(currentSaleNum)}`;
+    link.download = `${currentSaleNum}.pdf`;
+    link.click();
+    showNotification('Invoice downloaded', 'success');
 }
 
 function openUpdateStatusModal() {
@@ -1867,8 +2063,7 @@ document.getElementById('updateStatusForm').addEventListener('submit', async (e)
             showNotification(result.message, 'success');
             closeUpdateStatusModal();
             closeSaleDetailsModal();
-            loadSalesHistory();
-            loadDashboard();
+            refreshViews(loadSalesHistory, loadDashboard);
         } else {
             showNotification(result.error, 'error');
         }
@@ -1890,8 +2085,7 @@ async function quickUpdateStatus(saleNum, newStatus) {
 
         if (result.success) {
             showNotification(result.message, 'success');
-            loadSalesHistory();
-            loadDashboard();
+            refreshViews(loadSalesHistory, loadDashboard);
         } else {
             showNotification(result.error, 'error');
         }
@@ -1910,33 +2104,10 @@ document.getElementById('searchSalesBtn').addEventListener('click', async () =>
         if (customer) url.searchParams.append('customer', customer);
         if (date) url.searchParams.append('date', date);
 
-        const response = await fetch(url);
-        const sales = await response.json();
+        const sales = await fetchAllPages(url);
 
         const table = document.getElementById('salesTable');
-        table.innerHTML = sales.map(sale => {
-            const statusColor = sale.payment_status.toLowerCase();
-            return `
-                <tr>
-                    <td><strong>${sale.sale_num}</strong></td>
-                    <td>${sale.customer}</td>
-                    <td>${sale.date}</td>
-                    <td>₦${parseFloat(sale.total_amount).toFixed(2)}</td>
-                    <td>
-                        <span class="payment-status-badge ${statusColor}">
-                            ${sale.payment_status}
-                        </span>
-                    </td>
-                    <td>
-                        <div class="action-buttons">
-                            <button class="action-btn edit" onclick="viewSaleDetails('${sale.sale_num}')">View</button>
-                            ${sale.payment_status === 'Credit' ? `<button class="action-btn success" onclick="quickUpdateStatus('${sale.sale_num}', 'Paid')">Mark Paid</button>` : ''}
-                            ${sale.payment_status === 'Pending' ? `<button class="action-btn success" onclick="quickUpdateStatus('${sale.sale_num}', 'Paid')">Mark Paid</button>` : ''}
-                        </div>
-                    </td>
-                </tr>
-            `;
-        }).join('');
+        table.innerHTML = sales.map(sale => saleRow(sale)).join('');
 
         if (sales.length === 0) {
             table.innerHTML = '<tr><td colspan="6" style="text-align:center; color: var(--text-secondary);">No sales found</td></tr>';
@@ -1950,3 +2121,21 @@ document.getElementById('searchSalesBtn').addEventListener('click', async () =>
 document.getElementById('filterSalesRecordsBtn').addEventListener('click', () => {
     loadSalesRecords();
 });
+
+document.getElementById('exportInvoicesBtn').addEventListener('click', () => {
+    const start = document.getElementById('exportStartDate').value;
+    const end = document.getElementById('exportEndDate').value || start;
+    const format = document.getElementById('exportFormat').value;
+    if (!start) {
+        showNotification('Choose the first day to export', 'error');
+        return;
+    }
+
+    // Streamed by the server as it renders, so the browser handles the download
+    const params = new URLSearchParams({ start, end, format });
+    const link = document.createElement('a');
+    link.href = `/api/invoices/export?${params}`;
+    link.download = `invoices-${start}-to-${end}.${format}`;
+    link.click();
+    showNotification('Export started', 'info');
+});
@@ -1,5 +1,6 @@
 const CACHE_NAME = 'inventory-app-v1';
 const API_CACHE_NAME = 'inventory-app-api-v1';
+const UNCACHED_API_PATHS = ['/api/changes', '/api/events', '/api/invoices/export'];
 const urlsToCache = [
     '/',
     '/static/style.css',
@@ -46,8 +47,11 @@ async function handleApiRequest(request) {
     try {
         const response = await fetch(request);
         
-        // Cache successful GET requests
-        if (response.ok && request.method === 'GET') {
+        // Cache successful GET requests, except the change feeds and exports:
+        // /api/changes is unique per sequence number, /api/events never ends
+        // and an invoice export can run to many megabytes
+        const path = new URL(request.url).pathname;
+        if (response.ok && request.method === 'GET' && !UNCACHED_API_PATHS.includes(path)) {
             const cache = await caches.open(API_CACHE_NAME);
             cache.put(request, response.clone());
         }
@@ -0,0 +1,117 @@
+"""Stock mutations shared by every route that moves inventory.
+
+All changes go through guarded single-statement updates, so a quantity is
+never read into Python and written back: concurrent terminals cannot lose
+each other's updates, and a decrement that would go below zero simply
+matches no row.
+"""
+import sqlite3
+import time
+
+WRITE_RETRIES = 3
+WRITE_BACKOFF = 0.05  # seconds, doubled per attempt
+
+
+class StockConflict(Exception):
+    """One or more decrements would have taken stock below zero."""
+
+    def __init__(self, names):
+        super().__init__(f"Insufficient stock for {', '.join(names)}")
+        self.names = names
+
+
+def begin_write(conn, retries=WRITE_RETRIES, backoff=WRITE_BACKOFF):
+    """Open a write transaction, retrying a bounded number of times while locked.
+
+    Each attempt already waits up to the connection's busy_timeout; the
+    retries only cover a writer that holds the lock longer than that.
+    """
+    for attempt in range(retries + 1):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            return
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) or attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+def read_stock(cursor, names):
+    """{name: quantity} for those of ``names`` that are in the catalogue."""
+    stock = {}
+    for start in range(0, len(names), 500):
+        batch = names[start:start + 500]
+        cursor.execute(f"SELECT name, quantity FROM products WHERE name IN ({','.join('?' * len(batch))})", batch)
+        stock.update(cursor.fetchall())
+    return stock
+
+
+def adjust_stock(conn, changes):
+    """Apply ``changes`` ({name: delta}) inside the caller's write transaction.
+
+    Returns the names that are not in the catalogue (left untouched). Raises
+    StockConflict, naming every offender, if any update would leave a
+    negative quantity; the caller must then roll back. One read and one
+    batched guarded update, however many names there are.
+    """
+    changes = {name: delta for name, delta in changes.items() if delta}
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    names = list(changes)
+    stock = read_stock(cursor, names)
+    missing = [name for name in names if name not in stock]
+    refused = [name for name in names if name in stock and stock[name] + changes[name] < 0]
+    if refused:
+        raise StockConflict(refused)
+    updates = [(delta, name, delta) for name, delta in changes.items() if name in stock]
+    if not updates:
+        return missing
+    cursor.executemany("UPDATE products SET quantity = quantity + ? WHERE name = ? AND quantity + ? >= 0", updates)
+    if cursor.rowcount != len(updates):
+        # Cannot happen while we hold the write lock; refuse rather than drift
+        raise StockConflict([name for delta, name, _ in updates])
+    return missing
+
+
+def apply_entries(conn, entries, date_str, time_str):
+    """Apply (name, quantity, type, brand) entries, in order, in the caller's write transaction.
+
+    Each entry is checked against the stock it would see at its point in the
+    batch, read once under the write lock, so one bad row is skipped without
+    affecting the rest. Intakes of unknown items create the product. Returns
+    ``(transaction_ids, names, errors)`` where ``errors`` is a list of
+    ``(index, message)`` for the skipped entries.
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    names = list(dict.fromkeys(entry[0] for entry in entries))
+    stock = read_stock(cursor, names)
+
+    new_products, deltas, ledger, errors = {}, {}, [], []
+    for index, (name, qty, entry_type, brand) in enumerate(entries):
+        if name not in stock:
+            if entry_type != 'Intake':
+                errors.append((index, 'Item does not exist in stock'))
+                continue
+            new_products[name] = brand
+            stock[name] = 0
+        change = qty if entry_type == 'Intake' else -qty
+        if stock[name] + change < 0:
+            errors.append((index, 'Insufficient stock'))
+            continue
+        stock[name] += change
+        deltas[name] = deltas.get(name, 0) + change
+        ledger.append((name, qty, entry_type, date_str, time_str))
+
+    cursor.executemany("INSERT INTO products (name, quantity, reorder_level, brand) VALUES (?, 0, 5, ?)",
+                       new_products.items())
+    changes = [(delta, name, delta) for name, delta in deltas.items() if delta]
+    cursor.executemany("UPDATE products SET quantity = quantity + ? WHERE name = ? AND quantity + ? >= 0", changes)
+    if cursor.rowcount != len(changes):
+        # Cannot happen while we hold the write lock; refuse rather than drift
+        raise StockConflict([name for delta, name, _ in changes])
+    cursor.executemany("INSERT INTO transactions (item_name, quantity, type, date, time) VALUES (?,?,?,?,?)", ledger)
+    # The ledger rows were inserted back to back under the write lock
+    last_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+    transaction_ids = list(range(last_id - len(ledger) + 1, last_id + 1)) if ledger else []
+    return transaction_ids, list(deltas), errors